@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+from __future__ import annotations
+import argparse, json, random, tempfile, time
+from contrakg.eval import TypeOracle, score_prediction
+from contrakg.hierarchy import ClassHierarchy
+from contrakg.vectorized import VectorizedScorer
+
+# Python vs NumPy scoring on synthetic preds; the oracle answers from a local hierarchy,
+# so no network is involved. Prints one JSON record.
+
+def synth(n_triples: int, n_ents: int, n_pids: int, n_classes: int, seed: int):
+    rng = random.Random(seed)
+    classes = [f"Q{9_000_000 + i}" for i in range(n_classes)]
+    root = "Q8999999"
+    parents = {c: [classes[i // 2] if i else root] for i, c in enumerate(classes)}
+    parents[root] = []
+    constraints = {}
+    for i in range(n_pids):
+        p = f"P{i + 1}"
+        tc = lambda: [{"constraint_qid": "Q0", "classes": rng.sample(classes, 2), "relation": None, "status": None,
+                       "exceptions": [f"Q{rng.randrange(n_ents)}" for _ in range(3)]}]
+        constraints[p] = {"pid": p, "subject_type": tc() if i % 3 else [], "value_type": tc(),
+                          "single_value": i % 2 == 0, "single_value_status": None, "single_value_exceptions": []}
+    types = {f"Q{i}": rng.sample(classes, rng.randint(0, 2)) for i in range(n_ents)}
+    preds, t = [], 0
+    while t < n_triples:
+        p = f"P{rng.randrange(n_pids) + 1}"
+        k = rng.choice([0, 1, 1, 2, 3])
+        s = f"Q{rng.randrange(n_ents)}"
+        triples = [{"subj": s if rng.random() < 0.7 else f"Q{rng.randrange(n_ents)}", "pid": p,
+                    "obj": f"Q{rng.randrange(n_ents)}"} for _ in range(k)]
+        preds.append({"id": f"r{len(preds)}", "test_type": "value_type_violation", "pid": p, "triples": triples})
+        t += k
+    return constraints, types, parents, preds
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--triples", type=int, default=1_000_000)
+    ap.add_argument("--ents", type=int, default=200_000)
+    ap.add_argument("--pids", type=int, default=300)
+    ap.add_argument("--classes", type=int, default=500)
+    ap.add_argument("--chunk_size", type=int, default=200_000)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    constraints, types, parents, preds = synth(args.triples, args.ents, args.pids, args.classes, args.seed)
+    hierarchy = ClassHierarchy(parents).precompute()
+    with tempfile.TemporaryDirectory() as tmp:
+        t0 = time.perf_counter()
+        oracle = TypeOracle(cache_dir=tmp, hierarchy=hierarchy, types=types)
+        ref = [score_prediction(pr, constraints, oracle, types) for pr in preds]
+        t_py = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        oracle = TypeOracle(cache_dir=tmp, hierarchy=hierarchy, types=types)
+        scorer = VectorizedScorer(constraints, types, oracle)
+        got = [row for i in range(0, len(preds), args.chunk_size) for row in scorer.score_rows(preds[i:i+args.chunk_size])]
+        t_np = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        oracle = TypeOracle(cache_dir=tmp, hierarchy=hierarchy, types=types)
+        scorer = VectorizedScorer(constraints, types, oracle)
+        for i in range(0, len(preds), args.chunk_size):
+            scorer.score(preds[i:i+args.chunk_size])
+        t_flags = time.perf_counter() - t0
+
+    assert got == ref, "vectorized results differ from the per-triple functions"
+    print(json.dumps({
+        "triples": sum(len(p["triples"]) for p in preds),
+        "rows": len(preds),
+        "python_s": round(t_py, 3),
+        "vectorized_s": round(t_np, 3),
+        "vectorized_flags_s": round(t_flags, 3),
+        "speedup": round(t_py / t_np, 2) if t_np else None,
+        "speedup_flags": round(t_py / t_flags, 2) if t_flags else None,
+    }))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+from __future__ import annotations
+import argparse, json, re, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from synth import SynthWorld
+from contrakg.constraints import Q_SINGLE_VALUE
+
+# Local stand-in for WDQS that answers the query shapes contrakg sends (labels + P31, P279
+# edges, ASK and batched type checks, type pools, P2302 constraints) from a SynthWorld.
+# Point scripts at it with --endpoint http://127.0.0.1:<port>/sparql.
+
+E = "http://www.wikidata.org/entity/"
+_QIDS = re.compile(r"wd:(Q\d+)")
+
+def _uri(q: str) -> Dict[str, str]:
+    return {"type": "uri", "value": E + q}
+
+def _ent(world: SynthWorld, q: str) -> int:
+    i = int(q[1:])
+    return i if 1 <= i <= world.n_ents else 0
+
+def answer(world: SynthWorld, q: str) -> Dict[str, Any]:
+    if q.lstrip().startswith("ASK"):
+        x, c = _QIDS.findall(q)[:2]
+        return {"head": {}, "boolean": world.is_a(x, c)}
+    if "VALUES (?x ?c)" in q:
+        pairs = re.findall(r"\(wd:(Q\d+) wd:(Q\d+)\)", q)
+        return {"results": {"bindings": [{"x": _uri(x), "c": _uri(c)} for x, c in pairs if world.is_a(x, c)]}}
+    if "P2302" in q:
+        rows = []
+        for p in re.findall(r"wd:P(\d+)", q):
+            c = world.constraint(int(p)) if 1 <= int(p) <= world.n_pids else None
+            if c is None:
+                continue
+            for role in ("subject_type", "value_type"):
+                for tc in c[role]:
+                    for cls in tc["classes"]:
+                        for ex in tc["exceptions"] or [None]:
+                            r = {"p": _uri(f"P{p}"), "constraint": _uri(tc["constraint_qid"]), "class": _uri(cls),
+                                 "status": _uri(tc["status"])}
+                            if ex:
+                                r["exception"] = _uri(ex)
+                            rows.append(r)
+            if c["single_value"]:
+                rows.append({"p": _uri(f"P{p}"), "constraint": _uri(Q_SINGLE_VALUE), "status": _uri(c["single_value_status"])})
+        return {"results": {"bindings": rows}}
+    if "wdt:P279 ?p" in q:
+        rows = []
+        for c in _QIDS.findall(q):
+            rows += [{"c": _uri(c), "p": _uri(p)} for p in world.parents(c)] or [{"c": _uri(c)}]
+        return {"results": {"bindings": rows}}
+    if "LIMIT" in q and "wdt:P31/wdt:P279*" in q:
+        rows = []
+        for m in re.finditer(r"wd:(Q\d+) \.\s*\}\s*LIMIT (\d+)", q):
+            rows += [{"x": _uri(x), "c": _uri(m.group(1))} for x in world.pool(m.group(1), int(m.group(2)))]
+        return {"results": {"bindings": rows}}
+    vals = re.search(r"VALUES \?x \{([^}]*)\}", q)
+    rows = []
+    for x in _QIDS.findall(vals.group(1)) if vals else []:
+        i = _ent(world, x)
+        base = {"x": _uri(x)}
+        if "xLabel" in q:
+            base["xLabel"] = {"type": "literal", "value": world.label(i) if i else x}
+        ts = world.types(i) if i and "?t" in q else []
+        rows += [{**base, "t": _uri(t)} for t in ts] or [base]
+    return {"results": {"bindings": rows}}
+
+def start(world: SynthWorld, port: int=0, fail_every: int=0) -> Tuple[ThreadingHTTPServer, str]:
+    # fail_every=N answers every Nth request with 429 (Retry-After: 0) to exercise retries.
+    state = {"n": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *a):
+            pass
+
+        def do_GET(self):
+            q = parse_qs(urlparse(self.path).query).get("query", [""])[0]
+            with lock:
+                state["n"] += 1
+                n = state["n"]
+            if fail_every and n % fail_every == 0:
+                self.send_response(429)
+                self.send_header("Retry-After", "0")
+                self.end_headers()
+                return
+            body = json.dumps(answer(world, q)).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/sparql-results+json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    srv = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    srv.daemon_threads = True
+    srv.requests_served = state
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv, f"http://127.0.0.1:{srv.server_address[1]}/sparql"
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--rows", type=int, default=100_000, help="size the world like run_benchmarks.py --rows")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--fail_every", type=int, default=0)
+    args = ap.parse_args()
+    srv, url = start(SynthWorld.for_rows(args.rows, args.seed), args.port, args.fail_every)
+    print(f"[OK] serving {url}", flush=True)
+    threading.Event().wait()
+
+if __name__ == "__main__":
+    main()
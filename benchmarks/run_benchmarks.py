@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+from __future__ import annotations
+import argparse, datetime, json, os, platform, random, subprocess, sys, tempfile, time, tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from synth import SynthWorld, load_json
+from contrakg.constraints import ConstraintIndex, fetch_constraints
+from contrakg.contrast import (CandidateIndex, TypePoolIndex, build_type_pools, constraint_classes, make_contrasts,
+                               make_range_violation, make_single_value_violation, make_subject_violation)
+from contrakg.eval import (EVAL_COLUMNS, LeakageSummary, TypeOracle, score_predictions, violates_single_value,
+                           violates_subject_type, violates_value_type)
+from contrakg.hierarchy import ClassHierarchy
+from contrakg.io_utils import CsvRowWriter, iter_chunks, read_jsonl, write_jsonl
+from contrakg.predictors import CopyGoldPredictor, StringMatchPredictor
+from contrakg.wikidata import SparqlClient
+
+# Times every pipeline stage on a deterministic synthetic dataset and records peak traced
+# memory (a second pass under tracemalloc, so timings are not skewed by it). WDQS stages run
+# against the local stand-in in fake_wdqs.py. Writes one JSON document; --compare prints
+# per-stage ratios against an earlier one.
+
+CHUNK = 50_000
+
+def parse_rows(s: str) -> int:
+    s = s.strip().lower().replace("_", "")
+    mult = {"k": 1_000, "m": 1_000_000}.get(s[-1:], 1)
+    return int(float(s[:-1] if mult > 1 else s) * mult)
+
+class Ctx:
+    def __init__(self, world: SynthWorld, rows: int, work: Path, per_class: int, seed: int):
+        self.world, self.rows, self.work, self.per_class, self.seed = world, rows, work, per_class, seed
+        self.paths: Dict[str, str] = {}
+        self.endpoint: Optional[str] = None
+
+    def path(self, name: str) -> str:
+        return str(self.work / name)
+
+def _timed_chunks(path: str, fn: Callable[[List[Dict[str, Any]]], Any]) -> Tuple[int, float]:
+    # Time only fn, not the JSONL parsing around it.
+    rows, spent = 0, 0.0
+    for chunk in iter_chunks(read_jsonl(path), CHUNK):
+        t0 = time.perf_counter()
+        fn(chunk)
+        spent += time.perf_counter() - t0
+        rows += len(chunk)
+    return rows, spent
+
+# --- stages: each returns rows processed, optionally (rows, seconds, extra) ---
+
+def st_synth(ctx: Ctx):
+    ctx.paths = ctx.world.write(ctx.work, ctx.rows, per_class=ctx.per_class)
+    return ctx.rows
+
+def st_load_caches(ctx: Ctx):
+    ctx.labels = load_json(ctx.paths["labels.json"])
+    ctx.types = load_json(ctx.paths["types.json"])
+    ctx.constraints = ConstraintIndex(load_json(ctx.paths["constraints.json"]))
+    ctx.hierarchy = ClassHierarchy(load_json(ctx.paths["subclass.json"])).precompute()
+    ctx.pools = TypePoolIndex.load(ctx.paths["pools.json"]).precompute(ctx.constraints)
+    return len(ctx.labels)
+
+def st_read_jsonl(ctx: Ctx):
+    return sum(1 for _ in read_jsonl(ctx.paths["examples.jsonl"]))
+
+def st_write_jsonl(ctx: Ctx):
+    rows = list(read_jsonl(ctx.paths["examples.jsonl"])) if ctx.rows <= 1_000_000 else None
+    t0 = time.perf_counter()
+    write_jsonl(ctx.path("copy.jsonl"), rows if rows is not None else read_jsonl(ctx.paths["examples.jsonl"]))
+    return ctx.rows, time.perf_counter() - t0, {"includes_read": rows is None}
+
+def _maker(fn):
+    def stage(ctx: Ctx):
+        rng = random.Random(ctx.seed)
+        if fn is make_single_value_violation:
+            cand = CandidateIndex(ctx.labels)
+            call = lambda ex: fn(ex, ctx.constraints, ctx.labels, rng, candidates=cand)
+        else:
+            call = lambda ex: fn(ex, ctx.constraints, ctx.labels, ctx.pools, rng)
+        made = [0]
+        def run(chunk):
+            made[0] += sum(1 for ex in chunk if call(ex))
+        rows, spent = _timed_chunks(ctx.paths["examples.jsonl"], run)
+        return rows, spent, {"made": made[0]}
+    return stage
+
+def st_make_contrasts(ctx: Ctx):
+    rng = random.Random(ctx.seed)
+    cand = CandidateIndex(ctx.labels)
+    n = [0]
+    def pairs():
+        for ex in read_jsonl(ctx.paths["examples.jsonl"]):
+            for v in make_contrasts(ex, ctx.constraints, ctx.labels, ctx.pools, rng, candidates=cand):
+                n[0] += 1
+                yield v
+    write_jsonl(ctx.path("pairs.jsonl"), pairs())
+    return ctx.rows, None, {"pairs": n[0]}
+
+def _baseline(pred_cls):
+    def stage(ctx: Ctx):
+        pred = pred_cls(use_contrast=True)
+        out = ctx.path(f"preds.{pred_cls.__name__}.jsonl")
+        rows, spent = 0, 0.0
+        with open(out, "w", encoding="utf-8") as f:
+            for chunk in iter_chunks(read_jsonl(ctx.path("pairs.jsonl")), CHUNK):
+                t0 = time.perf_counter()
+                res = pred.predict_batch(chunk)
+                spent += time.perf_counter() - t0
+                rows += len(chunk)
+                for p, triples in zip(chunk, res):
+                    f.write(json.dumps({"id": p["id"], "test_type": p.get("test_type"), "pid": p["pid"],
+                                        "is_contrast": True, "triples": triples}) + "\n")
+        return rows, spent
+    return stage
+
+def _violates(kind: str):
+    def stage(ctx: Ctx):
+        cs, types = ctx.constraints, ctx.types
+        if kind == "value_type":
+            run = lambda chunk: [violates_value_type(t, cs.get(p["pid"], {}), None, types) for p in chunk for t in p["triples"]]
+        elif kind == "subject_type":
+            run = lambda chunk: [violates_subject_type(t, cs.get(p["pid"], {}), None, types) for p in chunk for t in p["triples"]]
+        else:
+            run = lambda chunk: [violates_single_value(p["triples"], cs.get(p["pid"], {})) for p in chunk]
+        return _timed_chunks(ctx.path("preds.StringMatchPredictor.jsonl"), run)
+    return stage
+
+def _eval(engine: str):
+    def stage(ctx: Ctx):
+        oracle = TypeOracle(cache_dir=ctx.path("oracle_cache"), hierarchy=ctx.hierarchy, types=ctx.types)
+        preds = read_jsonl(ctx.path("preds.StringMatchPredictor.jsonl"))
+        if engine == "vectorized":
+            from contrakg.vectorized import VectorizedScorer
+            scorer = VectorizedScorer(ctx.constraints, ctx.types, oracle)
+            rows = (r for chunk in iter_chunks(preds, CHUNK) for r in scorer.score_rows(chunk))
+        else:
+            rows = score_predictions(preds, ctx.constraints, oracle, ctx.types, chunk_size=CHUNK)
+        summary = LeakageSummary()
+        writer = CsvRowWriter(ctx.path(f"leakage.{engine}.csv"), EVAL_COLUMNS)
+        for chunk in iter_chunks(rows, CHUNK):
+            for r in chunk:
+                summary.add(r)
+            writer.write_rows(chunk)
+        writer.close()
+        d = summary.to_dict()
+        return d["rows"], None, {"ITLR": d["ITLR"], "oracle_requests": oracle.client.requests}
+    return stage
+
+def _client(ctx: Ctx) -> SparqlClient:
+    return SparqlClient(endpoint=ctx.endpoint, cache=None, rate=None, max_workers=8)
+
+def st_wdqs_constraints(ctx: Ctx):
+    client = _client(ctx)
+    out = fetch_constraints(list(ctx.constraints), client=client)
+    assert out == ctx.constraints.source, "stand-in constraints differ from the synthetic ones"
+    return len(out), None, {"requests": client.requests}
+
+def st_wdqs_type_pools(ctx: Ctx):
+    client = _client(ctx)
+    pools = build_type_pools(constraint_classes(ctx.constraints), per_class=ctx.per_class, client=client)
+    return len(pools), None, {"requests": client.requests}
+
+def st_wdqs_entities(ctx: Ctx):
+    client = _client(ctx)
+    ents = [f"Q{i}" for i in range(1, min(ctx.world.n_ents, 20_000) + 1)]
+    qs = [f"""SELECT ?x ?xLabel ?t WHERE {{ VALUES ?x {{ {' '.join('wd:' + e for e in sub)} }}
+          OPTIONAL {{ ?x wdt:P31 ?t . }} }}""" for sub in iter_chunks(ents, 200)]
+    client.query_many(qs)
+    return len(ents), None, {"requests": client.requests}
+
+def st_wdqs_oracle(ctx: Ctx):
+    client = _client(ctx)
+    oracle = TypeOracle(cache_dir=ctx.path("oracle_cache_wdqs"), client=client)
+    rng = random.Random(ctx.seed)
+    classes = constraint_classes(ctx.constraints)
+    checks = [(f"Q{1 + rng.randrange(ctx.world.n_ents)}", rng.sample(classes, min(2, len(classes)))) for _ in range(5_000)]
+    oracle.check_many(checks)
+    return len(checks), None, {"requests": client.requests}
+
+STAGES: List[Tuple[str, Callable[[Ctx], Any], bool]] = [
+    # (name, fn, needs the WDQS stand-in)
+    ("synth_write", st_synth, False),
+    ("load_json_caches", st_load_caches, False),
+    ("io_read_jsonl", st_read_jsonl, False),
+    ("io_write_jsonl", st_write_jsonl, False),
+    ("make_range_violation", _maker(make_range_violation), False),
+    ("make_subject_violation", _maker(make_subject_violation), False),
+    ("make_single_value_violation", _maker(make_single_value_violation), False),
+    ("make_contrasts_to_jsonl", st_make_contrasts, False),
+    ("baseline_copy_gold", _baseline(CopyGoldPredictor), False),
+    ("baseline_string_match", _baseline(StringMatchPredictor), False),
+    ("violates_value_type", _violates("value_type"), False),
+    ("violates_subject_type", _violates("subject_type"), False),
+    ("violates_single_value", _violates("single_value"), False),
+    ("eval_python", _eval("python"), False),
+    ("eval_vectorized", _eval("vectorized"), False),
+    ("wdqs_constraints", st_wdqs_constraints, True),
+    ("wdqs_type_pools", st_wdqs_type_pools, True),
+    ("wdqs_entity_cache", st_wdqs_entities, True),
+    ("wdqs_oracle_checks", st_wdqs_oracle, True),
+]
+
+def _run(ctx: Ctx, fn) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    res = fn(ctx)
+    wall = time.perf_counter() - t0
+    rows, secs, extra = (res + (None, None))[:3] if isinstance(res, tuple) else (res, None, None)
+    secs = wall if secs is None else secs
+    return {"rows": rows, "seconds": round(secs, 4), "rows_per_s": round(rows / secs, 1) if secs else None,
+            **({"extra": extra} if extra else {})}
+
+def run_all(ctx: Ctx, memory: bool, with_wdqs: bool, log=print) -> List[Dict[str, Any]]:
+    stages = [(n, fn) for n, fn, net in STAGES if with_wdqs or not net]
+    results = []
+    for name, fn in stages:
+        rec = {"stage": name, **_run(ctx, fn)}
+        results.append(rec)
+        log(f"[..] {name:<28} rows={rec['rows']:<9} {rec['seconds']:>9.3f}s")
+    if memory:
+        # Same stages again, each with a fresh tracemalloc peak.
+        tracemalloc.start()
+        for rec, (name, fn) in zip(results, stages):
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            fn(ctx)
+            rec["peak_mb"] = round((tracemalloc.get_traced_memory()[1] - base) / 1e6, 2)
+        tracemalloc.stop()
+    return results
+
+def _git_rev() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(cur: Dict[str, Any], prev: Dict[str, Any]):
+    old = {r["stage"]: r for r in prev.get("stages", [])}
+    for r in cur["stages"]:
+        o = old.get(r["stage"])
+        if not o or not o.get("seconds"):
+            continue
+        line = f"{r['stage']:<28} {o['seconds']:>9.3f}s -> {r['seconds']:>9.3f}s  x{r['seconds'] / o['seconds']:.2f}"
+        if "peak_mb" in r and o.get("peak_mb"):
+            line += f"  mem {o['peak_mb']:.1f} -> {r['peak_mb']:.1f} MB"
+        print(line)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", default="10k", help="examples to generate, e.g. 10k, 1M, 10M")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--per_class", type=int, default=20)
+    ap.add_argument("--work_dir", default=None, help="keep generated data here (default: a temp dir)")
+    ap.add_argument("--no_memory", action="store_true", help="skip the tracemalloc pass")
+    ap.add_argument("--no_wdqs", action="store_true", help="skip the stages that talk to the local WDQS stand-in")
+    ap.add_argument("--out", default=None, help="write results JSON here (also printed)")
+    ap.add_argument("--compare", default=None, help="earlier results JSON to compare against")
+    args = ap.parse_args()
+
+    rows = parse_rows(args.rows)
+    world = SynthWorld.for_rows(rows, args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        work = Path(args.work_dir or tmp)
+        work.mkdir(parents=True, exist_ok=True)
+        ctx = Ctx(world, rows, work, args.per_class, args.seed)
+        srv = None
+        if not args.no_wdqs:
+            from fake_wdqs import start
+            srv, ctx.endpoint = start(world)
+        try:
+            stages = run_all(ctx, memory=not args.no_memory, with_wdqs=not args.no_wdqs,
+                             log=lambda s: print(s, file=sys.stderr))
+        finally:
+            if srv is not None:
+                srv.shutdown()
+    doc = {
+        "meta": {"rows": rows, **world.meta(), "per_class": args.per_class, "git": _git_rev(),
+                 "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+                 "time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")},
+        "stages": stages,
+    }
+    text = json.dumps(doc, indent=2)
+    if args.out:
+        Path(args.out).write_text(text + "\n", encoding="utf-8")
+    print(text)
+    if args.compare:
+        compare(doc, json.loads(Path(args.compare).read_text(encoding="utf-8")))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+from __future__ import annotations
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from contrakg.constraints import Q_SUBJECT_TYPE, Q_VALUE_TYPE
+from contrakg.io_utils import write_json_atomic, write_jsonl
+
+# Deterministic synthetic Wikidata slice. Everything is a pure function of (sizes, seed), so
+# the generator that writes files and the local WDQS stand-in (fake_wdqs.py) agree without
+# sharing state.
+#   entities  Q1..Q{n_ents}, one or two P31 classes each
+#   classes   Q{CLASS_BASE + j}, a binary P279 tree rooted at j = 0
+#   pids      P1..P{n_pids}, subject/value-type constraints on random classes, even PIDs single-value
+
+CLASS_BASE = 100_000_000
+MANDATORY = "Q21502408"
+_FIRST = ["North", "Saint", "Upper", "New", "Great", "Old", "East", "Little", "West", "Grand", "Lower", "South"]
+_SECOND = ["Haven", "Bridge", "Ford", "Field", "Water", "Stone", "Brook", "Wood", "Hill", "Port", "Vale", "Marsh",
+           "Gate", "Moor", "Cliff", "Mill"]
+_VERBS = ["was born in", "works for", "is located in", "was founded by", "plays for", "is married to"]
+
+def _h(*xs: int) -> int:
+    # splitmix64-style mixer: fast, stable across Python versions (unlike hash()).
+    z = 0x9E3779B97F4A7C15
+    for x in xs:
+        z = (z ^ (x & 0xFFFFFFFFFFFFFFFF)) * 0xBF58476D1CE4E5B9 & 0xFFFFFFFFFFFFFFFF
+        z = (z ^ (z >> 27)) * 0x94D049BB133111EB & 0xFFFFFFFFFFFFFFFF
+        z ^= z >> 31
+    return z
+
+class SynthWorld:
+    def __init__(self, n_ents: int=100_000, n_classes: int=1_000, n_pids: int=200, seed: int=0):
+        self.n_ents, self.n_classes, self.n_pids, self.seed = n_ents, n_classes, n_pids, seed
+
+    @classmethod
+    def for_rows(cls, rows: int, seed: int=0) -> "SynthWorld":
+        # Entity and class counts grow with the example count, roughly like T-REx slices.
+        return cls(n_ents=max(1_000, rows // 4), n_classes=max(64, min(50_000, rows // 200)),
+                   n_pids=max(8, min(2_000, rows // 500)), seed=seed)
+
+    def meta(self) -> Dict[str, int]:
+        return {"n_ents": self.n_ents, "n_classes": self.n_classes, "n_pids": self.n_pids, "seed": self.seed}
+
+    # entities
+    def label(self, i: int) -> str:
+        h = _h(self.seed, 1, i)
+        return f"{_FIRST[h % len(_FIRST)]} {_SECOND[(h >> 8) % len(_SECOND)]} {i}"
+
+    def types(self, i: int) -> List[str]:
+        h = _h(self.seed, 2, i)
+        out = [self.cls(h % self.n_classes)]
+        if h % 3 == 0 and (h >> 20) % self.n_classes != h % self.n_classes:
+            out.append(self.cls((h >> 20) % self.n_classes))
+        return out
+
+    # classes
+    def cls(self, j: int) -> str:
+        return f"Q{CLASS_BASE + j}"
+
+    def cls_index(self, c: str) -> Optional[int]:
+        j = int(c[1:]) - CLASS_BASE if c[:1] == "Q" and c[1:].isdigit() else -1
+        return j if 0 <= j < self.n_classes else None
+
+    def parents(self, c: str) -> List[str]:
+        j = self.cls_index(c)
+        return [self.cls((j - 1) // 2)] if j else []
+
+    def ancestors(self, c: str) -> List[str]:
+        out = [c]
+        while True:
+            ps = self.parents(out[-1])
+            if not ps:
+                return out
+            out.append(ps[0])
+
+    def is_a(self, ent: str, c: str) -> bool:
+        i = int(ent[1:])
+        return 1 <= i <= self.n_ents and any(c in self.ancestors(t) for t in self.types(i))
+
+    # properties
+    def _constraint_classes(self, p: int, role: int) -> List[str]:
+        # Shallow-ish classes so that a fair share of entities satisfies each constraint.
+        h = _h(self.seed, 3, p, role)
+        depth_cap = max(1, min(self.n_classes, 63))
+        return sorted({self.cls(h % depth_cap), self.cls((h >> 16) % depth_cap)})
+
+    def constraint(self, p: int) -> Dict[str, Any]:
+        def tc(qid: str, role: int):
+            return {"constraint_qid": qid, "classes": self._constraint_classes(p, role), "relation": None,
+                    "status": MANDATORY, "exceptions": sorted({f"Q{1 + _h(self.seed, 4, p, role, k) % self.n_ents}" for k in range(2)})}
+        single = p % 2 == 0
+        return {
+            "pid": f"P{p}",
+            "subject_type": [tc(Q_SUBJECT_TYPE, 0)] if p % 3 else [],
+            "value_type": [tc(Q_VALUE_TYPE, 1)],
+            "single_value": single,
+            "single_value_status": MANDATORY if single else None,
+            "single_value_exceptions": [],
+        }
+
+    def constraints(self) -> Dict[str, Any]:
+        return {f"P{p}": self.constraint(p) for p in range(1, self.n_pids + 1)}
+
+    # data
+    def examples(self, n: int) -> Iterator[Dict[str, Any]]:
+        for k in range(n):
+            h = _h(self.seed, 5, k)
+            s, o = 1 + h % self.n_ents, 1 + (h >> 24) % self.n_ents
+            p = 1 + (h >> 48) % self.n_pids
+            sl, ol = self.label(s), self.label(o)
+            yield {"id": f"ex{k}", "sentence": f"{sl} {_VERBS[p % len(_VERBS)]} {ol}.", "pid": f"P{p}",
+                   "subj": f"Q{s}", "obj": f"Q{o}", "subj_label": sl, "obj_label": ol}
+
+    def pool(self, c: str, k: int, scan: int=200_000) -> List[str]:
+        # First k entities (by number) that are instances of c, looking at most `scan` entities.
+        out = []
+        for i in range(1, min(self.n_ents, scan) + 1):
+            if self.is_a(f"Q{i}", c):
+                out.append(f"Q{i}")
+                if len(out) == k:
+                    break
+        return out
+
+    def write(self, out_dir: str | Path, rows: int, per_class: int=20) -> Dict[str, str]:
+        # Materialise the inputs of steps 3-5 (and the 02/01 outputs) under out_dir.
+        out = Path(out_dir)
+        out.mkdir(parents=True, exist_ok=True)
+        paths = {name: str(out / name) for name in
+                 ("examples.jsonl", "labels.json", "types.json", "subclass.json", "constraints.json", "pools.json")}
+        write_jsonl(paths["examples.jsonl"], self.examples(rows))
+        write_json_atomic(paths["labels.json"], {f"Q{i}": self.label(i) for i in range(1, self.n_ents + 1)}, indent=None)
+        write_json_atomic(paths["types.json"], {f"Q{i}": self.types(i) for i in range(1, self.n_ents + 1)}, indent=None)
+        write_json_atomic(paths["subclass.json"], {self.cls(j): self.parents(self.cls(j)) for j in range(self.n_classes)}, indent=None)
+        constraints = self.constraints()
+        write_json_atomic(paths["constraints.json"], constraints, indent=None)
+        classes = sorted({c for v in constraints.values() for role in ("subject_type", "value_type")
+                          for tc in v[role] for c in tc["classes"]})
+        write_json_atomic(paths["pools.json"], {"per_class": per_class,
+                                                "pools": {c: self.pool(c, per_class) for c in classes}}, indent=None)
+        return paths
+
+def load_json(path: str | Path) -> Any:
+    return json.loads(Path(path).read_text(encoding="utf-8"))
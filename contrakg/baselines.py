@@ -1,22 +1,27 @@
 from __future__ import annotations
-from typing import Dict, Any, List
-import re
+from typing import Dict, Any, List, Optional
+from .matching import Span
 
-def _contains(label: str, text: str) -> bool:
+def _contains(label: str, text: str, spans: Optional[Dict[str, List[Span]]]=None) -> bool:
+    # A word-boundary hit is always also a substring hit, so matching reduces to `label in text`.
+    # `spans` is LabelMatcher.find(text) from a matcher that covers the pair's labels.
     if not label:
         return False
-    return re.search(rf"\b{re.escape(label)}\b", text) is not None or (label in text)
+    if spans is not None:
+        return label in spans
+    return label in text
 
-def baseline_copy_gold(pair: Dict[str, Any]) -> List[Dict[str, Any]]:
+def baseline_copy_gold(pair: Dict[str, Any], spans: Optional[Dict[str, List[Span]]]=None) -> List[Dict[str, Any]]:
     s = pair["orig_sentence"]
     subj_label = pair.get("subj_label") or ""
     obj_label  = pair.get("obj_label") or ""
     out = []
-    if _contains(subj_label, s) and _contains(obj_label, s):
+    if _contains(subj_label, s, spans) and _contains(obj_label, s, spans):
         out.append({"subj": pair["subj"], "pid": pair["pid"], "obj": pair["obj"]})
     return out
 
-def baseline_string_match_swap(pair: Dict[str, Any], use_contrast: bool=False) -> List[Dict[str, Any]]:
+def baseline_string_match_swap(pair: Dict[str, Any], use_contrast: bool=False,
+                               spans: Optional[Dict[str, List[Span]]]=None) -> List[Dict[str, Any]]:
     text = pair["contrast_sentence"] if use_contrast else pair["orig_sentence"]
     subj = pair.get("contrast_subj", pair["subj"]) if use_contrast else pair["subj"]
     obj  = pair.get("contrast_obj", pair["obj"]) if use_contrast else pair["obj"]
@@ -24,12 +29,12 @@ def baseline_string_match_swap(pair: Dict[str, Any], use_contrast: bool=False) -
     obj_label  = pair.get("contrast_obj_label", pair.get("obj_label","")) if use_contrast else pair.get("obj_label","")
 
     out = []
-    if _contains(subj_label, text) and _contains(obj_label, text):
+    if _contains(subj_label, text, spans) and _contains(obj_label, text, spans):
         out.append({"subj": subj, "pid": pair["pid"], "obj": obj})
 
     if use_contrast and pair.get("test_type") == "single_value_violation":
         extra_obj = pair.get("extra_obj")
         extra_label = pair.get("extra_obj_label","")
-        if extra_obj and _contains(extra_label, text):
+        if extra_obj and _contains(extra_label, text, spans):
             out.append({"subj": subj, "pid": pair["pid"], "obj": extra_obj})
     return out
@@ -1,8 +1,10 @@
 from __future__ import annotations
+import json, sys, time
+from collections.abc import Mapping
 from dataclasses import dataclass, asdict
-from typing import List, Dict, Any, Optional
-from .wikidata import sparql, qid, pid
-from .io_utils import SimpleDiskCache
+from pathlib import Path
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple, Union
+from .wikidata import SparqlClient, default_client, qid, pid
 
 # Constraint-type QIDs
 Q_SUBJECT_TYPE = "Q21503250"  # subject type constraint
@@ -41,14 +43,9 @@ class PropertyConstraints:
             "single_value_exceptions": self.single_value_exceptions or [],
         }
 
-def fetch_constraints(pids: List[str], cache_dir: str=".cache_wdqs", sleep: float=0.1) -> Dict[str, Any]:
-    cache = SimpleDiskCache(cache_dir)
-    out: Dict[str, PropertyConstraints] = {}
-
-    values = " ".join([f"wd:{p.strip()}" for p in pids if p.strip()])
-    if not values:
-        raise ValueError("No pids given.")
-    q = f"""
+def constraints_query(pids: List[str]) -> str:
+    values = " ".join([f"wd:{p}" for p in pids])
+    return f"""
     SELECT ?p ?constraint ?class ?relation ?status ?exception WHERE {{
       VALUES ?p {{ {values} }}
       ?p p:P2302 ?st .
@@ -59,9 +56,11 @@ def fetch_constraints(pids: List[str], cache_dir: str=".cache_wdqs", sleep: floa
       OPTIONAL {{ ?st pq:P2303 ?exception . }}
     }}
     """
-    js = sparql(q, cache=cache, sleep=sleep)
-    rows = js["results"]["bindings"]
 
+def cache_key(p: str) -> str:
+    return f"constraints/{p}"
+
+def _parse_rows(rows: List[Dict[str, Any]]) -> Dict[str, Dict[str, Dict[str, Any]]]:
     tmp: Dict[str, Dict[str, Dict[str, Any]]] = {}
     for r in rows:
         p = pid(r["p"]["value"])
@@ -75,46 +74,185 @@ def fetch_constraints(pids: List[str], cache_dir: str=".cache_wdqs", sleep: floa
             tmp[p][c]["statuses"].add(qid(r["status"]["value"]))
         if "exception" in r:
             tmp[p][c]["exceptions"].add(qid(r["exception"]["value"]))
+    return tmp
+
+def _build(p: str, byc: Dict[str, Dict[str, Any]]) -> PropertyConstraints:
+    subj_list = []
+    val_list = []
+    single = False
+    single_status = None
+    single_ex = []
 
+    if Q_SUBJECT_TYPE in byc:
+        d = byc[Q_SUBJECT_TYPE]
+        subj_list.append(TypeConstraint(
+            constraint_qid=Q_SUBJECT_TYPE,
+            classes=sorted(d["classes"]),
+            relation=sorted(d["relations"])[0] if d["relations"] else None,
+            status=sorted(d["statuses"])[0] if d["statuses"] else None,
+            exceptions=sorted(d["exceptions"])
+        ))
+    if Q_VALUE_TYPE in byc:
+        d = byc[Q_VALUE_TYPE]
+        val_list.append(TypeConstraint(
+            constraint_qid=Q_VALUE_TYPE,
+            classes=sorted(d["classes"]),
+            relation=sorted(d["relations"])[0] if d["relations"] else None,
+            status=sorted(d["statuses"])[0] if d["statuses"] else None,
+            exceptions=sorted(d["exceptions"])
+        ))
+    if Q_SINGLE_VALUE in byc:
+        single = True
+        d = byc[Q_SINGLE_VALUE]
+        single_status = sorted(d["statuses"])[0] if d["statuses"] else None
+        single_ex = sorted(d["exceptions"])
+
+    return PropertyConstraints(
+        pid=p, subject_type=subj_list, value_type=val_list,
+        single_value=single, single_value_status=single_status,
+        single_value_exceptions=single_ex
+    )
+
+def _fresh(rec: Optional[Dict[str, Any]], max_age: Optional[float], now: float) -> bool:
+    return rec is not None and (max_age is None or now - rec.get("fetched_at", 0) <= max_age)
+
+def fetch_constraints(pids: List[str], cache_dir: str=".cache_wdqs", sleep: float=0.1,
+                      client: Optional[SparqlClient]=None, batch_size: int=50,
+                      max_age: Optional[float]=None) -> Dict[str, Any]:
+    # Results are cached per PID under "constraints/<pid>" with their fetch time, so a changed
+    # PID set only queries the PIDs not seen before (or older than max_age seconds). Missing
+    # PIDs are queried batch_size at a time, the batches concurrently.
+    client = client or default_client(cache_dir, sleep, max_workers=1)
+    pids = list(dict.fromkeys(p.strip() for p in pids if p.strip()))
+    if not pids:
+        raise ValueError("No pids given.")
+    cache = client.cache
+    now = time.time()
+    cached = cache.get_many([cache_key(p) for p in pids]) if cache is not None else {}
+    out: Dict[str, Any] = {}
+    todo = []
     for p in pids:
-        p = p.strip()
-        if not p:
-            continue
-        byc = tmp.get(p, {})
-        subj_list = []
-        val_list = []
-        single = False
-        single_status = None
-        single_ex = []
-
-        if Q_SUBJECT_TYPE in byc:
-            d = byc[Q_SUBJECT_TYPE]
-            subj_list.append(TypeConstraint(
-                constraint_qid=Q_SUBJECT_TYPE,
-                classes=sorted(d["classes"]),
-                relation=sorted(d["relations"])[0] if d["relations"] else None,
-                status=sorted(d["statuses"])[0] if d["statuses"] else None,
-                exceptions=sorted(d["exceptions"])
-            ))
-        if Q_VALUE_TYPE in byc:
-            d = byc[Q_VALUE_TYPE]
-            val_list.append(TypeConstraint(
-                constraint_qid=Q_VALUE_TYPE,
-                classes=sorted(d["classes"]),
-                relation=sorted(d["relations"])[0] if d["relations"] else None,
-                status=sorted(d["statuses"])[0] if d["statuses"] else None,
-                exceptions=sorted(d["exceptions"])
-            ))
-        if Q_SINGLE_VALUE in byc:
-            single = True
-            d = byc[Q_SINGLE_VALUE]
-            single_status = sorted(d["statuses"])[0] if d["statuses"] else None
-            single_ex = sorted(d["exceptions"])
-
-        out[p] = PropertyConstraints(
-            pid=p, subject_type=subj_list, value_type=val_list,
-            single_value=single, single_value_status=single_status,
-            single_value_exceptions=single_ex
-        )
-
-    return {p: pc.to_dict() for p, pc in out.items()}
+        rec = cached.get(cache_key(p))
+        if _fresh(rec, max_age, now):
+            out[p] = rec["constraints"]
+        else:
+            todo.append(p)
+
+    batches = [todo[i:i+batch_size] for i in range(0, len(todo), batch_size)]
+    fetched: Dict[str, Any] = {}
+    for batch, js in zip(batches, client.query_many([constraints_query(b) for b in batches], use_cache=False)):
+        tmp = _parse_rows(js["results"]["bindings"])
+        for p in batch:
+            out[p] = _build(p, tmp.get(p, {})).to_dict()
+            fetched[cache_key(p)] = {"fetched_at": now, "constraints": out[p]}
+    if cache is not None and fetched:
+        cache.set_many(fetched)
+    return {p: out[p] for p in pids}
+
+def constraint_ages(pids: List[str], cache) -> Dict[str, Optional[float]]:
+    # Seconds since each PID was last fetched; None when it has no cache record.
+    now = time.time()
+    recs = cache.get_many([cache_key(p) for p in pids]) if cache is not None else {}
+    return {p: (now - recs[cache_key(p)].get("fetched_at", 0)) if cache_key(p) in recs else None for p in pids}
+
+def refresh_constraints(existing: Dict[str, Any], pids: List[str], client: SparqlClient,
+                        batch_size: int=50, max_age: Optional[float]=None) -> Tuple[Dict[str, Any], List[str]]:
+    # Merge into an existing constraints.json: PIDs not in it are fetched; with max_age, PIDs
+    # already in it are re-fetched when their last fetch is older than that (or unknown).
+    pids = list(dict.fromkeys(p.strip() for p in pids if p.strip()))
+    todo = [p for p in pids if p not in existing]
+    if max_age is not None:
+        ages = constraint_ages([p for p in dict.fromkeys(list(existing) + pids) if p in existing], client.cache)
+        todo += [p for p, age in ages.items() if age is None or age > max_age]
+    merged = dict(existing)
+    if todo:
+        merged.update(fetch_constraints(todo, client=client, batch_size=batch_size, max_age=max_age))
+    return merged, todo
+
+class CompiledTypeConstraint:
+    # The first type constraint of a role, as the checks read it: classes in stored order
+    # (oracle questions follow it) plus frozen sets for membership tests. None stands for
+    # "no constraint", including a constraint without classes.
+    __slots__ = ("classes", "allowed", "exceptions", "relation", "status")
+
+    def __init__(self, classes: Iterable[str], exceptions: Iterable[str]=(), relation: Optional[str]=None,
+                 status: Optional[str]=None):
+        self.classes = tuple(map(sys.intern, classes))
+        self.allowed = frozenset(self.classes)
+        self.exceptions = frozenset(map(sys.intern, exceptions))
+        self.relation = relation
+        self.status = status
+
+    @classmethod
+    def from_list(cls, tlist: List[Any]) -> Optional["CompiledTypeConstraint"]:
+        if not tlist:
+            return None
+        tc = tlist[0].to_dict() if isinstance(tlist[0], TypeConstraint) else tlist[0]
+        classes = tc.get("classes") or []
+        if not classes:
+            return None
+        return cls(classes, tc.get("exceptions") or [], tc.get("relation"), tc.get("status"))
+
+    def __reduce__(self):
+        return (CompiledTypeConstraint, (self.classes, tuple(self.exceptions), self.relation, self.status))
+
+class CompiledConstraint:
+    __slots__ = ("pid", "value_type", "subject_type", "single_value", "single_value_status", "single_value_exceptions")
+
+    def __init__(self, pid: str, value_type: Optional[CompiledTypeConstraint]=None,
+                 subject_type: Optional[CompiledTypeConstraint]=None, single_value: bool=False,
+                 single_value_status: Optional[str]=None, single_value_exceptions: Iterable[str]=()):
+        self.pid = sys.intern(pid)
+        self.value_type = value_type
+        self.subject_type = subject_type
+        self.single_value = bool(single_value)
+        self.single_value_status = single_value_status
+        self.single_value_exceptions = frozenset(map(sys.intern, single_value_exceptions))
+
+    @classmethod
+    def from_dict(cls, pid: str, c: Union[Dict[str, Any], PropertyConstraints]) -> "CompiledConstraint":
+        if isinstance(c, PropertyConstraints):
+            c = c.to_dict()
+        return cls(pid, CompiledTypeConstraint.from_list(c.get("value_type", [])),
+                   CompiledTypeConstraint.from_list(c.get("subject_type", [])), c.get("single_value", False),
+                   c.get("single_value_status"), c.get("single_value_exceptions") or [])
+
+    def __reduce__(self):
+        return (CompiledConstraint, (self.pid, self.value_type, self.subject_type, self.single_value,
+                                     self.single_value_status, tuple(self.single_value_exceptions)))
+
+NO_CONSTRAINT = CompiledConstraint("")
+
+def compiled(c: Union[CompiledConstraint, Dict[str, Any]]) -> CompiledConstraint:
+    # Checks accept a compiled constraint or a raw constraints.json entry (compiled on the fly).
+    return c if isinstance(c, CompiledConstraint) else CompiledConstraint.from_dict(c.get("pid", ""), c)
+
+class ConstraintIndex(Mapping):
+    # constraints.json compiled once: PID -> CompiledConstraint. Pickles as the raw dict and
+    # recompiles on load, which is smaller than the compiled objects and takes milliseconds.
+    def __init__(self, constraints: Dict[str, Any]):
+        self.source = constraints.source if isinstance(constraints, ConstraintIndex) else constraints
+        self._by_pid = {sys.intern(p): CompiledConstraint.from_dict(p, c) for p, c in self.source.items()}
+
+    @classmethod
+    def of(cls, constraints: Union["ConstraintIndex", Dict[str, Any]]) -> "ConstraintIndex":
+        return constraints if isinstance(constraints, ConstraintIndex) else cls(constraints)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "ConstraintIndex":
+        return cls(json.loads(Path(path).read_text(encoding="utf-8")))
+
+    def __getitem__(self, pid: str) -> CompiledConstraint:
+        return self._by_pid[pid]
+
+    def get(self, pid: str, default: Any=None) -> Any:
+        return self._by_pid.get(pid, default)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._by_pid)
+
+    def __len__(self) -> int:
+        return len(self._by_pid)
+
+    def __reduce__(self):
+        return (ConstraintIndex, (self.source,))
@@ -1,52 +1,193 @@
 from __future__ import annotations
-import random, re
-from typing import Dict, Any, List, Optional
-from .wikidata import sparql, qid
-from .io_utils import SimpleDiskCache
+import itertools, json, multiprocessing as mp, random
+from pathlib import Path
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple, Union
+from .constraints import NO_CONSTRAINT, ConstraintIndex, compiled
+from .wikidata import SparqlClient, default_client, sparql, qid
+from .io_utils import Cache, write_json_atomic
+from .matching import word_pattern
 
 def _safe_replace(sentence: str, old: str, new: str) -> str:
     if not old or old == new:
         return sentence
     if old in sentence:
         return sentence.replace(old, new, 1)
-    pat = re.compile(rf"\b{re.escape(old)}\b", flags=re.IGNORECASE)
-    return pat.sub(new, sentence, count=1)
+    return word_pattern(old, ignore_case=True).sub(new, sentence, count=1)
 
-def pick_entity_of_class(target_class_qid: str, cache: SimpleDiskCache, k: int=50, sleep: float=0.1) -> List[str]:
-    q = f"""
+def pool_query(target_class_qid: str, k: int=50) -> str:
+    return f"""
     SELECT ?x WHERE {{
       ?x wdt:P31/wdt:P279* wd:{target_class_qid} .
     }} LIMIT {int(k)}
     """
-    js = sparql(q, cache=cache, sleep=sleep)
+
+def pick_entity_of_class(target_class_qid: str, cache: Cache, k: int=50, sleep: float=0.1) -> List[str]:
+    js = sparql(pool_query(target_class_qid, k), cache=cache, sleep=sleep)
     return [qid(b["x"]["value"]) for b in js["results"]["bindings"]]
 
-def build_type_pools(seed_classes: List[str], cache_dir: str=".cache_wdqs", per_class: int=50, sleep: float=0.1) -> Dict[str, List[str]]:
-    cache = SimpleDiskCache(cache_dir)
-    pools = {}
-    for c in seed_classes:
-        try:
-            pools[c] = pick_entity_of_class(c, cache=cache, k=per_class, sleep=sleep)
-        except Exception:
-            pools[c] = []
+def pool_batch_query(classes: List[str], k: int=50) -> str:
+    # One LIMIT-k subselect per class, UNIONed, so a single request fills several pools.
+    parts = [f"""{{ SELECT ?x ?c WHERE {{
+        BIND(wd:{c} AS ?c)
+        ?x wdt:P31/wdt:P279* wd:{c} .
+      }} LIMIT {int(k)} }}""" for c in classes]
+    return "SELECT ?x ?c WHERE {\n      " + "\n      UNION\n      ".join(parts) + "\n    }"
+
+def build_type_pools(seed_classes: List[str], cache_dir: str=".cache_wdqs", per_class: int=50, sleep: float=0.1,
+                     client: Optional[SparqlClient]=None, batch_size: int=20) -> Dict[str, List[str]]:
+    # A class whose queries fail gets an empty pool.
+    pools, _ = fetch_type_pools(seed_classes, cache_dir, per_class, sleep, client, batch_size)
     return pools
 
+def fetch_type_pools(seed_classes: List[str], cache_dir: str=".cache_wdqs", per_class: int=50, sleep: float=0.1,
+                     client: Optional[SparqlClient]=None,
+                     batch_size: int=20) -> Tuple[Dict[str, List[str]], List[str]]:
+    # Batches run concurrently; a failed batch (e.g. a timeout on a heavy class) falls back to
+    # one query per class. Returns the pools and the classes whose own query failed too (their
+    # pools are empty, but only for this run).
+    client = client or default_client(cache_dir, sleep)
+    seed_classes = list(seed_classes)
+    batches = [seed_classes[i:i+batch_size] for i in range(0, len(seed_classes), batch_size)]
+    results = client.query_many([pool_batch_query(b, per_class) for b in batches], return_exceptions=True)
+    pools: Dict[str, List[str]] = {}
+    retry = []
+    for batch, js in zip(batches, results):
+        if isinstance(js, Exception):
+            retry += batch
+            continue
+        got: Dict[str, List[str]] = {c: [] for c in batch}
+        for b in js["results"]["bindings"]:
+            got.setdefault(qid(b["c"]["value"]), []).append(qid(b["x"]["value"]))
+        pools.update(got)
+    failed = []
+    for c, js in zip(retry, client.query_many([pool_query(c, per_class) for c in retry], return_exceptions=True)):
+        if isinstance(js, Exception):
+            failed.append(c)
+            pools[c] = []
+        else:
+            pools[c] = [qid(b["x"]["value"]) for b in js["results"]["bindings"]]
+    return {c: pools[c] for c in seed_classes}, failed
+
+def constraint_classes(constraints: Union[ConstraintIndex, Dict[str, Any]]) -> List[str]:
+    # Every class of every type constraint (not only the first per role, which the checks use).
+    classes = set()
+    for c in (constraints.source if isinstance(constraints, ConstraintIndex) else constraints).values():
+        for role in ("subject_type", "value_type"):
+            for tc in c.get(role, []):
+                classes.update(tc.get("classes") or [])
+    return sorted(classes)
+
+class TypePoolIndex:
+    # Read-only class -> entity pools, plus a memo of the usable complement (non-empty pools
+    # of classes outside the allowed set, in pool order) per allowed-class set. precompute()
+    # fills the memo for every constraint up front, so with fork-based workers it is shared
+    # and each example's lookup is a single dict hit. Classes in `failed` (queries that failed in
+    # build) have empty pools for this run but are not saved, so a later run asks them again.
+    def __init__(self, pools: Dict[str, List[str]], per_class: Optional[int]=None, failed: Iterable[str]=()):
+        self.pools = dict(pools)
+        self.per_class = per_class
+        self.failed = set(failed)
+        self._complement: Dict[frozenset, List[Tuple[str, List[str]]]] = {}
+
+    @classmethod
+    def load(cls, path: str | Path) -> "TypePoolIndex":
+        d = json.loads(Path(path).read_text(encoding="utf-8"))
+        return cls(d["pools"], per_class=d.get("per_class"))
+
+    def save(self, path: str | Path):
+        write_json_atomic(path, {"per_class": self.per_class, "pools": self.answered()}, indent=None)
+
+    def answered(self) -> Dict[str, List[str]]:
+        return {c: pool for c, pool in self.pools.items() if c not in self.failed}
+
+    @classmethod
+    def build(cls, classes: Iterable[str], client: SparqlClient, per_class: int=50, batch_size: int=20,
+              existing: Optional["TypePoolIndex"]=None) -> "TypePoolIndex":
+        # Pools already in `existing` (built with the same per_class) are reused; the result
+        # holds exactly `classes`, in that order.
+        classes = list(classes)
+        have = existing.pools if existing is not None and existing.per_class == per_class else {}
+        new, failed = fetch_type_pools([c for c in classes if c not in have], per_class=per_class, client=client,
+                                       batch_size=batch_size)
+        return cls({c: have[c] if c in have else new[c] for c in classes}, per_class=per_class, failed=failed)
+
+    def merged(self, other: "TypePoolIndex") -> "TypePoolIndex":
+        # Failed classes of `other` keep the pool `self` has for them, if any.
+        return TypePoolIndex({**self.pools, **other.answered()}, per_class=other.per_class,
+                             failed=other.failed - self.answered().keys())
+
+    def __len__(self) -> int:
+        return len(self.pools)
+
+    def __contains__(self, cls_qid: str) -> bool:
+        return cls_qid in self.pools
+
+    def get(self, cls_qid: str, default: Any=None) -> Any:
+        return self.pools.get(cls_qid, default)
+
+    def complement(self, allowed: Iterable[str]) -> List[Tuple[str, List[str]]]:
+        key = frozenset(allowed)
+        out = self._complement.get(key)
+        if out is None:
+            out = self._complement[key] = [(c, pool) for c, pool in self.pools.items() if c not in key and pool]
+        return out
+
+    def precompute(self, constraints: Union[ConstraintIndex, Dict[str, Any]]) -> "TypePoolIndex":
+        for c in ConstraintIndex.of(constraints).values():
+            for tc in (c.subject_type, c.value_type):
+                if tc is not None:
+                    self.complement(tc.allowed)
+        return self
+
+def usable_pools(type_pools: Union[TypePoolIndex, Dict[str, List[str]]], allowed: Iterable[str]) -> List[Tuple[str, List[str]]]:
+    if isinstance(type_pools, TypePoolIndex):
+        return type_pools.complement(allowed)
+    allowed_set = allowed if isinstance(allowed, frozenset) else set(allowed)
+    return [(cls, pool) for cls, pool in type_pools.items() if cls not in allowed_set and pool]
+
+class CandidateIndex:
+    # QIDs eligible as an injected second value (non-empty label of at most `max_words` words),
+    # kept in labels order. Excluding the gold object shifts the drawn index past its slot, which
+    # consumes the RNG exactly like rng.choice() over the filtered list did.
+    def __init__(self, labels: Dict[str, str], types: Optional[Dict[str, List[str]]]=None, max_words: int=4):
+        self.qids = [q for q, l in labels.items() if l and len(l.split()) <= max_words]
+        self.pos = {q: i for i, q in enumerate(self.qids)}
+        self.buckets: Dict[str, List[str]] = {}
+        self.bucket_pos: Dict[str, Dict[str, int]] = {}
+        if types is not None:
+            for q in self.qids:
+                for t in types.get(q, []):
+                    self.buckets.setdefault(t, []).append(q)
+            self.bucket_pos = {t: {q: i for i, q in enumerate(qs)} for t, qs in self.buckets.items()}
+
+    def __len__(self) -> int:
+        return len(self.qids)
+
+    def sample(self, rng: random.Random, exclude: Optional[str]=None, bucket: Optional[str]=None) -> Optional[str]:
+        if bucket is None:
+            qids, pos = self.qids, self.pos
+        else:
+            qids, pos = self.buckets.get(bucket, []), self.bucket_pos.get(bucket, {})
+        skip = pos.get(exclude) if exclude is not None else None
+        n = len(qids) - (skip is not None)
+        if n <= 0:
+            return None
+        i = rng.randrange(n)
+        if skip is not None and i >= skip:
+            i += 1
+        return qids[i]
+
 def make_range_violation(example: Dict[str, Any],
-                         constraints: Dict[str, Any],
+                         constraints: Union[ConstraintIndex, Dict[str, Any]],
                          labels: Dict[str, str],
-                         type_pools: Dict[str, List[str]],
+                         type_pools: Union[TypePoolIndex, Dict[str, List[str]]],
                          rng: random.Random) -> Optional[Dict[str, Any]]:
     pid = example["pid"]
-    c = constraints.get(pid, {})
-    vlist = c.get("value_type", [])
-    if not vlist:
-        return None
-    allowed = vlist[0].get("classes") or []
-    if not allowed:
+    tc = compiled(constraints.get(pid, NO_CONSTRAINT)).value_type
+    if tc is None:
         return None
 
-    pools = [(cls, type_pools.get(cls, [])) for cls in type_pools.keys() if cls not in set(allowed)]
-    pools = [(cls, pool) for cls, pool in pools if pool]
+    pools = usable_pools(type_pools, tc.allowed)
     if not pools:
         return None
     bad_cls, pool = rng.choice(pools)
@@ -71,27 +212,22 @@ def make_range_violation(example: Dict[str, Any],
         "contrast_sentence": sent2,
         "contrast_obj": new_obj,
         "contrast_obj_label": new_label,
-        "target_allowed_classes": allowed,
+        "target_allowed_classes": list(tc.classes),
         "contrast_obj_class_pool": bad_cls,
         "edit": {"op": "replace_obj", "from": example.get("obj_label"), "to": new_label},
     }
 
 def make_subject_violation(example: Dict[str, Any],
-                           constraints: Dict[str, Any],
+                           constraints: Union[ConstraintIndex, Dict[str, Any]],
                            labels: Dict[str, str],
-                           type_pools: Dict[str, List[str]],
+                           type_pools: Union[TypePoolIndex, Dict[str, List[str]]],
                            rng: random.Random) -> Optional[Dict[str, Any]]:
     pid = example["pid"]
-    c = constraints.get(pid, {})
-    slist = c.get("subject_type", [])
-    if not slist:
-        return None
-    allowed = slist[0].get("classes") or []
-    if not allowed:
+    tc = compiled(constraints.get(pid, NO_CONSTRAINT)).subject_type
+    if tc is None:
         return None
 
-    pools = [(cls, type_pools.get(cls, [])) for cls in type_pools.keys() if cls not in set(allowed)]
-    pools = [(cls, pool) for cls, pool in pools if pool]
+    pools = usable_pools(type_pools, tc.allowed)
     if not pools:
         return None
     bad_cls, pool = rng.choice(pools)
@@ -116,24 +252,25 @@ def make_subject_violation(example: Dict[str, Any],
         "contrast_sentence": sent2,
         "contrast_subj": new_subj,
         "contrast_subj_label": new_label,
-        "target_allowed_classes": allowed,
+        "target_allowed_classes": list(tc.classes),
         "contrast_subj_class_pool": bad_cls,
         "edit": {"op": "replace_subj", "from": example.get("subj_label"), "to": new_label},
     }
 
 def make_single_value_violation(example: Dict[str, Any],
-                                constraints: Dict[str, Any],
+                                constraints: Union[ConstraintIndex, Dict[str, Any]],
                                 labels: Dict[str, str],
-                                rng: random.Random) -> Optional[Dict[str, Any]]:
+                                rng: random.Random,
+                                candidates: Optional[CandidateIndex]=None) -> Optional[Dict[str, Any]]:
     pid = example["pid"]
-    c = constraints.get(pid, {})
-    if not c.get("single_value", False):
+    if not compiled(constraints.get(pid, NO_CONSTRAINT)).single_value:
         return None
 
-    candidates = [q for q,l in labels.items() if q != example.get("obj") and l and len(l.split()) <= 4]
-    if not candidates:
+    if candidates is None:
+        candidates = CandidateIndex(labels)
+    obj2 = candidates.sample(rng, exclude=example.get("obj"))
+    if obj2 is None:
         return None
-    obj2 = rng.choice(candidates)
     obj2_label = labels.get(obj2)
     if not obj2_label:
         return None
@@ -161,3 +298,62 @@ def make_single_value_violation(example: Dict[str, Any],
         "extra_obj_label": obj2_label,
         "edit": {"op": "duplicate_value", "add": obj2_label},
     }
+
+def make_contrasts(example: Dict[str, Any],
+                   constraints: Union[ConstraintIndex, Dict[str, Any]],
+                   labels: Dict[str, str],
+                   type_pools: Union[TypePoolIndex, Dict[str, List[str]]],
+                   rng: random.Random,
+                   candidates: Optional[CandidateIndex]=None) -> List[Dict[str, Any]]:
+    out = []
+    v1 = make_range_violation(example, constraints, labels, type_pools, rng)
+    if v1: out.append(v1)
+    v2 = make_subject_violation(example, constraints, labels, type_pools, rng)
+    if v2: out.append(v2)
+    v3 = make_single_value_violation(example, constraints, labels, rng, candidates=candidates)
+    if v3: out.append(v3)
+    return out
+
+def example_rng(seed: int, example_id: str) -> random.Random:
+    # str seeds hash with SHA-512, so this does not depend on PYTHONHASHSEED or worker layout.
+    return random.Random(f"{seed}:{example_id}")
+
+_WORKER: Dict[str, Any] = {}
+
+def _init_worker(state: Optional[Dict[str, Any]]=None):
+    if state is not None:
+        _WORKER.update(state)
+    if "candidates" not in _WORKER:
+        _WORKER["candidates"] = CandidateIndex(_WORKER["labels"])
+
+def _contrasts_for(example: Dict[str, Any]) -> List[Dict[str, Any]]:
+    w = _WORKER
+    return make_contrasts(example, w["constraints"], w["labels"], w["type_pools"],
+                          example_rng(w["seed"], example["id"]), candidates=w["candidates"])
+
+def generate_contrasts_parallel(examples: Iterable[Dict[str, Any]],
+                                constraints: Union[ConstraintIndex, Dict[str, Any]],
+                                labels: Dict[str, str],
+                                type_pools: Union[TypePoolIndex, Dict[str, List[str]]],
+                                seed: int,
+                                workers: int,
+                                chunksize: int=256) -> Iterator[Dict[str, Any]]:
+    # Yields pairs in example order. Each example gets its own RNG, so the output is the
+    # same for any worker count; the caller can stop consuming at --max_pairs.
+    state = {"constraints": ConstraintIndex.of(constraints), "labels": labels, "type_pools": type_pools, "seed": seed}
+    if "fork" in mp.get_all_start_methods():
+        # Children inherit the read-only state copy-on-write instead of unpickling it.
+        _WORKER.clear()
+        _WORKER.update(state)
+        ctx, initargs = mp.get_context("fork"), (None,)
+    else:
+        ctx, initargs = mp.get_context(), (state,)
+    it = iter(examples)
+    window = max(1, workers) * chunksize * 4
+    with ctx.Pool(workers, initializer=_init_worker, initargs=initargs) as pool:
+        while True:
+            block = list(itertools.islice(it, window))
+            if not block:
+                break
+            for cand in pool.imap(_contrasts_for, block, chunksize=chunksize):
+                yield from cand
@@ -0,0 +1,172 @@
+from __future__ import annotations
+import itertools, re, shutil, tempfile, zlib
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from .constraints import ConstraintIndex
+
+# Corpus-wide single-value check: violates_single_value only sees the triples of one
+# prediction row, this groups every triple of every row (and file) by (subject, PID).
+# Records (subj, pid, obj, source, row id) of single-value PIDs are hash-partitioned on
+# (subj, pid); while they fit in `max_records` they stay in memory, beyond that every
+# partition is appended to its own spill file. Each partition is then grouped on its own,
+# and one that is still too large is split again with another hash seed, so memory stays
+# bounded by max_records whatever the corpus size. Partitioning uses crc32, not hash(),
+# so the report order does not depend on PYTHONHASHSEED. Spill files are tab-separated with
+# \\, \t, \n and \r escaped, and are read splitting on \n only.
+
+Record = Tuple[str, str, str, int, str]
+
+_ESC = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+_UNESC = re.compile(r"\\(.)")
+_UNESC_MAP = {"\\": "\\", "t": "\t", "n": "\n", "r": "\r"}
+
+def _esc(s: str) -> str:
+    return s.translate(_ESC) if "\t" in s or "\n" in s or "\r" in s or "\\" in s else s
+
+def _unesc(s: str) -> str:
+    return _UNESC.sub(lambda m: _UNESC_MAP[m.group(1)], s) if "\\" in s else s
+
+class _Partitions:
+    def __init__(self, root: Path, parts: int, seed: int, max_records: int):
+        self.root, self.parts, self.seed, self.max_records = root, parts, seed, max_records
+        self.buf: List[List[Record]] = [[] for _ in range(parts)]
+        self.counts = [0] * parts
+        self.n = 0
+        self.spills = 0
+
+    def add(self, rec: Record):
+        i = zlib.crc32(f"{rec[0]}\x1f{rec[1]}".encode("utf-8"), self.seed) % self.parts
+        self.buf[i].append(rec)
+        self.counts[i] += 1
+        self.n += 1
+        if self.n >= self.max_records:
+            self.spill()
+
+    def _path(self, i: int) -> Path:
+        return self.root / f"s{self.seed}-p{i:04d}.tsv"
+
+    def spill(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        for i, recs in enumerate(self.buf):
+            if recs:
+                with self._path(i).open("a", encoding="utf-8", newline="\n") as f:
+                    f.write("".join(f"{_esc(s)}\t{_esc(p)}\t{_esc(o)}\t{src}\t{_esc(rid)}\n" for s, p, o, src, rid in recs))
+                self.buf[i] = []
+        self.n = 0
+        self.spills += 1
+
+    def records(self, i: int) -> Iterator[Record]:
+        path = self._path(i)
+        if path.exists():
+            with path.open("r", encoding="utf-8", newline="\n") as f:
+                for line in f:
+                    s, p, o, src, rid = line[:-1].split("\t")
+                    yield _unesc(s), _unesc(p), _unesc(o), int(src), _unesc(rid)
+        yield from self.buf[i]
+
+    def drop(self, i: int):
+        self.buf[i] = []
+        self._path(i).unlink(missing_ok=True)
+
+class SingleValueChecker:
+    def __init__(self, constraints: Union[ConstraintIndex, Dict[str, Any]], max_records: int=5_000_000,
+                 partitions: int=64, tmp_dir: Optional[str]=None, max_rows_per_group: int=100):
+        self.constraints = ConstraintIndex.of(constraints)
+        self.single = {p: c for p, c in self.constraints.items() if c.single_value}
+        self.max_records = max_records
+        self.partitions = partitions
+        self.max_rows_per_group = max_rows_per_group
+        self.root = Path(tempfile.mkdtemp(prefix="single_value_", dir=tmp_dir))
+        self._seeds = itertools.count()
+        self._parts = _Partitions(self.root, partitions, next(self._seeds), max_records)
+        self.sources: List[str] = []
+        self.stats = {"rows": 0, "triples": 0, "checked": 0, "excepted": 0, "groups": 0, "conflicts": 0,
+                      "conflict_row_refs": 0, "spills": 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def add_rows(self, rows: Iterable[Dict[str, Any]], source: str="-"):
+        # Prediction rows as written by 04 ({"id", "triples": [{"subj", "pid", "obj"}]}).
+        src = len(self.sources)
+        self.sources.append(str(source))
+        single, add, st = self.single, self._parts.add, self.stats
+        for r in rows:
+            st["rows"] += 1
+            rid = r.get("id")
+            rid = "" if rid is None else str(rid)
+            for t in r.get("triples") or []:
+                st["triples"] += 1
+                c = single.get(t.get("pid"))
+                if c is None:
+                    continue
+                s = t["subj"]
+                if s in c.single_value_exceptions:
+                    st["excepted"] += 1
+                    continue
+                st["checked"] += 1
+                add((s, c.pid, str(t["obj"]), src, rid))
+
+    def conflicts(self) -> Iterator[Dict[str, Any]]:
+        # (subj, pid) groups with two or more distinct objects; sorted by (pid, subj) within
+        # each partition, partitions in order.
+        parts = self._parts
+        if parts.spills:
+            parts.spill()  # everything on disk, so the in-memory budget is free for grouping
+        self.stats["spills"] = parts.spills
+        for i in range(parts.parts):
+            yield from self._partition(parts, i, 0)
+
+    def _partition(self, parts: _Partitions, i: int, depth: int) -> Iterator[Dict[str, Any]]:
+        total = parts.counts[i]
+        if total > self.max_records and depth < 8:
+            # Too large to group in memory: split it again with another seed. A partition that
+            # does not shrink is one huge (subj, pid) group and is grouped as is.
+            sub = _Partitions(self.root, self.partitions, next(self._seeds), self.max_records)
+            for rec in parts.records(i):
+                sub.add(rec)
+            parts.drop(i)
+            if sub.spills:
+                sub.spill()
+            self.stats["spills"] += sub.spills
+            for j in range(sub.parts):
+                yield from self._partition(sub, j, depth + 1 if sub.counts[j] < total else 8)
+            return
+        groups: Dict[Tuple[str, str], Tuple[Dict[str, None], Dict[Tuple[int, str, str], None]]] = {}
+        for s, p, o, src, rid in parts.records(i):
+            g = groups.get((p, s))
+            if g is None:
+                g = groups[(p, s)] = ({}, {})
+            g[0][o] = None
+            g[1][(src, rid, o)] = None
+        parts.drop(i)
+        self.stats["groups"] += len(groups)
+        for (p, s) in sorted(k for k, g in groups.items() if len(g[0]) >= 2):
+            objs, refs = groups[(p, s)]
+            self.stats["conflicts"] += 1
+            self.stats["conflict_row_refs"] += len(refs)
+            yield {
+                "subj": s,
+                "pid": p,
+                "status": self.single[p].single_value_status,
+                "n_values": len(objs),
+                "values": sorted(objs),
+                "n_rows": len(refs),
+                "rows": [{"source": self.sources[src], "id": rid, "obj": o}
+                         for src, rid, o in itertools.islice(refs, self.max_rows_per_group)],
+            }
+
+def check_single_value(sources: Iterable[Tuple[str, Iterable[Dict[str, Any]]]],
+                       constraints: Union[ConstraintIndex, Dict[str, Any]], **kwargs) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    # In-memory convenience wrapper: [(source name, rows), ...] -> (conflicts, stats).
+    with SingleValueChecker(constraints, **kwargs) as chk:
+        for name, rows in sources:
+            chk.add_rows(rows, source=name)
+        out = list(chk.conflicts())
+        return out, dict(chk.stats)
@@ -0,0 +1,213 @@
+from __future__ import annotations
+import io, multiprocessing as mp, re
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from .constraints import _build
+from .io_utils import iter_chunks, loads, open_binary
+
+# Offline counterpart of the WDQS lookups, read from a Wikidata JSON dump (one entity per
+# line inside a JSON array, optionally .gz/.bz2/.zst). Statements are read with the semantics the
+# SPARQL queries use: wdt:P31 / wdt:P279 are truthy (best non-deprecated rank), while
+# p:P2302 constraint statements and their qualifiers are taken at any rank.
+
+# Dumps write "type" and "id" first; lines matching this can be skipped without parsing.
+_HEAD = re.compile(r'\{"type":"(?:item|property)","id":"([QP]\d+)"')
+
+def open_dump(path: str | Path) -> Iterator[str]:
+    with io.TextIOWrapper(open_binary(path), encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line in ("", "[", "]"):
+                continue
+            yield line[:-1] if line.endswith(",") else line
+
+def _snak_id(snak: Dict[str, Any]) -> Optional[str]:
+    if snak.get("snaktype") != "value":
+        return None
+    v = snak.get("datavalue", {}).get("value")
+    return v.get("id") if isinstance(v, dict) else None
+
+def truthy_ids(claims: Dict[str, Any], prop: str) -> List[str]:
+    stmts = claims.get(prop) or []
+    best = [s for s in stmts if s.get("rank") == "preferred"] or [s for s in stmts if s.get("rank", "normal") == "normal"]
+    out: List[str] = []
+    for s in best:
+        i = _snak_id(s.get("mainsnak", {}))
+        if i and i not in out:
+            out.append(i)
+    return out
+
+def en_label(entity: Dict[str, Any]) -> str:
+    # Like the WDQS label service: fall back to the id when there is no English label.
+    return (entity.get("labels", {}).get("en") or {}).get("value") or entity["id"]
+
+_QUALIFIERS = (("P2308", "classes"), ("P2309", "relations"), ("P2316", "statuses"), ("P2303", "exceptions"))
+
+def constraint_statements(entity: Dict[str, Any]) -> Dict[str, Dict[str, Set[str]]]:
+    # -> {constraint_qid: {"classes", "relations", "statuses", "exceptions"}}, the shape
+    # constraints._build takes.
+    byc: Dict[str, Dict[str, Set[str]]] = {}
+    for st in entity.get("claims", {}).get("P2302") or []:
+        c = _snak_id(st.get("mainsnak", {}))
+        if not c:
+            continue
+        d = byc.setdefault(c, {"classes": set(), "relations": set(), "statuses": set(), "exceptions": set()})
+        quals = st.get("qualifiers") or {}
+        for prop, field in _QUALIFIERS:
+            for q in quals.get(prop) or []:
+                i = _snak_id(q)
+                if i:
+                    d[field].add(i)
+    return byc
+
+_WORKER: Dict[str, Any] = {}
+
+def _init_worker(state: Optional[Dict[str, Any]]=None):
+    if state is not None:
+        _WORKER.update(state)
+
+def _wanted(line: str, ids: Set[str], markers: Tuple[str, ...]) -> bool:
+    m = _HEAD.match(line)
+    return m is None or m.group(1) in ids or any(k in line for k in markers)
+
+def _scan_chunk(lines: List[str]) -> List[tuple]:
+    # ("item", id, label, P31s, P279s) for wanted items and for every class with P279
+    # statements; ("property", id, constraints) for wanted properties.
+    ents, pids = _WORKER["ents"], _WORKER["pids"]
+    out = []
+    for line in lines:
+        if not _wanted(line, _WORKER["ids"], ('"P279"',)):
+            continue
+        e = loads(line)
+        i = e.get("id")
+        if e.get("type") == "property":
+            if i in pids:
+                out.append(("property", i, constraint_statements(e)))
+            continue
+        claims = e.get("claims", {})
+        p279 = truthy_ids(claims, "P279")
+        if i in ents:
+            out.append(("item", i, en_label(e), truthy_ids(claims, "P31"), p279))
+        elif p279:
+            out.append(("item", i, None, None, p279))
+    return out
+
+def _pool_chunk(lines: List[str]) -> List[tuple]:
+    # (id, label, P31s, seed classes reached via P31/P279*) for items that reach any seed class.
+    anc, seeds = _WORKER["ancestors"], _WORKER["seeds"]
+    out = []
+    for line in lines:
+        if '"P31"' not in line:
+            continue
+        e = loads(line)
+        if e.get("type") != "item":
+            continue
+        p31 = truthy_ids(e.get("claims", {}), "P31")
+        hit = {s for t in p31 for s in anc(t) & seeds}
+        if hit:
+            out.append((e["id"], en_label(e), p31, hit))
+    return out
+
+def _map_chunks(path: str | Path, fn, state: Dict[str, Any], workers: int, chunk_lines: int) -> Iterator[tuple]:
+    chunks = iter_chunks(open_dump(path), chunk_lines)
+    if workers <= 0:
+        _WORKER.clear()
+        _WORKER.update(state)
+        for c in chunks:
+            yield from fn(c)
+        return
+    if "fork" in mp.get_all_start_methods():
+        _WORKER.clear()
+        _WORKER.update(state)
+        ctx, initargs = mp.get_context("fork"), (None,)
+    else:
+        ctx, initargs = mp.get_context(), (state,)
+    with ctx.Pool(workers, initializer=_init_worker, initargs=initargs) as pool:
+        for recs in pool.imap(fn, chunks):
+            yield from recs
+
+class _Closure:
+    # Memoized reflexive-transitive P279 closure over the full edge map (cycle-safe).
+    def __init__(self, parents: Dict[str, List[str]]):
+        self.parents = parents
+        self._memo: Dict[str, frozenset] = {}
+
+    def __call__(self, c: str) -> frozenset:
+        hit = self._memo.get(c)
+        if hit is not None:
+            return hit
+        seen, stack = {c}, [c]
+        while stack:
+            for p in self.parents.get(stack.pop(), ()):
+                if p not in seen:
+                    seen.add(p)
+                    stack.append(p)
+        out = self._memo[c] = frozenset(seen)
+        return out
+
+def subclass_graph(parents: Dict[str, List[str]], classes: Iterable[str]) -> Dict[str, List[str]]:
+    # Same shape as hierarchy.fetch_subclass_edges: every class reachable upward from
+    # `classes`, with its sorted direct superclasses ([] for roots).
+    out: Dict[str, List[str]] = {}
+    frontier = sorted(set(classes))
+    while frontier:
+        for c in frontier:
+            out[c] = sorted(parents.get(c, []))
+        frontier = sorted({p for c in frontier for p in out[c] if p not in out})
+    return out
+
+class DumpExtract:
+    def __init__(self):
+        self.labels: Dict[str, str] = {}
+        self.types: Dict[str, List[str]] = {}
+        self.parents: Dict[str, List[str]] = {}   # all truthy P279 edges in the dump
+        self.constraints: Dict[str, Any] = {}
+
+def ingest_dump(path: str | Path, ents: Iterable[str], pids: Iterable[str], workers: int=4,
+                chunk_lines: int=2000) -> DumpExtract:
+    # One pass: labels and truthy P31 for `ents`, constraint statements for `pids`, and the
+    # truthy P279 edges of every class (the superclass closure is not known until the end).
+    ents, pids = set(ents), [p.strip() for p in pids if p.strip()]
+    state = {"ents": ents, "pids": set(pids), "ids": ents | set(pids)}
+    res = DumpExtract()
+    found: Dict[str, Any] = {}
+    items: Dict[str, Tuple[str, List[str]]] = {}
+    for rec in _map_chunks(path, _scan_chunk, state, workers, chunk_lines):
+        if rec[0] == "property":
+            found[rec[1]] = rec[2]
+            continue
+        _, i, label, p31, p279 = rec
+        if p279:
+            res.parents[i] = p279
+        if label is not None:
+            items[i] = (label, p31)
+    for i in sorted(items):
+        res.labels[i] = items[i][0]
+        if items[i][1]:
+            res.types[i] = items[i][1]
+    res.constraints = {p: _build(p, found.get(p, {})).to_dict() for p in dict.fromkeys(pids)}
+    return res
+
+def build_pools_from_dump(path: str | Path, parents: Dict[str, List[str]], seed_classes: List[str],
+                          per_class: int=50, workers: int=4, chunk_lines: int=2000
+                          ) -> Tuple[Dict[str, List[str]], Dict[str, str], Dict[str, List[str]]]:
+    # Second pass: the first `per_class` items (dump order) whose P31/P279* reaches each seed
+    # class, plus their labels and P31 types. Stops reading once every pool is full.
+    state = {"ancestors": _Closure(parents), "seeds": frozenset(seed_classes)}
+    pools: Dict[str, List[str]] = {c: [] for c in seed_classes}
+    labels: Dict[str, str] = {}
+    types: Dict[str, List[str]] = {}
+    open_pools = len(pools) if per_class > 0 else 0
+    gen = _map_chunks(path, _pool_chunk, state, workers, chunk_lines)
+    for i, label, p31, hit in gen:
+        for c in hit:
+            if len(pools[c]) < per_class:
+                pools[c].append(i)
+                labels[i] = label
+                types[i] = p31
+                if len(pools[c]) == per_class:
+                    open_pools -= 1
+        if not open_pools:
+            gen.close()
+            break
+    return pools, labels, types
@@ -0,0 +1,234 @@
+from __future__ import annotations
+import bisect, itertools, json, mmap, os, re, struct
+from abc import abstractmethod
+from array import array
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+# Read-only binary store for the labels/types caches written by 02_build_entity_cache.py.
+# Entities are stored as integer QIDs in one sorted key table; labels are a UTF-8 blob and
+# type lists an int64 blob, both addressed through offset tables. The file is mmapped, so
+# lookups are a bisect plus a slice and processes opening the same file share its pages.
+#
+# Layout (little-endian, each section padded to 8 bytes):
+#   header   magic, n, n_labels, n_types, label_blob_len, n_type_vals
+#   keys     int64[n]      sorted entity numbers (Q123 -> 123)
+#   flags    uint8[n]      bit 0: has a label, bit 1: has a type list
+#   loff     int64[n+1]    label offsets into the blob
+#   lblob    bytes
+#   toff     int64[n+1]    type-list offsets into tvals
+#   tvals    int64[...]    class numbers
+#   lorder   uint32[n_labels]  key positions in the original labels order
+#   torder   uint32[n_types]   key positions in the original types order
+
+MAGIC = b"CKGENT1\x00"
+_HEADER = struct.Struct("<8sQQQQQ")
+_HAS_LABEL, _HAS_TYPES = 1, 2
+
+_QID = re.compile(r"Q([1-9][0-9]*)\Z")
+
+def _num(qid: str) -> Optional[int]:
+    m = _QID.match(qid) if isinstance(qid, str) else None
+    return int(m.group(1)) if m else None
+
+def _nums(qids: Iterable[str]) -> List[int]:
+    out = list(map(_num, qids))
+    if None in out:
+        bad = next(q for q, k in zip(qids, out) if k is None)
+        raise ValueError(f"Entity store keys must be plain QIDs, got {bad!r}")
+    return out
+
+def store_entries(labels: Mapping, types: Mapping) -> Tuple[Dict[str, str], Dict[str, List[str]], int]:
+    # The part of labels/types a store can hold: entries keyed by plain QIDs, type lists
+    # without non-QID classes. Returns both dicts and the number of keys and values dropped.
+    lab = {q: l for q, l in labels.items() if _num(q) is not None}
+    typ, dropped = {}, 0
+    for q, ts in types.items():
+        if _num(q) is None:
+            dropped += 1
+            continue
+        typ[q] = [t for t in ts if _num(t) is not None]
+        dropped += len(ts) - len(typ[q])
+    return lab, typ, dropped + len(labels) - len(lab)
+
+def _pad(n: int) -> int:
+    return -n % 8
+
+def is_entity_store(path: Union[str, Path]) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def write_entity_store(path: Union[str, Path], labels: Dict[str, str], types: Dict[str, List[str]]) -> Path:
+    lnums, tnums = _nums(list(labels)), _nums(list(types))
+    keys = sorted(set(lnums).union(tnums))
+    pos = {k: i for i, k in enumerate(keys)}
+    n = len(keys)
+    lorder = array("I", map(pos.__getitem__, lnums))
+    torder = array("I", map(pos.__getitem__, tnums))
+    flags = bytearray(n)
+    texts: List[bytes] = [b""] * n
+    tlists: List[List[int]] = [[]] * n
+    for i, lab in zip(lorder, labels.values()):
+        flags[i] |= _HAS_LABEL
+        texts[i] = (lab or "").encode("utf-8")
+    for i, ts in zip(torder, types.values()):
+        flags[i] |= _HAS_TYPES
+        tlists[i] = _nums(ts)
+    loff = array("q", itertools.accumulate(map(len, texts), initial=0))
+    toff = array("q", itertools.accumulate(map(len, tlists), initial=0))
+    lblob = b"".join(texts)
+    tvals = array("q", itertools.chain.from_iterable(tlists))
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("wb") as f:
+        f.write(_HEADER.pack(MAGIC, n, len(lorder), len(torder), len(lblob), len(tvals)))
+        for part in (array("q", keys).tobytes(), bytes(flags), loff.tobytes(), lblob,
+                     toff.tobytes(), tvals.tobytes(), lorder.tobytes(), torder.tobytes()):
+            f.write(part)
+            f.write(b"\x00" * _pad(len(part)))
+    os.replace(tmp, path)
+    return path
+
+class EntityStore:
+    def __init__(self, path: Union[str, Path]):
+        self.path = str(path)
+        self._open()
+
+    def _open(self):
+        self._file = open(self.path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n, nl, nt, lb, tv = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not an entity store")
+        mv = memoryview(self._mm)
+        off = _HEADER.size
+        def take(nbytes: int, fmt: Optional[str]=None):
+            nonlocal off
+            sec = mv[off:off + nbytes]
+            off += nbytes + _pad(nbytes)
+            return sec.cast(fmt) if fmt else sec
+        self.n = n
+        self.keys = take(8 * n, "q")
+        self.flags = take(n)
+        self.loff = take(8 * (n + 1), "q")
+        self.lblob = take(lb)
+        self.toff = take(8 * (n + 1), "q")
+        self.tvals = take(8 * tv, "q")
+        self.lorder = take(4 * nl, "I")
+        self.torder = take(4 * nt, "I")
+        self.labels = LabelView(self)
+        self.types = TypeView(self)
+
+    # Pickled as its path: worker processes re-map the same file instead of copying it.
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self._open()
+
+    def index(self, qid: str) -> int:
+        k = _num(qid)
+        if k is None:
+            return -1
+        i = bisect.bisect_left(self.keys, k)
+        return i if i < self.n and self.keys[i] == k else -1
+
+    def label_at(self, i: int) -> str:
+        return str(self.lblob[self.loff[i]:self.loff[i + 1]], "utf-8")
+
+    def types_at(self, i: int) -> List[str]:
+        return [f"Q{t}" for t in self.tvals[self.toff[i]:self.toff[i + 1]]]
+
+    def qid_at(self, i: int) -> str:
+        return f"Q{self.keys[i]}"
+
+    def close(self):
+        for name in ("keys", "flags", "loff", "lblob", "toff", "tvals", "lorder", "torder"):
+            getattr(self, name).release()
+        self._mm.close()
+        self._file.close()
+
+class _View(Mapping):
+    _flag = 0
+
+    def __init__(self, store: EntityStore):
+        self.store = store
+
+    @abstractmethod
+    def _order(self):
+        ...
+
+    @abstractmethod
+    def _value(self, i: int) -> Any:
+        ...
+
+    def _find(self, qid: str) -> int:
+        s = self.store
+        m = _QID.match(qid)
+        if m is None:
+            return -1
+        k = int(m.group(1))
+        i = bisect.bisect_left(s.keys, k)
+        return i if i < s.n and s.keys[i] == k and s.flags[i] & self._flag else -1
+
+    def __getitem__(self, qid: str) -> Any:
+        i = self._find(qid)
+        if i < 0:
+            raise KeyError(qid)
+        return self._value(i)
+
+    def get(self, qid: str, default: Any=None) -> Any:
+        i = self._find(qid)
+        return self._value(i) if i >= 0 else default
+
+    def __contains__(self, qid: object) -> bool:
+        return isinstance(qid, str) and self._find(qid) >= 0
+
+    def __len__(self) -> int:
+        return len(self._order())
+
+    # Iteration follows the order of the JSON file the store was built from.
+    def __iter__(self) -> Iterator[str]:
+        qid_at = self.store.qid_at
+        return (qid_at(i) for i in self._order())
+
+    def items(self) -> Iterable[Tuple[str, Any]]:
+        qid_at, value = self.store.qid_at, self._value
+        return ((qid_at(i), value(i)) for i in self._order())
+
+    def __reduce__(self):
+        return (getattr, (self.store, "labels" if self._flag == _HAS_LABEL else "types"))
+
+class LabelView(_View):
+    _flag = _HAS_LABEL
+
+    def _order(self):
+        return self.store.lorder
+
+    def _value(self, i: int) -> str:
+        return self.store.label_at(i)
+
+class TypeView(_View):
+    _flag = _HAS_TYPES
+
+    def _order(self):
+        return self.store.torder
+
+    def _value(self, i: int) -> List[str]:
+        return self.store.types_at(i)
+
+def _load(path: Union[str, Path], attr: str):
+    if is_entity_store(path):
+        return getattr(EntityStore(path), attr)
+    return json.loads(Path(path).read_text(encoding="utf-8"))
+
+def load_labels(path: Union[str, Path]) -> Mapping:
+    # labels.json or an entity store; either way a read-only QID -> label mapping.
+    return _load(path, "labels")
+
+def load_types(path: Union[str, Path]) -> Mapping:
+    return _load(path, "types")
@@ -1,77 +1,267 @@
 from __future__ import annotations
-from typing import Dict, Any, List, Optional
-from .wikidata import sparql
-from .io_utils import SimpleDiskCache
+from collections import OrderedDict
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple, Union
+from .constraints import NO_CONSTRAINT, CompiledConstraint, CompiledTypeConstraint, ConstraintIndex, compiled
+from .wikidata import SparqlClient, qid, rate_from_sleep
+from .io_utils import iter_chunks, open_cache
+from .hierarchy import ClassHierarchy
+
+def ask_query(ent_qid: str, class_qid: str) -> str:
+    return f"ASK {{ wd:{ent_qid} wdt:P31/wdt:P279* wd:{class_qid} . }}"
+
+def batch_check_query(pairs: List[Tuple[str, str]]) -> str:
+    values = " ".join([f"(wd:{e} wd:{c})" for e, c in pairs])
+    return f"""
+    SELECT ?x ?c WHERE {{
+      VALUES (?x ?c) {{ {values} }}
+      FILTER EXISTS {{ ?x wdt:P31/wdt:P279* ?c . }}
+    }}
+    """
 
 class TypeOracle:
-    def __init__(self, cache_dir: str=".cache_wdqs", sleep: float=0.05):
-        self.cache = SimpleDiskCache(cache_dir)
+    def __init__(self, cache_dir: str=".cache_wdqs", sleep: float=0.05,
+                 hierarchy: Optional[ClassHierarchy]=None, types: Optional[Dict[str, List[str]]]=None,
+                 memo_size: int=1_000_000, batch_size: int=200, client: Optional[SparqlClient]=None):
+        self.cache = client.cache if client is not None and client.cache is not None else open_cache(cache_dir)
         self.sleep = sleep
+        self.client = client or SparqlClient(cache=self.cache, rate=rate_from_sleep(sleep), max_workers=1)
+        self.hierarchy = hierarchy
+        self.types = types
+        self.memo_size = memo_size
+        self.batch_size = batch_size
+        self._memo: "OrderedDict[Tuple[str, str], bool]" = OrderedDict()
+
+    def _memo_get(self, key: Tuple[str, str]) -> Optional[bool]:
+        hit = self._memo.get(key)
+        if hit is not None:
+            self._memo.move_to_end(key)
+        return hit
+
+    def _memo_put(self, key: Tuple[str, str], val: bool):
+        self._memo[key] = val
+        self._memo.move_to_end(key)
+        while len(self._memo) > self.memo_size:
+            self._memo.popitem(last=False)
+
+    def local_answer(self, ent_qid: str, class_qid: str) -> Optional[bool]:
+        if self.hierarchy is None or self.types is None or ent_qid not in self.types:
+            return None
+        return self.hierarchy.entity_is_a(self.types[ent_qid], class_qid)
 
     def is_instance_or_subclass(self, ent_qid: str, class_qid: str) -> bool:
-        q = f"ASK {{ wd:{ent_qid} wdt:P31/wdt:P279* wd:{class_qid} . }}"
-        js = sparql(q, cache=self.cache, sleep=self.sleep)
-        return bool(js.get("boolean", False))
+        key = (ent_qid, class_qid)
+        hit = self._memo_get(key)
+        if hit is not None:
+            return hit
+        local = self.local_answer(ent_qid, class_qid)
+        if local is None:
+            js = self.client.query(ask_query(ent_qid, class_qid))
+            local = bool(js.get("boolean", False))
+        self._memo_put(key, local)
+        return local
 
-def violates_value_type(triple: Dict[str, str], c: Dict[str, Any], oracle: Optional[TypeOracle], types_cache: Optional[Dict[str, List[str]]] = None) -> bool:
-    vlist = c.get("value_type", [])
-    if not vlist:
-        return False
-    allowed = vlist[0].get("classes") or []
-    if not allowed:
-        return False
+    def check_many(self, checks: Iterable[Tuple[str, Iterable[str]]]) -> Dict[Tuple[str, str], bool]:
+        # Resolve every (entity, class) pair up front: memo, local hierarchy and the
+        # per-pair ASK cache first, then the remainder in VALUES batches.
+        out: Dict[Tuple[str, str], bool] = {}
+        unresolved: List[Tuple[str, str]] = []
+        for ent, classes in checks:
+            for cls in classes:
+                key = (ent, cls)
+                if key in out:
+                    continue
+                hit = self._memo_get(key)
+                if hit is None:
+                    hit = self.local_answer(ent, cls)
+                    if hit is not None:
+                        self._memo_put(key, hit)
+                out[key] = bool(hit)
+                if hit is None:
+                    unresolved.append(key)
 
-    obj = triple["obj"]
-    exc = set(vlist[0].get("exceptions") or [])
-    if obj in exc:
-        return False
+        cached = self.cache.get_many([ask_query(*key) for key in unresolved])
+        missing: List[Tuple[str, str]] = []
+        for key in unresolved:
+            js = cached.get(ask_query(*key))
+            if js is None:
+                missing.append(key)
+                continue
+            out[key] = bool(js.get("boolean", False))
+            self._memo_put(key, out[key])
 
-    if types_cache is not None and obj in types_cache:
-        cached = set(types_cache.get(obj, []))
-        if cached.intersection(set(allowed)):
-            return False
-        if oracle is None:
-            return False
-        ok = any(oracle.is_instance_or_subclass(obj, a) for a in allowed)
-        return not ok
+        subs = [missing[i:i+self.batch_size] for i in range(0, len(missing), self.batch_size)]
+        # Batch answers are stored per pair below, so the VALUES queries themselves bypass the cache.
+        for sub, js in zip(subs, self.client.query_many([batch_check_query(sub) for sub in subs], use_cache=False)):
+            for b in js["results"]["bindings"]:
+                out[(qid(b["x"]["value"]), qid(b["c"]["value"]))] = True
+            self.cache.set_many({ask_query(*key): {"head": {}, "boolean": out[key]} for key in sub})
+            for key in sub:
+                self._memo_put(key, out[key])
+        return out
 
-    if oracle is None:
-        return False
-    ok = any(oracle.is_instance_or_subclass(obj, a) for a in allowed)
-    return not ok
+def _type_check(ent: str, tc: Optional[CompiledTypeConstraint], types_cache: Optional[Dict[str, List[str]]]) -> Optional[Tuple[str, Tuple[str, ...]]]:
+    if tc is None or ent in tc.exceptions:
+        return None
+    if types_cache is not None and ent in types_cache and not tc.allowed.isdisjoint(types_cache.get(ent, [])):
+        return None
+    return (ent, tc.classes)
 
-def violates_subject_type(triple: Dict[str, str], c: Dict[str, Any], oracle: Optional[TypeOracle], types_cache: Optional[Dict[str, List[str]]] = None) -> bool:
-    slist = c.get("subject_type", [])
-    if not slist:
+def pending_checks(triples: List[Dict[str, str]], c: Union[CompiledConstraint, Dict[str, Any]],
+                   types_cache: Optional[Dict[str, List[str]]] = None) -> List[Tuple[str, Tuple[str, ...]]]:
+    # The (entity, allowed classes) questions violates_*_type would put to the oracle.
+    c = compiled(c)
+    out = []
+    for t in triples:
+        for chk in (_type_check(t["obj"], c.value_type, types_cache), _type_check(t["subj"], c.subject_type, types_cache)):
+            if chk is not None:
+                out.append(chk)
+    return out
+
+def _violates_type(ent: str, tc: Optional[CompiledTypeConstraint], oracle: Optional[TypeOracle],
+                   types_cache: Optional[Dict[str, List[str]]]) -> bool:
+    if tc is None or ent in tc.exceptions:
         return False
-    allowed = slist[0].get("classes") or []
-    if not allowed:
+    # A cached type in the allowed set settles it; otherwise only the oracle can tell.
+    if types_cache is not None and ent in types_cache and not tc.allowed.isdisjoint(types_cache.get(ent, [])):
         return False
-
-    subj = triple["subj"]
-    exc = set(slist[0].get("exceptions") or [])
-    if subj in exc:
+    if oracle is None:
         return False
+    return not any(oracle.is_instance_or_subclass(ent, a) for a in tc.classes)
 
-    if types_cache is not None and subj in types_cache:
-        cached = set(types_cache.get(subj, []))
-        if cached.intersection(set(allowed)):
-            return False
-        if oracle is None:
-            return False
-        ok = any(oracle.is_instance_or_subclass(subj, a) for a in allowed)
-        return not ok
+def violates_value_type(triple: Dict[str, str], c: Union[CompiledConstraint, Dict[str, Any]], oracle: Optional[TypeOracle],
+                        types_cache: Optional[Dict[str, List[str]]] = None) -> bool:
+    return _violates_type(triple["obj"], compiled(c).value_type, oracle, types_cache)
 
-    if oracle is None:
-        return False
-    ok = any(oracle.is_instance_or_subclass(subj, a) for a in allowed)
-    return not ok
+def violates_subject_type(triple: Dict[str, str], c: Union[CompiledConstraint, Dict[str, Any]], oracle: Optional[TypeOracle],
+                          types_cache: Optional[Dict[str, List[str]]] = None) -> bool:
+    return _violates_type(triple["subj"], compiled(c).subject_type, oracle, types_cache)
 
-def violates_single_value(triples: List[Dict[str,str]], c: Dict[str, Any]) -> bool:
-    if not c.get("single_value", False):
+def violates_single_value(triples: List[Dict[str,str]], c: Union[CompiledConstraint, Dict[str, Any]]) -> bool:
+    if not compiled(c).single_value:
         return False
     seen = {}
     for t in triples:
         key = (t["subj"], t["pid"])
         seen.setdefault(key, set()).add(t["obj"])
     return any(len(v) >= 2 for v in seen.values())
+
+EVAL_COLUMNS = ["id", "test_type", "pid", "n_triples", "viol_value_type", "viol_subject_type",
+                "viol_single_value", "any_violation", "has_output"]
+
+def score_prediction(pr: Dict[str, Any], constraints: Union[ConstraintIndex, Dict[str, Any]], oracle: Optional[TypeOracle],
+                     types_cache: Optional[Dict[str, List[str]]] = None) -> Dict[str, Any]:
+    pid = pr["pid"]
+    c = compiled(constraints.get(pid, NO_CONSTRAINT))
+    triples = pr.get("triples", [])
+    v_val = any(violates_value_type(t, c, oracle, types_cache) for t in triples)
+    v_sub = any(violates_subject_type(t, c, oracle, types_cache) for t in triples)
+    v_single = violates_single_value(triples, c)
+    violated = v_val or v_sub or v_single
+    return {
+        "id": pr["id"],
+        "test_type": pr.get("test_type"),
+        "pid": pid,
+        "n_triples": len(triples),
+        "viol_value_type": int(v_val),
+        "viol_subject_type": int(v_sub),
+        "viol_single_value": int(v_single),
+        "any_violation": int(violated),
+        "has_output": int(len(triples) > 0),
+    }
+
+def score_predictions(preds: Iterable[Dict[str, Any]], constraints: Union[ConstraintIndex, Dict[str, Any]],
+                      oracle: Optional[TypeOracle], types_cache: Optional[Dict[str, List[str]]] = None,
+                      chunk_size: int=50_000) -> Iterator[Dict[str, Any]]:
+    # Two phases per chunk: resolve every oracle question of the chunk in bulk, then score.
+    constraints = ConstraintIndex.of(constraints)
+    for chunk in iter_chunks(preds, chunk_size):
+        if oracle is not None:
+            checks = []
+            for pr in chunk:
+                checks.extend(pending_checks(pr.get("triples", []), constraints.get(pr["pid"], NO_CONSTRAINT), types_cache))
+            oracle.check_many(checks)
+        for pr in chunk:
+            yield score_prediction(pr, constraints, oracle, types_cache)
+
+class LeakageSummary:
+    def __init__(self):
+        self.rows = 0
+        self.rows_with_output = 0
+        self.violations = 0
+        self.violations_with_output = 0
+
+    def add(self, row: Dict[str, Any]):
+        self.rows += 1
+        self.violations += row["any_violation"]
+        if row["has_output"]:
+            self.rows_with_output += 1
+            self.violations_with_output += row["any_violation"]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "ITLR": self.violations_with_output / self.rows_with_output if self.rows_with_output else 0.0,
+            "rows": self.rows,
+            "rows_with_output": self.rows_with_output,
+            "viol_rate_any": self.violations / self.rows if self.rows else 0.0,
+        }
+
+# Paired evaluation (05 --orig_preds): one row per pair with the contrast flags under the
+# EVAL_COLUMNS names and the orig ones prefixed "orig_", plus the pair's outcome:
+#   leaked         the contrast output violates a constraint, the orig output does not
+#   already_wrong  both violate: the model was wrong before the edit
+#   orig_only      only the orig output violates
+#   clean          neither violates (contrast output present); no_output: neither, no contrast triples
+#   missing_orig / missing_contrast / missing_both: the pair has no row in that run
+PAIR_OUTCOMES = ["leaked", "already_wrong", "orig_only", "clean", "no_output",
+                 "missing_orig", "missing_contrast", "missing_both"]
+_FLAGS = EVAL_COLUMNS[3:]
+PAIRED_COLUMNS = ["id", "test_type", "pid", "outcome"] + _FLAGS + [f"orig_{c}" for c in _FLAGS]
+
+def pair_outcome(orig: Optional[Dict[str, Any]], contrast: Optional[Dict[str, Any]]) -> str:
+    if orig is None or contrast is None:
+        return "missing_both" if orig is contrast else "missing_orig" if orig is None else "missing_contrast"
+    if contrast["any_violation"]:
+        return "already_wrong" if orig["any_violation"] else "leaked"
+    if orig["any_violation"]:
+        return "orig_only"
+    return "clean" if contrast["has_output"] else "no_output"
+
+def paired_row(key: Tuple[str, str], pid: str, orig: Optional[Dict[str, Any]], contrast: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    row = {"id": key[0], "test_type": key[1] or None, "pid": pid, "outcome": pair_outcome(orig, contrast)}
+    for c in _FLAGS:
+        row[c] = contrast[c] if contrast is not None else None
+        row[f"orig_{c}"] = orig[c] if orig is not None else None
+    return row
+
+class PairedSummary:
+    def __init__(self):
+        self.contrast = LeakageSummary()
+        self.orig = LeakageSummary()
+        self.outcomes = dict.fromkeys(PAIR_OUTCOMES, 0)
+
+    def add(self, row: Dict[str, Any]):
+        self.outcomes[row["outcome"]] += 1
+        if row["has_output"] is not None:
+            self.contrast.add(row)
+        if row["orig_has_output"] is not None:
+            self.orig.add({"any_violation": row["orig_any_violation"], "has_output": row["orig_has_output"]})
+
+    def to_dict(self) -> Dict[str, Any]:
+        c, o = self.contrast.to_dict(), self.orig.to_dict()
+        n = self.outcomes
+        # Of the pairs whose orig output was fine, the share that violates after the edit.
+        ok = n["leaked"] + n["clean"] + n["no_output"]
+        return {
+            "ITLR": c["ITLR"],
+            "orig_ITLR": o["ITLR"],
+            "delta_ITLR": c["ITLR"] - o["ITLR"],
+            "pairs": sum(n.values()),
+            "rows": c["rows"],
+            "rows_with_output": c["rows_with_output"],
+            "orig_rows": o["rows"],
+            "orig_rows_with_output": o["rows_with_output"],
+            "viol_rate_any": c["viol_rate_any"],
+            "orig_viol_rate_any": o["viol_rate_any"],
+            "leak_rate": n["leaked"] / ok if ok else 0.0,
+            **n,
+        }
@@ -0,0 +1,103 @@
+from __future__ import annotations
+import json
+from pathlib import Path
+from typing import Dict, FrozenSet, Iterable, List, Optional
+from .wikidata import SparqlClient, qid, rate_from_sleep
+from .io_utils import Cache
+
+class ClassHierarchy:
+    # P279 graph as {class: [direct superclasses]}. A class missing from the map
+    # was never fetched, so anything above it is unknown.
+    def __init__(self, parents: Dict[str, List[str]]):
+        self.parents = {c: tuple(ps) for c, ps in parents.items()}
+        self._closure: Dict[str, Optional[FrozenSet[str]]] = {}
+
+    @classmethod
+    def load(cls, path: str | Path) -> "ClassHierarchy":
+        return cls(json.loads(Path(path).read_text(encoding="utf-8")))
+
+    def __contains__(self, cls_qid: str) -> bool:
+        return cls_qid in self.parents
+
+    def __len__(self) -> int:
+        return len(self.parents)
+
+    def ancestors(self, cls_qid: str) -> Optional[FrozenSet[str]]:
+        # Reflexive-transitive closure (wdt:P279*); None when the closure reaches an unfetched class.
+        if cls_qid in self._closure:
+            return self._closure[cls_qid]
+        seen = {cls_qid}
+        stack = [cls_qid]
+        complete = True
+        while stack and complete:
+            c = stack.pop()
+            ps = self.parents.get(c)
+            if ps is None:
+                complete = False
+                break
+            for p in ps:
+                if p in seen:
+                    continue
+                if p in self._closure:
+                    anc = self._closure[p]
+                    if anc is None:
+                        complete = False
+                        break
+                    seen.update(anc)
+                    continue
+                seen.add(p)
+                stack.append(p)
+        out = frozenset(seen) if complete else None
+        self._closure[cls_qid] = out
+        return out
+
+    def precompute(self) -> "ClassHierarchy":
+        for c in self.parents:
+            self.ancestors(c)
+        return self
+
+    def is_subclass(self, cls_qid: str, target_qid: str) -> Optional[bool]:
+        anc = self.ancestors(cls_qid)
+        if anc is None:
+            return None
+        return target_qid in anc
+
+    def entity_is_a(self, ent_types: Iterable[str], target_qid: str) -> Optional[bool]:
+        # Local answer to "wd:X wdt:P31/wdt:P279* wd:C" from X's direct P31 types.
+        unknown = False
+        for t in ent_types:
+            hit = self.is_subclass(t, target_qid)
+            if hit:
+                return True
+            if hit is None:
+                unknown = True
+        return None if unknown else False
+
+def subclass_query(classes: List[str]) -> str:
+    values = " ".join([f"wd:{c}" for c in classes])
+    return f"""
+    SELECT ?c ?p WHERE {{
+      VALUES ?c {{ {values} }}
+      OPTIONAL {{ ?c wdt:P279 ?p . }}
+    }}
+    """
+
+def fetch_subclass_edges(classes: Iterable[str], cache: Optional[Cache]=None, sleep: float=0.1,
+                         chunk: int=200, parents: Optional[Dict[str, List[str]]]=None,
+                         client: Optional[SparqlClient]=None) -> Dict[str, List[str]]:
+    client = client or SparqlClient(cache=cache, rate=rate_from_sleep(sleep), max_workers=1)
+    parents = dict(parents or {})
+    frontier = sorted({c for c in classes if c and c not in parents})
+    while frontier:
+        subs = [frontier[i:i+chunk] for i in range(0, len(frontier), chunk)]
+        for sub, js in zip(subs, client.query_many([subclass_query(sub) for sub in subs])):
+            for c in sub:
+                parents.setdefault(c, [])
+            for b in js["results"]["bindings"]:
+                if "p" in b:
+                    c = qid(b["c"]["value"])
+                    p = qid(b["p"]["value"])
+                    if p not in parents[c]:
+                        parents[c].append(p)
+        frontier = sorted({p for c in frontier for p in parents[c] if p not in parents})
+    return {c: sorted(ps) for c, ps in parents.items()}
@@ -1,23 +1,221 @@
 from __future__ import annotations
-import json, hashlib
+import bz2, csv, glob, gzip, itertools, json, hashlib, multiprocessing as mp, os, sqlite3, threading, time, zlib
 from pathlib import Path
-from typing import Any
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional, Union
+from . import metrics
 
-def read_jsonl(path: str | Path):
+try:  # optional, several times faster than json.loads on JSONL rows
+    import orjson
+except ImportError:
+    orjson = None
+
+def loads(s: Union[str, bytes]) -> Any:
+    if orjson is not None:
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            pass  # NaN/Infinity or ints beyond 64 bits: the stdlib accepts them
+    return json.loads(s)
+
+# Writes stay on the stdlib so output files are byte-identical with or without orjson; one
+# shared encoder instead of json.dumps, which builds a new one per call.
+_encode = json.JSONEncoder(ensure_ascii=False).encode
+
+def _dumps(r: Any) -> str:
+    return _encode(r) + "\n"
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError("Reading or writing .zst files needs zstandard (pip install zstandard).") from e
+    return zstandard
+
+def open_binary(path: str | Path, mode: str="rb") -> IO[bytes]:
+    # Compression is chosen from the suffix: .gz, .bz2, .zst/.zstd, otherwise plain.
+    name = str(path)
+    if name.endswith(".gz"):
+        # Level 1: ~4x faster than the default 9 and only slightly larger on JSONL.
+        return gzip.open(path, mode, compresslevel=1) if "w" in mode or "a" in mode else gzip.open(path, mode)
+    if name.endswith(".bz2"):
+        return bz2.open(path, mode)
+    if name.endswith((".zst", ".zstd")):
+        return _zstd().open(path, mode)
+    return open(path, mode)
+
+def jsonl_files(path: str | Path) -> List[Path]:
+    # A file, a directory of part-*.jsonl[.gz|.zst] shards, or a glob pattern; shards in name order.
+    name = str(path)
+    if any(c in name for c in "*?["):
+        return [Path(p) for p in sorted(glob.glob(name))]
     path = Path(path)
-    with path.open("r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
+    if path.is_dir():
+        return sorted(p for p in path.iterdir() if p.name.startswith("part-") and ".jsonl" in p.name)
+    return [path]
+
+def _blocks(path: Path, block_size: int) -> Iterator[bytes]:
+    # Large reads cut at the last newline, so every block holds whole lines.
+    with open_binary(path) as f:
+        rest = b""
+        while True:
+            data = f.read(block_size)
+            if not data:
+                break
+            cut = data.rfind(b"\n")
+            if cut < 0:
+                rest += data
                 continue
-            yield json.loads(line)
+            yield rest + data[:cut + 1]
+            rest = data[cut + 1:]
+        if rest.strip():
+            yield rest
+
+def _parse_block(block: bytes) -> List[Any]:
+    return [loads(line) for line in block.split(b"\n") if line.strip()]
+
+def read_jsonl(path: str | Path, workers: int=0, block_size: int=1 << 22):
+    # workers > 0 decodes blocks in a process pool (rows still come back in file order); it pays
+    # off for large rows without orjson, where decoding rather than pickling dominates.
+    blocks = (b for p in jsonl_files(path) for b in _blocks(p, block_size))
+    if workers <= 0:
+        for b in blocks:
+            yield from _parse_block(b)
+        return
+    ctx = mp.get_context("fork") if "fork" in mp.get_all_start_methods() else mp.get_context()
+    with ctx.Pool(workers) as pool:
+        for rows in pool.imap(_parse_block, blocks):
+            yield from rows
 
-def write_jsonl(path: str | Path, rows):
+def write_jsonl(path: str | Path, rows, shard_size: Optional[int]=None, compression: Optional[str]=None):
+    w = JsonlWriter(path, shard_size=shard_size, compression=compression)
+    try:
+        w.write_rows(rows)
+    finally:
+        w.close()
+
+def write_json_atomic(path: str | Path, obj: Any, indent: Optional[int]=2):
+    # Write to a sibling temp file and rename, so readers never see a half-written file.
     path = Path(path)
     path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("w", encoding="utf-8") as f:
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(obj, ensure_ascii=False, indent=indent), encoding="utf-8")
+    os.replace(tmp, path)
+
+def iter_chunks(rows: Iterable[Any], size: int):
+    it = iter(rows)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+class CsvRowWriter:
+    def __init__(self, path: str | Path, columns: List[str]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._f = self.path.open("w", encoding="utf-8", newline="")
+        self._w = csv.DictWriter(self._f, fieldnames=columns, extrasaction="ignore", lineterminator="\n")
+        self._w.writeheader()
+
+    def write_rows(self, rows: List[Dict[str, Any]]):
+        self._w.writerows(rows)
+
+    def close(self):
+        self._f.close()
+
+class ParquetRowWriter:
+    def __init__(self, path: str | Path, columns: List[str]):
+        try:
+            import pyarrow as pa, pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Parquet output needs pyarrow (pip install pyarrow).") from e
+        self._pa = pa
+        self._pq = pq
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.columns = columns
+        self._w = None
+
+    def write_rows(self, rows: List[Dict[str, Any]]):
+        if not rows:
+            return
+        pa = self._pa
+        if self._w is None:
+            table = pa.Table.from_pylist(rows).select(self.columns)
+            # A column that is all-null in the first chunk would otherwise be typed null for the whole file.
+            schema = pa.schema([pa.field(f.name, pa.string()) if pa.types.is_null(f.type) else f for f in table.schema])
+            self._w = self._pq.ParquetWriter(str(self.path), schema)
+        self._w.write_table(pa.Table.from_pylist(rows, schema=self._w.schema))
+
+    def close(self):
+        if self._w is not None:
+            self._w.close()
+
+def open_row_writer(path: str | Path, columns: List[str]):
+    if str(path).endswith(".parquet"):
+        return ParquetRowWriter(path, columns)
+    return CsvRowWriter(path, columns)
+
+class JsonlWriter:
+    # Buffered JSONL writer. With shard_size, `path` is a directory of part-00000.jsonl files
+    # (plus .gz/.zst with `compression`) of at most shard_size rows each; otherwise the file
+    # suffix picks the compression.
+    def __init__(self, path: str | Path, shard_size: Optional[int]=None, compression: Optional[str]=None,
+                 buffer_bytes: int=1 << 20):
+        self.path = Path(path)
+        self.shard_size = shard_size
+        self.suffix = f".jsonl.{compression}" if compression else ".jsonl"
+        self.buffer_bytes = buffer_bytes
+        self.rows = 0
+        self._buf: List[str] = []
+        self._nbuf = 0
+        self._f: Optional[IO[bytes]] = None
+        self._shard = -1
+        if shard_size:
+            self.path.mkdir(parents=True, exist_ok=True)
+            for old in jsonl_files(self.path):  # stale shards from an earlier, longer run
+                old.unlink()
+        else:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._f = open_binary(self.path, "wb")
+
+    def _next_shard(self):
+        if self._f is not None:
+            self._f.close()
+        self._shard += 1
+        self._f = open_binary(self.path / f"part-{self._shard:05d}{self.suffix}", "wb")
+
+    def _flush(self):
+        if self._buf:
+            self._f.write("".join(self._buf).encode("utf-8"))
+            self._buf, self._nbuf = [], 0
+
+    def write_rows(self, rows: Iterable[Any]):
+        buf, limit, shard = self._buf, self.buffer_bytes, self.shard_size
         for r in rows:
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+            if shard and self.rows % shard == 0:
+                self._flush()
+                self._next_shard()
+                buf = self._buf
+            line = _dumps(r)
+            buf.append(line)
+            self._nbuf += len(line)
+            self.rows += 1
+            if self._nbuf >= limit:
+                self._flush()
+                buf = self._buf
+
+    def close(self):
+        if self._f is None and self.shard_size:
+            self._next_shard()  # an empty sharded output still gets one (empty) part
+        self._flush()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
 def sha1(s: str) -> str:
     return hashlib.sha1(s.encode("utf-8")).hexdigest()
@@ -26,13 +224,173 @@ class SimpleDiskCache:
     def __init__(self, root: str | Path):
         self.root = Path(root)
         self.root.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
 
     def get(self, key: str):
         p = self.root / f"{sha1(key)}.json"
-        if p.exists():
-            return json.loads(p.read_text(encoding="utf-8"))
-        return None
+        try:
+            val = json.loads(p.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            self.misses += 1
+            metrics.incr("cache.misses")
+            return None
+        self.hits += 1
+        metrics.incr("cache.hits")
+        return val
 
     def set(self, key: str, val: Any):
         p = self.root / f"{sha1(key)}.json"
         p.write_text(json.dumps(val, ensure_ascii=False), encoding="utf-8")
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        out = {}
+        for k in keys:
+            v = self.get(k)
+            if v is not None:
+                out[k] = v
+        return out
+
+    def set_many(self, items: Dict[str, Any]):
+        for k, v in items.items():
+            self.set(k, v)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+class SqliteCache:
+    # Single-file cache keyed by sha1(query). WAL mode + busy timeout let several
+    # worker processes share one file; each process opens its own connection.
+    SQLITE_SUFFIXES = (".sqlite", ".sqlite3", ".db")
+
+    def __init__(self, path: str | Path, max_entries: Optional[int]=None, ttl: Optional[float]=None,
+                 compress: bool=True, evict_every: int=1000, timeout: float=60.0):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.compress = compress
+        self.evict_every = evict_every
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        with self._lock:
+            self._connect().execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "k TEXT PRIMARY KEY, v BLOB NOT NULL, z INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache(accessed)")
+            self._conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(str(self.path), timeout=self.timeout, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._pid = os.getpid()
+        return self._conn
+
+    def __getstate__(self):
+        d = dict(self.__dict__)
+        d["_conn"] = None
+        d["_lock"] = None
+        return d
+
+    def __setstate__(self, d):
+        self.__dict__.update(d)
+        self._lock = threading.Lock()
+
+    def _encode(self, val: Any):
+        raw = json.dumps(val, ensure_ascii=False).encode("utf-8")
+        return (zlib.compress(raw), 1) if self.compress else (raw, 0)
+
+    @staticmethod
+    def _decode(blob: bytes, z: int) -> Any:
+        return json.loads(zlib.decompress(blob) if z else blob)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        by_hash = {sha1(k): k for k in keys}
+        hashes = list(by_hash)
+        now = time.time()
+        out, expired = {}, []
+        with self._lock:
+            conn = self._connect()
+            for i in range(0, len(hashes), 500):
+                sub = hashes[i:i+500]
+                marks = ",".join("?" * len(sub))
+                for h, blob, z, created in conn.execute(
+                        f"SELECT k, v, z, created FROM cache WHERE k IN ({marks})", sub):
+                    if self.ttl is not None and now - created > self.ttl:
+                        expired.append(h)
+                        continue
+                    out[by_hash[h]] = self._decode(blob, z)
+            hit_hashes = [sha1(k) for k in out]
+            if hit_hashes or expired:
+                conn.executemany("UPDATE cache SET accessed=? WHERE k=?", [(now, h) for h in hit_hashes])
+                conn.executemany("DELETE FROM cache WHERE k=?", [(h,) for h in expired])
+                conn.commit()
+        self.hits += len(out)
+        self.misses += len(by_hash) - len(out)
+        metrics.incr("cache.hits", len(out))
+        metrics.incr("cache.misses", len(by_hash) - len(out))
+        return out
+
+    def get(self, key: str):
+        return self.get_many([key]).get(key)
+
+    def set_many(self, items: Dict[str, Any]):
+        now = time.time()
+        rows = [(sha1(k), *self._encode(v), now, now) for k, v in items.items()]
+        with self._lock:
+            conn = self._connect()
+            conn.executemany("INSERT OR REPLACE INTO cache (k, v, z, created, accessed) VALUES (?, ?, ?, ?, ?)", rows)
+            conn.commit()
+            self._writes += len(rows)
+            if self.max_entries is not None and self._writes >= self.evict_every:
+                self._evict(conn)
+
+    def set(self, key: str, val: Any):
+        self.set_many({key: val})
+
+    def _evict(self, conn: sqlite3.Connection):
+        self._writes = 0
+        if self.ttl is not None:
+            conn.execute("DELETE FROM cache WHERE created < ?", (time.time() - self.ttl,))
+        n = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        if n > self.max_entries:
+            conn.execute("DELETE FROM cache WHERE k IN (SELECT k FROM cache ORDER BY accessed LIMIT ?)",
+                         (n - self.max_entries,))
+        conn.commit()
+
+    def evict(self):
+        with self._lock:
+            conn = self._connect()
+            if self.max_entries is None and self.ttl is not None:
+                conn.execute("DELETE FROM cache WHERE created < ?", (time.time() - self.ttl,))
+                conn.commit()
+            elif self.max_entries is not None:
+                self._evict(conn)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connect().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+Cache = Union[SimpleDiskCache, SqliteCache]
+
+def open_cache(path: str | Path, **kwargs) -> Cache:
+    # `--cache_dir` values ending in .sqlite/.sqlite3/.db select the single-file store.
+    if str(path).endswith(SqliteCache.SQLITE_SUFFIXES):
+        return SqliteCache(path, **kwargs)
+    return SimpleDiskCache(path)
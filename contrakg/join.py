@@ -0,0 +1,157 @@
+from __future__ import annotations
+import heapq, itertools, shutil, tempfile
+from operator import itemgetter
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from .io_utils import _encode, loads
+
+# Three-way join of the pairs file with the per-example rows of the orig and contrast runs on
+# (id, test_type). "hash" keeps the pairs (key -> pid) and the orig rows in dicts and streams
+# the contrast rows past them; results come in contrast order, then the pairs no contrast row
+# matched. "sort" is an external sort-merge: each input is cut into sorted runs on disk and
+# the three k-way merged streams are grouped by key, so memory holds one run per input;
+# results come in key order. "auto" starts as a hash join and turns into the sort-merge when
+# the two tables grow past max_rows. Rows of one input with the same key: the first wins.
+
+Key = Tuple[str, str]
+JOIN_METHODS = ("auto", "hash", "sort")
+
+def join_key(row: Dict[str, Any]) -> Key:
+    return (str(row["id"]), row.get("test_type") or "")
+
+class ExternalSorter:
+    # (key, value) records in sorted runs of run_size; sorted() merges them, stable on ties.
+    def __init__(self, root: Path, name: str, run_size: int):
+        self.root, self.name, self.run_size = root, name, run_size
+        self.buf: List[Tuple[Key, Any]] = []
+        self.runs: List[Path] = []
+
+    def add(self, key: Key, value: Any):
+        self.buf.append((key, value))
+        if len(self.buf) >= self.run_size:
+            self._spill()
+
+    def _spill(self):
+        self.buf.sort(key=itemgetter(0))
+        path = self.root / f"{self.name}-{len(self.runs):05d}.jsonl"
+        with path.open("w", encoding="utf-8") as f:
+            f.write("".join(_encode([k[0], k[1], v]) + "\n" for k, v in self.buf))
+        self.runs.append(path)
+        self.buf = []
+
+    @staticmethod
+    def _read(path: Path) -> Iterator[Tuple[Key, Any]]:
+        with path.open("rb") as f:
+            for line in f:
+                i, t, v = loads(line)
+                yield (i, t), v
+
+    def sorted(self) -> Iterator[Tuple[Key, Any]]:
+        self.buf.sort(key=itemgetter(0))
+        if not self.runs:
+            return iter(self.buf)
+        return heapq.merge(*[self._read(p) for p in self.runs], iter(self.buf), key=itemgetter(0))
+
+class PairedJoin:
+    def __init__(self, method: str="auto", max_rows: int=2_000_000, tmp_dir: Optional[str]=None):
+        if method not in JOIN_METHODS:
+            raise ValueError(f"join method must be one of {JOIN_METHODS}, got {method!r}")
+        self.method = method
+        self.max_rows = max_rows
+        self.tmp_dir = tmp_dir
+        self.root: Optional[Path] = None
+        # unmatched_*: rows without a pair (or a duplicate key); missing_*: pairs without that row.
+        self.stats = {"method": method, "pairs": 0, "matched": 0, "missing_orig": 0, "missing_contrast": 0,
+                      "unmatched_orig": 0, "unmatched_contrast": 0, "duplicate_pairs": 0, "runs": 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.root is not None:
+            shutil.rmtree(self.root, ignore_errors=True)
+            self.root = None
+
+    def join(self, pairs: Iterable[Dict[str, Any]], orig: Iterable[Dict[str, Any]],
+             contrast: Iterable[Dict[str, Any]]) -> Iterator[Tuple[Key, str, Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]:
+        # Yields (key, pid, orig row or None, contrast row or None) once per distinct pair key.
+        if self.method == "sort":
+            yield from self._sort_merge({}, iter(pairs), {}, iter(orig), contrast)
+            return
+        limit = self.max_rows if self.method == "auto" else None
+        pairs, orig = iter(pairs), iter(orig)
+        ptab: Dict[Key, str] = {}
+        otab: Dict[Key, Dict[str, Any]] = {}
+        for tab, rows, val in ((ptab, pairs, itemgetter("pid")), (otab, orig, None)):
+            for r in rows:
+                k = join_key(r)
+                if k in tab:
+                    self.stats["duplicate_pairs" if tab is ptab else "unmatched_orig"] += 1
+                    continue
+                tab[k] = val(r) if val else r
+                if limit is not None and len(ptab) + len(otab) > limit:
+                    yield from self._sort_merge(ptab, pairs, otab, orig, contrast)
+                    return
+        self.stats["method"] = "hash"
+        st = self.stats
+        for c in contrast:
+            k = join_key(c)
+            pid = ptab.pop(k, None)
+            if pid is None:
+                st["unmatched_contrast"] += 1
+                continue
+            o = otab.pop(k, None)
+            st["pairs"] += 1
+            st["matched" if o is not None else "missing_orig"] += 1
+            yield k, pid, o, c
+        for k, pid in ptab.items():
+            o = otab.pop(k, None)
+            st["pairs"] += 1
+            st["missing_contrast"] += 1
+            st["missing_orig"] += o is None
+            yield k, pid, o, None
+        st["unmatched_orig"] += len(otab)
+
+    def _sort_merge(self, ptab: Dict[Key, str], pairs: Iterator[Dict[str, Any]], otab: Dict[Key, Dict[str, Any]],
+                    orig: Iterator[Dict[str, Any]], contrast: Iterable[Dict[str, Any]]):
+        # Rows already in the hash tables go into the first runs, the rest of each input follows.
+        self.stats["method"] = "sort"
+        if self.root is None:
+            self.root = Path(tempfile.mkdtemp(prefix="paired_join_", dir=self.tmp_dir))
+        run_size = max(1, self.max_rows // 2)
+        sorters = [ExternalSorter(self.root, name, run_size) for name in ("pairs", "orig", "contrast")]
+        for sorter, tab, rows, val in ((sorters[0], ptab, pairs, itemgetter("pid")), (sorters[1], otab, orig, None),
+                                       (sorters[2], {}, iter(contrast), None)):
+            for k, v in tab.items():
+                sorter.add(k, v)
+            tab.clear()
+            for r in rows:
+                sorter.add(join_key(r), val(r) if val else r)
+        self.stats["runs"] = sum(len(s.runs) for s in sorters)
+
+        def tagged(i: int):
+            return ((k, i, v) for k, v in sorters[i].sorted())
+
+        st = self.stats
+        for k, grp in itertools.groupby(heapq.merge(tagged(0), tagged(1), tagged(2), key=itemgetter(0)), key=itemgetter(0)):
+            got: List[Any] = [None, None, None]
+            n = [0, 0, 0]
+            for _, i, v in grp:
+                if not n[i]:
+                    got[i] = v
+                n[i] += 1
+            if not n[0]:
+                st["unmatched_orig"] += n[1]
+                st["unmatched_contrast"] += n[2]
+                continue
+            st["duplicate_pairs"] += n[0] - 1
+            st["unmatched_orig"] += max(n[1] - 1, 0)
+            st["unmatched_contrast"] += max(n[2] - 1, 0)
+            st["pairs"] += 1
+            st["matched"] += bool(n[1] and n[2])
+            st["missing_orig"] += not n[1]
+            st["missing_contrast"] += not n[2]
+            yield k, got[0], got[1], got[2]
@@ -0,0 +1,61 @@
+from __future__ import annotations
+import functools, re
+from typing import Any, Dict, Iterable, List, Tuple
+
+Span = Tuple[int, int]
+
+class LabelMatcher:
+    # Aho-Corasick automaton over a fixed label vocabulary: one pass over a sentence reports
+    # every occurrence (overlaps included) of every label as (start, end) spans.
+    def __init__(self, labels: Iterable[str]):
+        self.labels: List[str] = sorted({l for l in labels if l})
+        self._label_set = frozenset(self.labels)
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+        for li, lab in enumerate(self.labels):
+            s = 0
+            for ch in lab:
+                nxt = self._goto[s].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[s][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                s = nxt
+            self._out[s].append(li)
+        queue = list(self._goto[0].values())
+        for s in queue:
+            for ch, t in self._goto[s].items():
+                queue.append(t)
+                f = self._fail[s]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[t] = self._goto[f].get(ch, 0) if s else 0
+                self._out[t] = self._out[t] + self._out[self._fail[t]]
+
+    @classmethod
+    def from_pairs(cls, pairs: Iterable[Dict[str, Any]]) -> "LabelMatcher":
+        fields = ("subj_label", "obj_label", "contrast_subj_label", "contrast_obj_label", "extra_obj_label")
+        return cls(p.get(f) or "" for p in pairs for f in fields)
+
+    def __contains__(self, label: str) -> bool:
+        return label in self._label_set
+
+    def find(self, text: str) -> Dict[str, List[Span]]:
+        goto, fail, out, labels = self._goto, self._fail, self._out, self.labels
+        res: Dict[str, List[Span]] = {}
+        s = 0
+        for i, ch in enumerate(text):
+            while s and ch not in goto[s]:
+                s = fail[s]
+            s = goto[s].get(ch, 0)
+            for li in out[s]:
+                lab = labels[li]
+                res.setdefault(lab, []).append((i + 1 - len(lab), i + 1))
+        return res
+
+@functools.lru_cache(maxsize=65536)
+def word_pattern(label: str, ignore_case: bool=False) -> "re.Pattern[str]":
+    return re.compile(rf"\b{re.escape(label)}\b", flags=re.IGNORECASE if ignore_case else 0)
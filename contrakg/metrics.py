@@ -0,0 +1,174 @@
+from __future__ import annotations
+import argparse, atexit, os, platform, sys, threading, time
+from typing import Any, Dict, List, Optional
+
+# Process-wide run instrumentation. Scripts open stages around their main phases and the
+# SPARQL client / query caches bump counters:
+#   sparql.requests, sparql.bytes, sparql.time_s, sparql.retries, sparql.retry_wait_s,
+#   sparql.throttle_s (token-bucket waits), sparql.deduped, sparql.errors,
+#   cache.hits, cache.misses
+# Everything is off until enable(); disabled, stage() returns a shared no-op and incr()
+# returns on its first line. Counters from pool worker processes are not collected, the
+# stage around the pool still times it.
+
+_MB = 1 << 20
+
+class _Registry:
+    def __init__(self):
+        self.enabled = False
+        self.trace_memory = False
+        self.counters: Dict[str, float] = {}
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+        self.stack: List["_Stage"] = []
+        self.t0 = time.perf_counter()
+        self.c0 = time.process_time()
+
+_REG = _Registry()
+
+def enabled() -> bool:
+    return _REG.enabled
+
+def enable(trace_memory: bool=False):
+    global _REG
+    _REG = _Registry()
+    _REG.enabled = True
+    if trace_memory:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _REG.trace_memory = True
+
+def disable():
+    if _REG.trace_memory:
+        import tracemalloc
+        tracemalloc.stop()
+    _REG.enabled = _REG.trace_memory = False
+
+def incr(name: str, n: float=1):
+    if not _REG.enabled:
+        return
+    with _REG.lock:
+        _REG.counters[name] = _REG.counters.get(name, 0) + n
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add(self, n: int=1):
+        pass
+
+_NULL = _NullStage()
+
+class _Stage:
+    __slots__ = ("name", "items", "_t0", "_c0", "_peak")
+
+    def __init__(self, name: str, items: int=0):
+        self.name = name
+        self.items = items
+
+    def add(self, n: int=1):
+        self.items += n
+
+    def __enter__(self):
+        if _REG.trace_memory:
+            import tracemalloc
+            # Nested stages reset the peak; the parent keeps the max seen so far.
+            if _REG.stack:
+                _REG.stack[-1]._peak = max(_REG.stack[-1]._peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            _REG.stack.append(self)
+        self._peak = 0
+        self._t0, self._c0 = time.perf_counter(), time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        wall, cpu = time.perf_counter() - self._t0, time.process_time() - self._c0
+        peak = None
+        if _REG.trace_memory and _REG.stack and _REG.stack[-1] is self:
+            import tracemalloc
+            _REG.stack.pop()
+            peak = max(self._peak, tracemalloc.get_traced_memory()[1])
+            if _REG.stack:
+                _REG.stack[-1]._peak = max(_REG.stack[-1]._peak, peak)
+        with _REG.lock:
+            st = _REG.stages.setdefault(self.name, {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "items": 0})
+            st["calls"] += 1
+            st["wall_s"] += wall
+            st["cpu_s"] += cpu
+            st["items"] += self.items
+            if peak is not None:
+                st["peak_mb"] = max(st.get("peak_mb", 0.0), peak / _MB)
+        return False
+
+def stage(name: str, items: int=0):
+    # with stage("score") as st: ... st.add(len(chunk))
+    return _Stage(name, items) if _REG.enabled else _NULL
+
+def _max_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / _MB if sys.platform == "darwin" else rss / 1024
+
+def snapshot() -> Dict[str, Any]:
+    with _REG.lock:
+        counters = dict(_REG.counters)
+        stages = {k: dict(v) for k, v in _REG.stages.items()}
+    for st in stages.values():
+        st["wall_s"], st["cpu_s"] = round(st["wall_s"], 6), round(st["cpu_s"], 6)
+        if st["items"]:
+            st["items_per_s"] = round(st["items"] / st["wall_s"], 2) if st["wall_s"] else None
+        if "peak_mb" in st:
+            st["peak_mb"] = round(st["peak_mb"], 3)
+    derived = {}
+    lookups = counters.get("cache.hits", 0) + counters.get("cache.misses", 0)
+    if lookups:
+        derived["cache.hit_rate"] = round(counters.get("cache.hits", 0) / lookups, 4)
+    if counters.get("sparql.requests"):
+        derived["sparql.mean_latency_s"] = round(counters.get("sparql.time_s", 0) / counters["sparql.requests"], 6)
+    return {
+        "wall_s": round(time.perf_counter() - _REG.t0, 6),
+        "cpu_s": round(time.process_time() - _REG.c0, 6),
+        "max_rss_mb": _max_rss_mb(),
+        "stages": stages,
+        "counters": {k: round(v, 6) if isinstance(v, float) else v for k, v in sorted(counters.items())},
+        "derived": derived,
+    }
+
+def add_arguments(ap: argparse.ArgumentParser):
+    ap.add_argument("--metrics", default=None, help="write stage timings and SPARQL/cache counters to this JSON file")
+    ap.add_argument("--profile", default=None, help="also write cProfile stats (pstats format) to this file")
+    ap.add_argument("--trace_memory", action="store_true", help="with --metrics, record the tracemalloc peak per stage")
+
+def start(args: argparse.Namespace, script: str):
+    # Called by scripts right after parse_args: honours --metrics/--profile/--trace_memory and
+    # writes the results when the interpreter exits (also after an exception).
+    path, prof_path = getattr(args, "metrics", None), getattr(args, "profile", None)
+    if path:
+        enable(trace_memory=getattr(args, "trace_memory", False))
+    prof = None
+    if prof_path:
+        import cProfile
+        prof = cProfile.Profile()
+        prof.enable()
+    if path or prof is not None:
+        atexit.register(_finish, path, prof, prof_path, script, os.getpid())
+
+def _finish(path: Optional[str], prof, prof_path: Optional[str], script: str, pid: int):
+    if os.getpid() != pid:  # forked worker inheriting the handler
+        return
+    if prof is not None:
+        prof.disable()
+        prof.dump_stats(prof_path)
+    if path:
+        from .io_utils import write_json_atomic
+        out = {"script": script, "argv": sys.argv[1:], "python": platform.python_version(),
+               "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"), **snapshot()}
+        disable()
+        write_json_atomic(path, out)
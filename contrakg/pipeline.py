@@ -0,0 +1,323 @@
+from __future__ import annotations
+import argparse, ast, hashlib, json, os, shutil, subprocess, sys, threading, time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from .io_utils import write_json_atomic
+
+# Runs steps 01-05 as a DAG of content-addressed stages:
+#   python -m contrakg.pipeline pipeline.json [--jobs 2] [--force eval.string_match] [--dry_run]
+#
+# A stage's fingerprint hashes its script and the contrakg modules it imports, its parameters,
+# and the *content* of its inputs (external files and upstream outputs alike). Outputs live in
+# <store>/<kind>/<fingerprint>/; a stage whose directory already exists is not re-run, so
+# experiments sharing a store share every common prefix (e.g. the same pairs scored by several
+# predictors). Steps 01-03 also depend on WDQS, which is not fingerprinted: use --force to refresh.
+#
+# Config (paths relative to the working directory):
+#   {"store": ".pipeline", "out_dir": "outputs/run1", "jobs": 2,
+#    "inputs": {"examples": "data/examples.jsonl", "pids": "data/pids.txt"},
+#    "wdqs": {"endpoint": "...", "cache_dir": ".cache_wdqs", "sleep": 0.1},
+#    "stages": {"pairs": {"max_pairs": 20000}, "eval": {"engine": "vectorized"}},
+#    "predictors": {"copy_gold": {}, "string_match": {"use_contrast": true}}}
+# Stage parameters are script flags. A string "@stage/file" refers to another stage's output and
+# "$key" to config["inputs"][key]; overriding a reference with a plain path drops the dependency,
+# and stages nothing depends on are not run.
+
+SCRIPTS = Path(__file__).resolve().parent.parent / "scripts"
+PACKAGE = Path(__file__).resolve().parent
+
+# kind -> (script, default params, outputs as {flag: file name})
+TEMPLATE: Dict[str, Tuple[str, Dict[str, Any], Dict[str, str]]] = {
+    "constraints": ("01_fetch_wikidata_constraints.py", {"pids": "$pids"}, {"out_json": "constraints.json"}),
+    "entities": ("02_build_entity_cache.py", {"examples": "$examples"},
+                 {"out_labels": "labels.json", "out_types": "types.json", "out_subclass": "subclass.json"}),
+    "pairs": ("03_generate_contrasts.py",
+              {"examples": "$examples", "constraints": "@constraints/constraints.json", "labels": "@entities/labels.json"},
+              {"out_pairs": "pairs.jsonl"}),
+    "preds": ("04_run_baselines.py", {"pairs": "@pairs/pairs.jsonl"}, {"out_preds": "preds.jsonl"}),
+    "eval": ("05_eval_leakage.py",
+             {"pairs": "@pairs/pairs.jsonl", "preds": "@preds.{name}/preds.jsonl",
+              "constraints": "@constraints/constraints.json", "types": "@entities/types.json"},
+             {"out_csv": "leakage.csv"}),
+}
+WDQS_KINDS = ("constraints", "entities", "pairs", "eval")
+
+# Flags that change speed or side caches but not the outputs; left out of fingerprints.
+VOLATILE = {"cache_dir", "sleep", "workers", "sparql_workers", "executor", "batch_size", "pool_batch", "chunk",
+            "chunk_size", "checkpoint_every", "engine", "latency_log", "pools", "metrics", "profile", "trace_memory", "offline"}
+SEMANTIC = {"pairs": {"workers"}}   # 03 --workers switches to per-example RNGs
+
+@dataclass
+class Stage:
+    name: str
+    kind: str
+    script: Path
+    params: Dict[str, Any]
+    outputs: Dict[str, str]
+    deps: Set[str] = field(default_factory=set)
+
+    def volatile(self, key: str) -> bool:
+        return key in VOLATILE and key not in SEMANTIC.get(self.kind, ())
+
+def _ref(v: Any) -> Optional[Tuple[str, str]]:
+    if isinstance(v, str) and v.startswith("@"):
+        stage, _, fname = v[1:].partition("/")
+        return stage, fname
+    return None
+
+def build_stages(config: Dict[str, Any]) -> Dict[str, Stage]:
+    inputs = config.get("inputs", {})
+    wdqs = config.get("wdqs", {})
+    scripts = Path(config.get("scripts_dir", SCRIPTS))
+    overrides = config.get("stages", {})
+    predictors = config.get("predictors") or {"copy_gold": {}}
+    todo: List[Tuple[str, str, Dict[str, Any]]] = [(k, k, {}) for k in ("constraints", "entities", "pairs")]
+    for name, extra in predictors.items():
+        todo.append((f"preds.{name}", "preds", {"predictor": name, **extra}))
+        todo.append((f"eval.{name}", "eval", {}))
+    stages: Dict[str, Stage] = {}
+    for name, kind, extra in todo:
+        script, defaults, outputs = TEMPLATE[kind]
+        params = {**(wdqs if kind in WDQS_KINDS else {}), **defaults, **overrides.get(kind, {}), **extra}
+        suffix = name.partition(".")[2]
+        for k, v in list(params.items()):
+            if isinstance(v, str) and v.startswith("$"):
+                if v[1:] not in inputs:
+                    raise ValueError(f"{name}: --{k} needs inputs.{v[1:]} in the config")
+                params[k] = inputs[v[1:]]
+            elif isinstance(v, str) and "{name}" in v:
+                params[k] = v.replace("{name}", suffix)
+        stages[name] = Stage(name, kind, scripts / script, params, outputs)
+    for st in stages.values():
+        for v in st.params.values():
+            r = _ref(v)
+            if r is not None:
+                if r[0] not in stages:
+                    raise ValueError(f"{st.name}: unknown stage in reference {v!r}")
+                st.deps.add(r[0])
+    # Only what the eval stages need.
+    needed, stack = set(), [n for n in stages if n.startswith("eval.")]
+    while stack:
+        n = stack.pop()
+        if n not in needed:
+            needed.add(n)
+            stack.extend(stages[n].deps)
+    return {n: st for n, st in stages.items() if n in needed}
+
+def file_digest(path: str | Path) -> str:
+    # Directories (sharded JSONL outputs) hash their files' names and contents in name order.
+    path = Path(path)
+    h = hashlib.sha256()
+    for p in (sorted(q for q in path.rglob("*") if q.is_file()) if path.is_dir() else [path]):
+        if p != path:
+            h.update(str(p.relative_to(path)).encode("utf-8") + b"\0")
+        with open(p, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    return h.hexdigest()
+
+def _imports(path: Path) -> Set[str]:
+    # contrakg modules imported by a script or package module (absolute or relative).
+    out = set()
+    for node in ast.walk(ast.parse(path.read_text(encoding="utf-8"))):
+        if isinstance(node, ast.ImportFrom):
+            base = node.module or ""
+            if node.level == 1 or base == "contrakg" or base.startswith("contrakg."):
+                mod = base.split(".", 1)[1] if base.startswith("contrakg.") else ("" if base == "contrakg" else base)
+                if mod:
+                    out.add(mod.split(".")[0])
+                else:
+                    out.update(a.name for a in node.names)
+        elif isinstance(node, ast.Import):
+            out.update(a.name.split(".")[1] for a in node.names if a.name.startswith("contrakg."))
+    return {m for m in out if (PACKAGE / f"{m}.py").exists()}
+
+def code_digest(script: Path) -> str:
+    # The script plus the transitive closure of contrakg modules it imports.
+    seen, stack = set(), sorted(_imports(script))
+    while stack:
+        m = stack.pop()
+        if m not in seen:
+            seen.add(m)
+            stack.extend(_imports(PACKAGE / f"{m}.py") - seen)
+    h = hashlib.sha256(script.read_bytes())
+    for m in sorted(seen):
+        h.update(m.encode() + b"\0" + (PACKAGE / f"{m}.py").read_bytes())
+    return h.hexdigest()
+
+class Pipeline:
+    def __init__(self, config: Dict[str, Any], jobs: Optional[int]=None, force: Iterable[str]=()):
+        self.config = config
+        self.stages = build_stages(config)
+        self.store = Path(config.get("store", ".pipeline"))
+        self.jobs = jobs or int(config.get("jobs", 2))
+        self.force = set(force)
+        unknown = self.force - set(self.stages)
+        if unknown:
+            raise ValueError(f"--force: unknown stage(s) {', '.join(sorted(unknown))}")
+        self.manifests: Dict[str, Dict[str, Any]] = {}
+        self._code: Dict[Path, str] = {}
+        self._locks: Dict[Path, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def order(self) -> List[str]:
+        out, seen = [], set()
+        def visit(n):
+            if n not in seen:
+                seen.add(n)
+                for d in sorted(self.stages[n].deps):
+                    visit(d)
+                out.append(n)
+        for n in sorted(self.stages):
+            visit(n)
+        return out
+
+    def _resolve(self, v: Any) -> Any:
+        r = _ref(v)
+        return str(Path(self.manifests[r[0]]["dir"]) / r[1]) if r else v
+
+    def fingerprint(self, st: Stage) -> str:
+        if st.script not in self._code:
+            self._code[st.script] = code_digest(st.script)
+        params = {}
+        for k, v in sorted(st.params.items()):
+            if st.volatile(k):
+                continue
+            r = _ref(v)
+            if r is not None:
+                params[k] = {"sha256": self.manifests[r[0]]["outputs"][r[1]]}
+            elif isinstance(v, str) and Path(v).exists():
+                params[k] = {"sha256": file_digest(v)}
+            else:
+                params[k] = v
+        blob = json.dumps({"script": st.script.name, "code": self._code[st.script], "params": params}, sort_keys=True)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def _argv(self, st: Stage, out_dir: Path) -> List[str]:
+        argv = [sys.executable, str(st.script)]
+        for k, v in st.params.items():
+            if v is None or v is False:
+                continue
+            if v is True:
+                argv.append(f"--{k}")
+                continue
+            for item in (v if isinstance(v, list) else [v]):
+                argv += [f"--{k}", str(self._resolve(item))]
+        for flag, fname in st.outputs.items():
+            argv += [f"--{flag}", str(out_dir / fname)]
+        if "metrics" not in st.params:
+            argv += ["--metrics", str(out_dir / "metrics.json")]
+        return argv
+
+    def run_stage(self, name: str) -> Dict[str, Any]:
+        st = self.stages[name]
+        fp = self.fingerprint(st)
+        final = self.store / st.kind / fp[:20]
+        # Stages with equal fingerprints (e.g. two predictors with identical output) share one run.
+        with self._lock:
+            lock = self._locks.setdefault(final, threading.Lock())
+        with lock:
+            return self._run_locked(name, st, fp, final)
+
+    def _run_locked(self, name: str, st: Stage, fp: str, final: Path) -> Dict[str, Any]:
+        manifest = final / "manifest.json"
+        if manifest.exists() and name not in self.force:
+            m = json.loads(manifest.read_text(encoding="utf-8"))
+            return {**m, "dir": str(final), "status": "cached"}
+        tmp = self.store / "tmp" / f"{st.kind}-{fp[:20]}-{os.getpid()}-{threading.get_ident()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        argv = self._argv(st, tmp)
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join([str(PACKAGE.parent)] + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else []))
+        t0 = time.perf_counter()
+        with (tmp / "log.txt").open("w", encoding="utf-8") as log:
+            proc = subprocess.run(argv, stdout=log, stderr=subprocess.STDOUT, env=env)
+        if proc.returncode != 0:
+            raise RuntimeError(f"stage {name} failed (exit {proc.returncode}), see {tmp / 'log.txt'}")
+        m = {"stage": name, "kind": st.kind, "fingerprint": fp, "argv": argv[1:],
+             "outputs": {f: file_digest(tmp / f) for f in sorted(os.listdir(tmp))
+                         if f not in ("log.txt", "metrics.json")},
+             "seconds": round(time.perf_counter() - t0, 3), "created": time.strftime("%Y-%m-%dT%H:%M:%S%z")}
+        write_json_atomic(tmp / "manifest.json", m)
+        if final.exists():   # --force, or another run finished the same stage meanwhile
+            shutil.rmtree(final)
+        final.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp, final)
+        return {**m, "dir": str(final), "status": "ran"}
+
+    def run(self) -> Dict[str, Dict[str, Any]]:
+        # Dependency-driven scheduling: every stage whose inputs are done is submitted at once.
+        pending, running = set(self.stages), {}
+        with ThreadPoolExecutor(self.jobs) as pool:
+            while pending or running:
+                for n in sorted(pending):
+                    if self.stages[n].deps <= set(self.manifests):
+                        running[pool.submit(self.run_stage, n)] = n
+                        pending.discard(n)
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for f in finished:
+                    n = running.pop(f)
+                    self.manifests[n] = f.result()
+                    m = self.manifests[n]
+                    print(f"[OK] {n}: {m['status']} {m['dir']}" + (f" ({m['seconds']}s)" if m["status"] == "ran" else ""))
+        return self.manifests
+
+    def plan(self) -> List[Tuple[str, str]]:
+        # Which stages would run; downstream of a stage that runs the fingerprint is not known yet.
+        out, dirty = [], set()
+        for n in self.order():
+            st = self.stages[n]
+            if n in self.force or st.deps & dirty:
+                dirty.add(n)
+                out.append((n, "run" if n in self.force else "run (upstream)"))
+                continue
+            final = self.store / st.kind / self.fingerprint(st)[:20]
+            if (final / "manifest.json").exists():
+                self.manifests[n] = {**json.loads((final / "manifest.json").read_text(encoding="utf-8")), "dir": str(final)}
+                out.append((n, "cached"))
+            else:
+                dirty.add(n)
+                out.append((n, "run"))
+        return out
+
+def link_outputs(manifests: Dict[str, Dict[str, Any]], out_dir: str | Path):
+    # <out_dir>/<stage> -> artifact directory, plus pipeline.json describing the run.
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    for n, m in manifests.items():
+        link = out / n
+        if link.is_symlink() or link.is_file():
+            link.unlink()
+        elif link.exists():
+            shutil.rmtree(link)
+        link.symlink_to(Path(m["dir"]).resolve(), target_is_directory=True)
+    write_json_atomic(out / "pipeline.json", {n: {k: m[k] for k in ("fingerprint", "dir", "status", "seconds")}
+                                              for n, m in sorted(manifests.items())})
+
+def main():
+    ap = argparse.ArgumentParser(prog="python -m contrakg.pipeline",
+                                 description="Run steps 01-05, re-running only stages whose inputs, parameters or code changed.")
+    ap.add_argument("config")
+    ap.add_argument("--jobs", type=int, default=None, help="stages run concurrently (default: config 'jobs' or 2)")
+    ap.add_argument("--force", nargs="*", default=[], metavar="STAGE", help="re-run these stages even if cached")
+    ap.add_argument("--dry_run", action="store_true", help="only print which stages would run")
+    args = ap.parse_args()
+
+    config = json.loads(Path(args.config).read_text(encoding="utf-8"))
+    pipe = Pipeline(config, jobs=args.jobs, force=args.force)
+    if args.dry_run:
+        for n, status in pipe.plan():
+            print(f"{n}: {status}")
+        return
+    manifests = pipe.run()
+    if config.get("out_dir"):
+        link_outputs(manifests, config["out_dir"])
+    ran = sum(1 for m in manifests.values() if m["status"] == "ran")
+    print(f"[OK] stages={len(manifests)} ran={ran} cached={len(manifests) - ran}"
+          + (f" out_dir={config['out_dir']}" if config.get("out_dir") else ""))
+
+if __name__ == "__main__":
+    main()
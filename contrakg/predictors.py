@@ -0,0 +1,112 @@
+from __future__ import annotations
+import importlib, inspect, time
+from importlib import metadata
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Protocol, runtime_checkable
+from .baselines import baseline_copy_gold, baseline_string_match_swap
+from .matching import LabelMatcher, Span
+
+Triples = List[Dict[str, Any]]
+SpanTable = Dict[str, Dict[str, List[Span]]]
+
+ENTRY_POINT_GROUP = "contrakg.predictors"
+
+@runtime_checkable
+class Predictor(Protocol):
+    def predict_batch(self, pairs: List[Dict[str, Any]]) -> List[Triples]: ...
+
+def batch_spans(pairs: List[Dict[str, Any]], texts: Iterable[str]) -> SpanTable:
+    matcher = LabelMatcher.from_pairs(pairs)
+    return {t: matcher.find(t) for t in set(texts)}
+
+class CopyGoldPredictor:
+    # Built-in string baselines take an optional precomputed span table so that several of
+    # them can share one matcher pass per batch.
+    shares_spans = True
+
+    def __init__(self, use_contrast: bool=False):
+        self.use_contrast = use_contrast
+
+    def _input(self, pair: Dict[str, Any]) -> Dict[str, Any]:
+        return {"orig_sentence": pair["contrast_sentence"], **pair} if self.use_contrast else pair
+
+    def texts(self, pairs: List[Dict[str, Any]]) -> List[str]:
+        return [self._input(p)["orig_sentence"] for p in pairs]
+
+    def predict_batch(self, pairs: List[Dict[str, Any]], spans: Optional[SpanTable]=None) -> List[Triples]:
+        spans = spans or batch_spans(pairs, self.texts(pairs))
+        return [baseline_copy_gold(p2, spans=spans[p2["orig_sentence"]]) for p2 in map(self._input, pairs)]
+
+class StringMatchPredictor:
+    shares_spans = True
+
+    def __init__(self, use_contrast: bool=False):
+        self.use_contrast = use_contrast
+
+    def texts(self, pairs: List[Dict[str, Any]]) -> List[str]:
+        return [p["contrast_sentence"] if self.use_contrast else p["orig_sentence"] for p in pairs]
+
+    def predict_batch(self, pairs: List[Dict[str, Any]], spans: Optional[SpanTable]=None) -> List[Triples]:
+        spans = spans or batch_spans(pairs, self.texts(pairs))
+        return [baseline_string_match_swap(p, use_contrast=self.use_contrast, spans=spans[t])
+                for p, t in zip(pairs, self.texts(pairs))]
+
+class DummyExtractor:
+    # Stand-in for a remote/batched extractor: a fixed per-call latency plus a per-item cost,
+    # so batching and concurrency effects are visible. Answers like string_match.
+    def __init__(self, use_contrast: bool=False, latency: float=0.05, per_item: float=0.001):
+        self.latency = float(latency)
+        self.per_item = float(per_item)
+        self.inner = StringMatchPredictor(use_contrast=use_contrast)
+
+    def predict_batch(self, pairs: List[Dict[str, Any]]) -> List[Triples]:
+        time.sleep(self.latency + self.per_item * len(pairs))
+        return self.inner.predict_batch(pairs)
+
+BUILTIN = {
+    "copy_gold": CopyGoldPredictor,
+    "string_match": StringMatchPredictor,
+    "dummy": DummyExtractor,
+}
+
+def _resolve(spec: str):
+    if spec in BUILTIN:
+        return BUILTIN[spec]
+    if ":" in spec:
+        mod, _, attr = spec.partition(":")
+        obj = importlib.import_module(mod)
+        for part in attr.split("."):
+            obj = getattr(obj, part)
+        return obj
+    for ep in metadata.entry_points(group=ENTRY_POINT_GROUP):
+        if ep.name == spec:
+            return ep.load()
+    raise ValueError(f"Unknown predictor {spec!r}: not built-in ({', '.join(BUILTIN)}), "
+                     f"not module:Class, and no '{ENTRY_POINT_GROUP}' entry point of that name.")
+
+def load_predictor(spec: str, use_contrast: bool=False, labels: Optional[Mapping[str, str]]=None,
+                   types: Optional[Mapping[str, List[str]]]=None, **kwargs) -> Predictor:
+    # `use_contrast` and the entity lookups are only passed to factories that declare them (or **kwargs).
+    factory = _resolve(spec)
+    try:
+        params = inspect.signature(factory).parameters
+    except (TypeError, ValueError):
+        params = {}
+    var_kw = any(p.kind == p.VAR_KEYWORD for p in params.values())
+    for name, value in (("use_contrast", use_contrast), ("labels", labels), ("types", types)):
+        if (name == "use_contrast" or value is not None) and (name in params or var_kw):
+            kwargs[name] = value
+    pred = factory(**kwargs)
+    if not isinstance(pred, Predictor):
+        raise TypeError(f"{spec!r} does not provide predict_batch(pairs)")
+    return pred
+
+def run_batch(predictors: List[Predictor], pairs: List[Dict[str, Any]]) -> List[List[Triples]]:
+    shared = [p for p in predictors if getattr(p, "shares_spans", False)]
+    spans = batch_spans(pairs, [t for p in shared for t in p.texts(pairs)]) if len(shared) > 1 else None
+    out = []
+    for p in predictors:
+        res = p.predict_batch(pairs, spans=spans) if spans is not None and p in shared else p.predict_batch(pairs)
+        if len(res) != len(pairs):
+            raise ValueError(f"{type(p).__name__}.predict_batch returned {len(res)} results for {len(pairs)} pairs")
+        out.append(res)
+    return out
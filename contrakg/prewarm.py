@@ -0,0 +1,175 @@
+from __future__ import annotations
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Union
+from .constraints import NO_CONSTRAINT, ConstraintIndex, cache_key, fetch_constraints
+from .contrast import TypePoolIndex, constraint_classes, pool_batch_query
+from .eval import TypeOracle, ask_query, pending_checks
+from .hierarchy import ClassHierarchy, subclass_query
+from .io_utils import JsonlWriter, iter_chunks, read_jsonl
+from .wikidata import SparqlClient, entity_query, parse_entities, qid
+
+# Cache prewarming. Steps 01/02/03/05 find out what to ask WDQS in the middle of their loops;
+# Prewarmer enumerates those questions up front, with the same query builders and parameters
+# (so the cache keys are identical), looks them all up in the cache in bulk and fetches only
+# the missing ones, concurrently, before the run:
+#   constraints  01: one "constraints/<pid>" record per PID
+#   entities     02: entity_query over the sorted subj/obj QIDs in --chunk sized VALUES lists
+#   subclass     02 --out_subclass: subclass_query levels up the P279 graph of the fetched types
+#   pools        03: pool_batch_query over the constraint classes in --pool_batch groups
+#   oracle       05 --use_oracle: one ASK record per (entity, class) the local checks cannot settle
+# Every key a stage reads is remembered, so the exact cache subset a run needs can be exported
+# to a portable gzip JSONL bundle and imported on a machine without network access, which then
+# runs the steps with --offline. Keys match the default (non-incremental) runs of 02/03.
+
+BUNDLE_FORMAT = "contrakg-cache-bundle/1"
+
+class Prewarmer:
+    def __init__(self, client: SparqlClient, dry_run: bool=False, lookup_chunk: int=10_000):
+        if client.cache is None:
+            raise ValueError("prewarming needs a client with a cache")
+        self.client = client
+        self.cache = client.cache
+        self.dry_run = dry_run
+        self.lookup_chunk = lookup_chunk
+        self.keys: Dict[str, None] = {}  # every key the planned run reads, in plan order
+        self.report: Dict[str, Dict[str, int]] = {}
+
+    def _plan(self, stage: str, keys: Iterable[str]) -> List[str]:
+        # Registers the keys, returns the ones not cached yet.
+        new = [k for k in dict.fromkeys(keys) if k not in self.keys]
+        self.keys.update(dict.fromkeys(new))
+        have = set()
+        for sub in iter_chunks(new, self.lookup_chunk):
+            have.update(self.cache.get_many(sub))
+        missing = [k for k in new if k not in have]
+        r = self.report.setdefault(stage, {"planned": 0, "cached": 0, "missing": 0, "requests": 0, "failed": 0})
+        r["planned"] += len(new)
+        r["cached"] += len(new) - len(missing)
+        r["missing"] += len(missing)
+        return missing
+
+    def _fetch(self, stage: str, queries: List[str]) -> Dict[str, Any]:
+        # Missing queries concurrently, through the cache; failures are counted, not raised.
+        if self.dry_run or not queries:
+            return {}
+        r0 = self.client.requests
+        out = {}
+        for q, js in zip(queries, self.client.query_many(queries, return_exceptions=True)):
+            if isinstance(js, Exception):
+                self.report[stage]["failed"] += 1
+            else:
+                out[q] = js
+        self.report[stage]["requests"] += self.client.requests - r0
+        return out
+
+    def _answers(self, queries: List[str], fetched: Dict[str, Any]) -> Dict[str, Any]:
+        out = dict(fetched)
+        for sub in iter_chunks([q for q in queries if q not in out], self.lookup_chunk):
+            out.update(self.cache.get_many(sub))
+        return out
+
+    def constraints(self, pids: Iterable[str], batch_size: int=50) -> Dict[str, Any]:
+        # 01; returns the constraints.json content for the PIDs available after the fetch.
+        pids = list(dict.fromkeys(p.strip() for p in pids if p.strip()))
+        missing = self._plan("constraints", [cache_key(p) for p in pids])
+        if missing and not self.dry_run:
+            r0 = self.client.requests
+            try:
+                fetch_constraints([k.split("/", 1)[1] for k in missing], client=self.client, batch_size=batch_size)
+            except Exception:
+                self.report["constraints"]["failed"] += 1
+            self.report["constraints"]["requests"] += self.client.requests - r0
+        recs = self._answers([cache_key(p) for p in pids], {})
+        return {p: recs[cache_key(p)]["constraints"] for p in pids if cache_key(p) in recs}
+
+    def entities(self, examples: Iterable[Dict[str, Any]], chunk: int=200) -> Dict[str, List[str]]:
+        # 02; returns the types of the entities answered so far (what 02 writes to --out_types).
+        ents = set()
+        for ex in examples:
+            ents.add(ex["subj"]); ents.add(ex["obj"])
+        todo = sorted(ents)
+        queries = [entity_query(sub) for sub in iter_chunks(todo, chunk)]
+        fetched = self._fetch("entities", self._plan("entities", queries))
+        types: Dict[str, List[str]] = {}
+        for js in self._answers(queries, fetched).values():
+            for e, rec in parse_entities(js).items():
+                if rec["types"]:
+                    types[e] = rec["types"]
+        return types
+
+    def subclass(self, classes: Iterable[str], chunk: int=200) -> Dict[str, List[str]]:
+        # 02 --out_subclass: the same level-by-level walk as fetch_subclass_edges; each level's
+        # queries are only known once the previous level is answered.
+        parents: Dict[str, List[str]] = {}
+        frontier = sorted({c for c in classes if c})
+        while frontier:
+            subs = list(iter_chunks(frontier, chunk))
+            queries = [subclass_query(sub) for sub in subs]
+            answers = self._answers(queries, self._fetch("subclass", self._plan("subclass", queries)))
+            for sub, q in zip(subs, queries):
+                for c in sub:
+                    parents.setdefault(c, [])
+                for b in answers.get(q, {"results": {"bindings": []}})["results"]["bindings"]:
+                    if "p" in b:
+                        c, p = qid(b["c"]["value"]), qid(b["p"]["value"])
+                        if p not in parents[c]:
+                            parents[c].append(p)
+            frontier = sorted({p for c in frontier for p in parents[c] if p not in parents})
+        return {c: sorted(ps) for c, ps in parents.items()}
+
+    def pools(self, constraints: Union[ConstraintIndex, Dict[str, Any]], per_class: int=50, batch_size: int=20,
+              max_classes: Optional[int]=None, existing: Optional[TypePoolIndex]=None):
+        # 03; classes already in a --pools file built with the same per_class are not asked.
+        have = existing.pools if existing is not None and existing.per_class == per_class else {}
+        todo = [c for c in constraint_classes(constraints)[:max_classes] if c not in have]
+        queries = [pool_batch_query(b, per_class) for b in iter_chunks(todo, batch_size)]
+        self._fetch("pools", self._plan("pools", queries))
+
+    def oracle(self, preds: Iterable[Dict[str, Any]], constraints: Union[ConstraintIndex, Dict[str, Any]],
+               types: Optional[Mapping[str, List[str]]]=None, hierarchy: Optional[ClassHierarchy]=None,
+               chunk_size: int=50_000, batch_size: int=500):
+        # 05 --use_oracle: the ASK records check_many reads. Which checks the local types and
+        # hierarchy settle depends on them, so the plan is exact only for the 05 run's --types/--subclass.
+        constraints = ConstraintIndex.of(constraints)
+        oracle = TypeOracle(client=self.client, hierarchy=hierarchy, types=types, batch_size=batch_size)
+        for chunk in iter_chunks(preds, chunk_size):
+            checks = []
+            for pr in chunk:
+                checks.extend(pending_checks(pr.get("triples", []), constraints.get(pr["pid"], NO_CONSTRAINT), types))
+            keys = [ask_query(e, c) for e, classes in checks for c in classes if oracle.local_answer(e, c) is None]
+            missing = self._plan("oracle", keys)
+            if missing and not self.dry_run:
+                r0 = self.client.requests
+                try:
+                    oracle.check_many(checks)
+                except Exception:
+                    self.report["oracle"]["failed"] += 1
+                self.report["oracle"]["requests"] += self.client.requests - r0
+
+    def export(self, path: Union[str, Path]) -> Dict[str, int]:
+        return export_bundle(path, self.cache, self.keys)
+
+def export_bundle(path: Union[str, Path], cache, keys: Iterable[str], chunk: int=10_000) -> Dict[str, int]:
+    # Header line, then one {"k": key, "v": answer} line per cached key; keys not in the cache are skipped.
+    keys = list(dict.fromkeys(keys))
+    w = JsonlWriter(path)
+    w.write_rows([{"format": BUNDLE_FORMAT, "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "keys": len(keys)}])
+    n = 0
+    for sub in iter_chunks(keys, chunk):
+        got = cache.get_many(sub)
+        w.write_rows({"k": k, "v": got[k]} for k in sub if k in got)
+        n += len(got)
+    w.close()
+    return {"keys": len(keys), "exported": n, "skipped": len(keys) - n}
+
+def import_bundle(path: Union[str, Path], cache, chunk: int=10_000) -> int:
+    rows = read_jsonl(path)
+    head = next(rows, None)
+    if head is None or head.get("format") != BUNDLE_FORMAT:
+        raise ValueError(f"{path}: not a cache bundle (expected format {BUNDLE_FORMAT})")
+    n = 0
+    for sub in iter_chunks(rows, chunk):
+        cache.set_many({r["k"]: r["v"] for r in sub})
+        n += len(sub)
+    return n
@@ -0,0 +1,217 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+import numpy as np
+import pandas as pd
+from .constraints import NO_CONSTRAINT, ConstraintIndex, compiled
+
+# Constraint-wise leakage profiles from the per-example rows of 05: ITLR and the violation
+# rate per group of (pid, test_type, status), with percentile bootstrap CIs and, given the
+# rows of the original sentences too, paired contrast - orig deltas.
+# Every row falls into one cell: no output / output without violation / output with
+# violation (3 cells; 3 x 3 for an (orig, contrast) pair). All statistics are ratios of
+# cell counts, so resampling the rows of a stratum with replacement is the same as drawing
+# its cell counts from a multinomial with the observed cell frequencies. Each bootstrap
+# replicate is thus one (strata x cells) count matrix, whatever the number of rows.
+# Strata are the (pid, test_type) pairs (status is a function of both); coarser groups add
+# up the resampled strata. resample="rows" draws the whole matrix from one multinomial over
+# all strata x cells, i.e. resamples rows from the whole file: the CIs include the variation
+# of the stratum sizes. resample="strata" holds every stratum at its observed size and only
+# resamples within it, so its CIs are conditional on the strata (zero-width when each stratum
+# is pure) and are not the sampling uncertainty of ITLR. The ci_resample column names the mode.
+
+STATUS_LABELS = {"Q21502408": "mandatory", "Q62026391": "suggestion"}
+KEYS = ["pid", "test_type", "status"]
+RESAMPLE = ("rows", "strata")
+FLAGS = ["viol_value_type", "viol_subject_type", "viol_single_value"]
+DEFAULT_BY = [(), ("test_type",), ("status",), ("pid",), ("pid", "test_type"), ("test_type", "status")]
+
+def constraint_status(c, test_type: Optional[str]) -> str:
+    # Status (P2316) of the constraint a test targets; "normal" when it has none.
+    c = compiled(c)
+    if test_type == "value_type_violation":
+        st = c.value_type.status if c.value_type is not None else None
+    elif test_type == "subject_type_violation":
+        st = c.subject_type.status if c.subject_type is not None else None
+    elif test_type == "single_value_violation":
+        st = c.single_value_status
+    else:
+        return "none"
+    return STATUS_LABELS.get(st, st) if st else "normal"
+
+def load_eval(path: Union[str, Path], with_id: bool=False) -> pd.DataFrame:
+    # Per-example rows of 05 (CSV or Parquet), only the columns the profiles need. A paired
+    # file (05 --orig_preds) also gives the orig_ flags; pairs missing either run are dropped.
+    parquet = str(path).endswith(".parquet")
+    if parquet:
+        import pyarrow.parquet as pq
+        header = pq.read_schema(path).names
+    else:
+        header = list(pd.read_csv(path, nrows=0).columns)
+    paired = "orig_has_output" in header
+    flags = ["has_output", "any_violation"] + FLAGS + (["orig_has_output", "orig_any_violation"] if paired else [])
+    cols = (["id"] if with_id else []) + ["test_type", "pid"] + (["outcome"] if paired else []) + flags
+    if parquet:
+        df = pd.read_parquet(path, columns=cols)
+    else:
+        dtype = {c: "float32" if paired else "int8" for c in flags}
+        dtype.update({"id": str, "test_type": str, "pid": str, "outcome": str})
+        try:
+            import pyarrow  # noqa: F401  # multithreaded parser, several times faster
+            df = pd.read_csv(path, usecols=cols, dtype=dtype, engine="pyarrow")
+        except ImportError:
+            df = pd.read_csv(path, usecols=cols, dtype=dtype, keep_default_na=False, na_values={c: [""] for c in flags})
+    if paired:
+        df = df[~df.pop("outcome").str.startswith("missing")].reset_index(drop=True)
+        df[flags] = df[flags].astype("int8")
+    df["test_type"] = df["test_type"].fillna("")
+    return df
+
+def _cells(df: pd.DataFrame, prefix: str="") -> np.ndarray:
+    out = df[prefix + "has_output"].to_numpy(np.int64)
+    return out + (out & df[prefix + "any_violation"].to_numpy(np.int64))
+
+def _ratio(num: np.ndarray, den: np.ndarray, empty: float=0.0) -> np.ndarray:
+    # `empty` for an empty denominator: 0.0 as LeakageSummary reports it for the point
+    # estimates, NaN for bootstrap replicates (left out of the quantiles).
+    return np.divide(num, den, out=np.full(np.broadcast(num, den).shape, empty), where=den > 0)
+
+def _stats(counts: np.ndarray, paired: bool, empty: float=0.0) -> Dict[str, np.ndarray]:
+    # counts: (..., 3) or, paired, (..., 9) with cell = 3 * orig cell + contrast cell.
+    if paired:
+        m = counts.reshape(counts.shape[:-1] + (3, 3))
+        c, o = m.sum(axis=-2), m.sum(axis=-1)
+    else:
+        c, o = counts, None
+    n = c.sum(axis=-1)
+    out = {"ITLR": _ratio(c[..., 2], c[..., 1] + c[..., 2], empty), "viol_rate_any": _ratio(c[..., 2], n, empty)}
+    if o is not None:
+        orig = {"ITLR": _ratio(o[..., 2], o[..., 1] + o[..., 2], empty), "viol_rate_any": _ratio(o[..., 2], n, empty)}
+        for k in ("ITLR", "viol_rate_any"):
+            out[f"orig_{k}"] = orig[k]
+            out[f"delta_{k}"] = out[k] - orig[k]
+    return out
+
+def _level(strata: pd.DataFrame, by: Sequence[str]) -> Tuple[np.ndarray, pd.DataFrame]:
+    # Stratum -> group code, and the group keys.
+    if not by:
+        return np.zeros(len(strata), dtype=np.int64), pd.DataFrame(index=[0])
+    g = strata.groupby(list(by), sort=True)
+    return g.ngroup().to_numpy(np.int64), g.size().index.to_frame(index=False)
+
+class _Aggregator:
+    # Sums stratum rows into group rows along an axis with one reduceat.
+    def __init__(self, codes: np.ndarray):
+        self.order = np.argsort(codes, kind="stable")
+        sc = codes[self.order]
+        self.starts = np.flatnonzero(np.r_[True, sc[1:] != sc[:-1]])
+
+    def __call__(self, a: np.ndarray, axis: int=0) -> np.ndarray:
+        return np.add.reduceat(np.take(a, self.order, axis=axis), self.starts, axis=axis)
+
+def pair_rows(contrast: pd.DataFrame, orig: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[str, int]]:
+    # Inner join of the contrast and orig rows on (id, test_type); orig columns get an "orig_" prefix.
+    # Both 05 runs usually come from the same pairs file in the same order: then it is a column copy.
+    o = orig[["id", "test_type", "has_output", "any_violation"]].rename(
+        columns={"has_output": "orig_has_output", "any_violation": "orig_any_violation"})
+    if len(o) == len(contrast) and all(np.array_equal(o[k].to_numpy(), contrast[k].to_numpy()) for k in ("id", "test_type")):
+        df = contrast.assign(orig_has_output=o["orig_has_output"].to_numpy(), orig_any_violation=o["orig_any_violation"].to_numpy())
+    else:
+        df = contrast.merge(o, on=["id", "test_type"], how="inner", validate="one_to_one")
+    return df, {"pairs": len(df), "contrast_only": len(contrast) - len(df), "orig_only": len(orig) - len(df)}
+
+def leakage_profiles(df: pd.DataFrame, constraints: Union[ConstraintIndex, Dict[str, Any]],
+                     by: Sequence[Sequence[str]]=DEFAULT_BY, n_boot: int=1000, alpha: float=0.05,
+                     seed: int=0, block: int=64, resample: str="rows", min_valid: float=0.5) -> pd.DataFrame:
+    # One row per group of every grouping in `by` (() is the overall row). df holds the 05
+    # columns; paired when it also has orig_has_output / orig_any_violation (see pair_rows).
+    # A replicate that leaves a group without the rows a statistic divides by (e.g. no
+    # output rows for ITLR) does not count for that statistic's CI; n_boot_valid is the number
+    # of replicates where all statistics are defined, and a CI with fewer than min_valid x
+    # n_boot valid replicates is left empty.
+    if resample not in RESAMPLE:
+        raise ValueError(f"resample must be one of {RESAMPLE}, got {resample!r}")
+    constraints = ConstraintIndex.of(constraints)
+    paired = "orig_has_output" in df.columns
+    if df.empty:
+        return _empty_profile(by, paired, n_boot, resample)
+    g = df.groupby(["pid", "test_type"], sort=True, observed=True)
+    codes = g.ngroup().to_numpy(np.int64)
+    strata = g.size().index.to_frame(index=False)
+    strata["status"] = [constraint_status(constraints.get(p, NO_CONSTRAINT), t)
+                        for p, t in zip(strata["pid"], strata["test_type"])]
+    k = 9 if paired else 3
+    cell = _cells(df) + (3 * _cells(df, "orig_") if paired else 0)
+    counts = np.bincount(codes * k + cell, minlength=len(strata) * k).reshape(len(strata), k)
+    flags = np.stack([np.bincount(codes, weights=df[f].to_numpy(np.float64), minlength=len(strata)) for f in FLAGS], axis=1)
+
+    levels = []
+    for cols in by:
+        gcodes, keys = _level(strata, cols)
+        levels.append((tuple(cols), keys, _Aggregator(gcodes)))
+
+    # Bootstrap: `block` replicates at a time, (block, strata, cells) counts per draw.
+    rng = np.random.default_rng(seed)
+    n = counts.sum(axis=1)
+    p = counts / n[:, None]
+    total = int(n.sum())
+    p_all = counts.ravel() / max(total, 1)
+    reps: List[Dict[str, List[np.ndarray]]] = [{} for _ in levels]
+    for start in range(0, n_boot, block):
+        size = min(block, n_boot - start)
+        if resample == "rows":
+            draws = rng.multinomial(total, p_all, size=size).reshape(size, len(n), k)
+        else:
+            draws = rng.multinomial(n, p, size=(size, len(n)))
+        for (_, _, agg), acc in zip(levels, reps):
+            for name, v in _stats(agg(draws, axis=1), paired, empty=np.nan).items():
+                acc.setdefault(name, []).append(v)
+
+    frames = []
+    q = [alpha / 2, 1 - alpha / 2]
+    for (cols, keys, agg), acc in zip(levels, reps):
+        c = agg(counts)
+        out = pd.DataFrame({"by": ",".join(cols) or "all"}, index=range(len(c)))
+        for key in KEYS:
+            out[key] = keys[key].to_numpy() if key in cols else None
+        out["n"] = c.sum(axis=1)
+        cm = c.reshape(len(c), 3, 3).sum(axis=1) if paired else c
+        out["n_output"] = cm[:, 1] + cm[:, 2]
+        if n_boot:
+            out["ci_resample"] = resample
+            reps_by = {name: np.concatenate(v) for name, v in acc.items()}
+            out["n_boot_valid"] = (~np.any([np.isnan(v) for v in reps_by.values()], axis=0)).sum(axis=0)
+        for name, v in _stats(c, paired).items():
+            out[name] = v
+            if n_boot:
+                r = reps_by[name]
+                ok = (~np.isnan(r)).sum(axis=0) >= max(min_valid * n_boot, 1)
+                lo, hi = np.full((2, r.shape[1]), np.nan)
+                if ok.any():
+                    lo[ok], hi[ok] = np.nanquantile(r[:, ok], q, axis=0)
+                out[f"{name}_lo"], out[f"{name}_hi"] = lo, hi
+        f = agg(flags)
+        for i, name in enumerate(FLAGS):
+            out[name] = f[:, i] / out["n"].to_numpy()
+        frames.append(out)
+    return pd.concat(frames, ignore_index=True)
+
+def _empty_profile(by: Sequence[Sequence[str]], paired: bool, n_boot: int, resample: str) -> pd.DataFrame:
+    # No rows (empty 05 output, or a paired file of missing_* pairs only): the overall row
+    # with n=0 and 0.0 statistics, as LeakageSummary reports it; other groupings have no groups.
+    cols = profile_columns(paired, n_boot)
+    if not any(len(b) == 0 for b in by):
+        return pd.DataFrame(columns=cols)
+    row: Dict[str, Any] = {c: 0.0 for c in cols}
+    row.update({"by": "all", "n": 0, "n_output": 0, **{k: None for k in KEYS}})
+    if n_boot:
+        row.update({"ci_resample": resample, "n_boot_valid": 0})
+        row.update({c: np.nan for c in cols if c.endswith(("_lo", "_hi"))})
+    return pd.DataFrame([row], columns=cols)
+
+def profile_columns(paired: bool, n_boot: int) -> List[str]:
+    stats = ["ITLR", "viol_rate_any"] + (["orig_ITLR", "delta_ITLR", "orig_viol_rate_any", "delta_viol_rate_any"] if paired else [])
+    cols = ["by"] + KEYS + ["n", "n_output"] + (["ci_resample", "n_boot_valid"] if n_boot else [])
+    for s in stats:
+        cols += [s, f"{s}_lo", f"{s}_hi"] if n_boot else [s]
+    return cols + FLAGS
@@ -0,0 +1,274 @@
+from __future__ import annotations
+import multiprocessing as mp, queue, random, threading, time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+from .constraints import ConstraintIndex
+from .contrast import CandidateIndex, TypePoolIndex, example_rng, make_contrasts
+from .eval import TypeOracle, score_predictions
+from .io_utils import iter_chunks
+from .predictors import load_predictor, run_batch
+
+# In-memory streaming: a chain of stages, each a function from a batch (list) of items to a
+# list of output items, linked by bounded queues. Every stage has a driver thread that takes
+# items from its input queue, cuts them into batches of batch_size and runs the function
+# inline, on a thread pool or on fork-started worker processes (at most 2 x workers batches in
+# flight), then puts the results on the next queue in input order. A full queue blocks its
+# producer, so each link holds at most queue_size chunks and the chain runs at the pace of its
+# slowest stage instead of the sum of all of them. Stage functions come from factories called
+# where the stage runs (once per worker process with executor="process"), so predictors,
+# SPARQL clients and the like are created there and need not pickle.
+
+Fn = Callable[[List[Any]], List[Any]]
+
+@dataclass
+class Stage:
+    name: str
+    factory: Callable[[], Fn]
+    batch_size: int = 64
+    workers: int = 1
+    limit: Optional[int] = None  # pass on at most this many items, then stop everything upstream
+    zip_inputs: bool = False  # fn returns one result per input; items become (input, result), and worker
+                              # processes do not send the inputs back
+
+_DONE = object()
+
+class _Failure:
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+class _Halt(Exception):
+    pass
+
+_STAGE_FN: Optional[Fn] = None
+
+def _init_process(factory: Callable[[], Fn]):
+    global _STAGE_FN
+    _STAGE_FN = factory()
+
+def _noop():
+    return None
+
+def _timed(fn: Fn, batch: List[Any]) -> Tuple[List[Any], float]:
+    t0 = time.perf_counter()
+    out = fn(batch)
+    return out, time.perf_counter() - t0
+
+def _timed_in_process(batch: List[Any]) -> Tuple[List[Any], float]:
+    return _timed(_STAGE_FN, batch)
+
+class StreamPipeline:
+    def __init__(self, stages: List[Stage], executor: str="thread", queue_size: int=8, poll: float=0.1):
+        if executor not in ("thread", "process"):
+            raise ValueError(f"executor must be 'thread' or 'process', got {executor!r}")
+        if executor == "process" and "fork" not in mp.get_all_start_methods():
+            raise ValueError("executor='process' needs the fork start method (stage factories are not pickled)")
+        self.stages = stages
+        self.executor = executor
+        self.queue_size = queue_size
+        self.poll = poll
+        # busy: time in the stage function; starved: waiting for input; blocked: waiting for
+        # room downstream. The bottleneck is the stage that is busy while the others wait.
+        self.stats: Dict[str, Dict[str, float]] = {
+            s.name: {"batches": 0, "items_in": 0, "items_out": 0, "busy_s": 0.0, "starved_s": 0.0, "blocked_s": 0.0}
+            for s in stages}
+
+    def _pool(self, stage: Stage) -> Optional[Executor]:
+        if self.executor == "process":
+            pool = ProcessPoolExecutor(stage.workers, mp_context=mp.get_context("fork"),
+                                       initializer=_init_process, initargs=(stage.factory,))
+            pool.submit(_noop).result()  # fork now, from the main thread, before the drivers start
+            return pool
+        return ThreadPoolExecutor(stage.workers, thread_name_prefix=f"stream-{stage.name}") if stage.workers > 1 else None
+
+    def run(self, source: Iterable[Any]) -> Iterator[Any]:
+        # Yields the last stage's items in order. Closing the generator early stops every stage.
+        n = len(self.stages)
+        links = [queue.Queue(self.queue_size) for _ in range(n + 1)]
+        halt = [threading.Event() for _ in range(n + 1)]  # 0: feeder, i + 1: stage i
+        pools = [self._pool(s) for s in self.stages]
+
+        def put(i: int, q: queue.Queue, item: Any, st: Optional[Dict[str, float]]=None) -> bool:
+            t0 = time.perf_counter()
+            try:
+                while not halt[i].is_set():
+                    try:
+                        q.put(item, timeout=self.poll)
+                        return True
+                    except queue.Full:
+                        pass
+                return False
+            finally:
+                if st is not None:
+                    st["blocked_s"] += time.perf_counter() - t0
+
+        def get(i: int, q: queue.Queue, st: Dict[str, float]) -> Any:
+            t0 = time.perf_counter()
+            try:
+                while not halt[i].is_set():
+                    try:
+                        return q.get(timeout=self.poll)
+                    except queue.Empty:
+                        pass
+                return _DONE
+            finally:
+                st["starved_s"] += time.perf_counter() - t0
+
+        def stop_upstream(i: int):
+            for h in halt[:i + 1]:
+                h.set()
+
+        def feeder():
+            try:
+                for chunk in iter_chunks(source, self.stages[0].batch_size if self.stages else 64):
+                    if not put(0, links[0], chunk):
+                        return
+                put(0, links[0], _DONE)
+            except BaseException as e:
+                put(0, links[0], _Failure(e))
+
+        def driver(i: int, stage: Stage):
+            st, pool, out_q = self.stats[stage.name], pools[i], links[i + 1]
+            fn = stage.factory() if pool is None or self.executor == "thread" and stage.workers > 1 else None
+            call = _timed_in_process if self.executor == "process" else (lambda b: _timed(fn, b))
+            pending: deque = deque()
+            sent = 0
+
+            def emit(batch: List[Any], res: Tuple[List[Any], float]):
+                nonlocal sent
+                out, busy = res
+                st["busy_s"] += busy
+                if stage.zip_inputs:
+                    if len(out) != len(batch):
+                        raise ValueError(f"stage {stage.name!r} returned {len(out)} results for {len(batch)} items")
+                    out = list(zip(batch, out))
+                if stage.limit is not None and sent + len(out) >= stage.limit:
+                    out = out[:stage.limit - sent]
+                    sent += len(out)
+                    st["items_out"] += len(out)
+                    if out:
+                        put(i + 1, out_q, out, st)
+                    raise _Halt()
+                sent += len(out)
+                st["items_out"] += len(out)
+                if out:
+                    put(i + 1, out_q, out, st)
+
+            def submit(batch: List[Any]):
+                st["batches"] += 1
+                if pool is None:
+                    emit(batch, call(batch))
+                    return
+                pending.append((batch, pool.submit(call, batch)))
+                while len(pending) >= 2 * stage.workers:
+                    b, f = pending.popleft()
+                    emit(b, f.result())
+
+            try:
+                if stage.limit is not None and stage.limit <= 0:
+                    raise _Halt()
+                buf: List[Any] = []
+                while True:
+                    chunk = get(i + 1, links[i], st)
+                    if chunk is _DONE:
+                        break
+                    if isinstance(chunk, _Failure):
+                        put(i + 1, out_q, chunk)
+                        return
+                    st["items_in"] += len(chunk)
+                    buf.extend(chunk)
+                    while len(buf) >= stage.batch_size:
+                        submit(buf[:stage.batch_size])
+                        buf = buf[stage.batch_size:]
+                if buf:
+                    submit(buf)
+                while pending:
+                    b, f = pending.popleft()
+                    emit(b, f.result())
+                put(i + 1, out_q, _DONE)
+            except _Halt:
+                stop_upstream(i)
+                put(i + 1, out_q, _DONE)
+            except BaseException as e:
+                stop_upstream(i)
+                put(i + 1, out_q, _Failure(e))
+            finally:
+                for _, f in pending:
+                    f.cancel()
+
+        threads = [threading.Thread(target=feeder, name="stream-feeder", daemon=True)]
+        threads += [threading.Thread(target=driver, args=(i, s), name=f"stream-{s.name}", daemon=True)
+                    for i, s in enumerate(self.stages)]
+        for t in threads:
+            t.start()
+        try:
+            while True:
+                chunk = links[n].get()
+                if chunk is _DONE:
+                    break
+                if isinstance(chunk, _Failure):
+                    raise chunk.exc
+                yield from chunk
+        finally:
+            for h in halt:
+                h.set()
+            for t in threads:
+                t.join()
+            for p in pools:
+                if p is not None:
+                    p.shutdown(wait=True, cancel_futures=True)
+
+# The generate -> predict -> score chain of steps 03-05. Items are examples, then pairs, then
+# (pair, [triples per predictor]), then ((pair, [triples per predictor]), [eval row per predictor]),
+# with eval rows exactly as 05 writes them (pred_row gives the rows of 04).
+
+def pred_row(pair: Dict[str, Any], triples: Any, use_contrast: bool=False) -> Dict[str, Any]:
+    return {"id": pair["id"], "test_type": pair.get("test_type"), "pid": pair["pid"],
+            "is_contrast": bool(use_contrast), "triples": triples}
+
+def generate_stage(constraints: ConstraintIndex, labels: Mapping[str, str], type_pools: TypePoolIndex, seed: int,
+                   per_example_rng: bool=False, batch_size: int=256, workers: int=1,
+                   max_pairs: Optional[int]=None) -> Stage:
+    # One shared RNG (same pairs as 03) unless per_example_rng (same as 03 --workers), which
+    # several generation workers need.
+    def factory() -> Fn:
+        rng = random.Random(seed)
+        candidates = CandidateIndex(labels)
+        def generate(examples: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+            out = []
+            for ex in examples:
+                out.extend(make_contrasts(ex, constraints, labels, type_pools,
+                                          example_rng(seed, ex["id"]) if per_example_rng else rng, candidates=candidates))
+            return out
+        return generate
+    return Stage("generate", factory, batch_size=batch_size, workers=workers, limit=max_pairs)
+
+def predict_stage(specs: List[str], use_contrast: bool=False, predictor_kwargs: Optional[Dict[str, Any]]=None,
+                  batch_size: int=64, workers: int=1) -> Stage:
+    def factory() -> Fn:
+        predictors = [load_predictor(s, use_contrast=use_contrast, **dict(predictor_kwargs or {})) for s in specs]
+        def predict(pairs: List[Dict[str, Any]]) -> List[List[Any]]:
+            res = run_batch(predictors, pairs)
+            return [[r[j] for r in res] for j in range(len(pairs))]
+        return predict
+    return Stage("predict", factory, batch_size=batch_size, workers=workers, zip_inputs=True)
+
+def score_stage(constraints: ConstraintIndex, types: Optional[Mapping[str, List[str]]]=None,
+                oracle_factory: Optional[Callable[[], TypeOracle]]=None, engine: str="python",
+                use_contrast: bool=False, batch_size: int=2048, workers: int=1) -> Stage:
+    def factory() -> Fn:
+        oracle = oracle_factory() if oracle_factory is not None else None
+        scorer = None
+        if engine == "vectorized":
+            from .vectorized import VectorizedScorer
+            scorer = VectorizedScorer(constraints, types, oracle)
+        def score(items: List[Tuple[Dict[str, Any], List[Any]]]) -> List[List[Dict[str, Any]]]:
+            evals = []
+            for k in range(len(items[0][1]) if items else 0):
+                rows = [pred_row(pair, triples[k], use_contrast) for pair, triples in items]
+                evals.append(list(scorer.score_rows(rows)) if scorer is not None else
+                             list(score_predictions(rows, constraints, oracle, types, chunk_size=len(rows))))
+            return [[e[j] for e in evals] for j in range(len(items))]
+        return score
+    return Stage("score", factory, batch_size=batch_size, workers=workers, zip_inputs=True)
@@ -0,0 +1,233 @@
+from __future__ import annotations
+from typing import Dict, Any, Iterable, List, Optional, Tuple, Union
+import numpy as np
+import pandas as pd
+from .constraints import ConstraintIndex
+from .eval import EVAL_COLUMNS, TypeOracle
+from .hierarchy import ClassHierarchy
+
+# Batch counterpart of violates_value_type / violates_subject_type / violates_single_value.
+# Entity, class and property ids are interned to ints; types_cache, the oracle's local class
+# hierarchy and the per-PID allowed / exception sets become CSR arrays or sorted int64 keys,
+# and each preds chunk is scored with array ops. Only triples neither can settle go to the
+# oracle, once per unique (entity, pid) pair.
+
+class Interner:
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.items: List[str] = []
+        self._index: Optional[pd.Index] = None
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def intern(self, s: str) -> int:
+        i = self.ids.get(s)
+        if i is None:
+            i = len(self.items)
+            self.ids[s] = i
+            self.items.append(s)
+        return i
+
+    def intern_many(self, values: List[str]) -> np.ndarray:
+        # Factorize the batch and look its distinct values up in a hash index, both in C;
+        # only values never seen before go through the Python dict.
+        codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+        if not len(codes):
+            return np.zeros(0, dtype=np.int64)
+        if self._index is None or len(self._index) != len(self.items):
+            self._index = pd.Index(self.items, dtype=object)
+        lut = self._index.get_indexer(uniques).astype(np.int64)
+        for i in np.nonzero(lut < 0)[0]:
+            lut[i] = self.intern(uniques[i])
+        return lut[codes]
+
+def _key(hi: np.ndarray, lo: np.ndarray) -> np.ndarray:
+    return (hi.astype(np.int64) << 32) | lo.astype(np.int64)
+
+def _member(keys: np.ndarray, sorted_keys: np.ndarray) -> np.ndarray:
+    if not len(sorted_keys):
+        return np.zeros(len(keys), dtype=bool)
+    i = np.searchsorted(sorted_keys, keys)
+    i[i == len(sorted_keys)] = 0
+    return sorted_keys[i] == keys
+
+def _csr(rows: List[List[int]]) -> Tuple[np.ndarray, np.ndarray]:
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([len(r) for r in rows], out=indptr[1:])
+    indices = np.fromiter((x for r in rows for x in r), dtype=np.int64, count=int(indptr[-1]))
+    return indptr, indices
+
+def _expand(indptr: np.ndarray, owners: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # For each position i, emit (i, j) for every j in indptr[owners[i]]:indptr[owners[i]+1].
+    starts = indptr[owners]
+    deg = indptr[owners + 1] - starts
+    pos = np.repeat(np.arange(len(owners)), deg)
+    offs = np.arange(int(deg.sum())) - np.repeat(np.cumsum(deg) - deg, deg)
+    return pos, np.repeat(starts, deg) + offs
+
+class _TypeTable:
+    # CSR of direct P31 types over the entity ids interned so far; later entities are untyped.
+    def __init__(self, types: Dict[str, List[str]], ents: Interner, classes: Interner):
+        for e in types:
+            ents.intern(e)
+        rows: List[List[int]] = [[] for _ in range(len(ents))]
+        self.typed = np.zeros(len(ents), dtype=bool)
+        for e, ts in types.items():
+            i = ents.ids[e]
+            self.typed[i] = True
+            rows[i] = [classes.intern(t) for t in ts]
+        self.indptr, self.indices = _csr(rows)
+
+    def is_typed(self, ent: np.ndarray) -> np.ndarray:
+        out = np.zeros(len(ent), dtype=bool)
+        inside = ent < len(self.typed)
+        out[inside] = self.typed[ent[inside]]
+        return out
+
+class _AncestorTable:
+    # CSR of wdt:P279* closures for every class interned so far; complete[c] is False where
+    # the closure reaches an unfetched class (the oracle would have to ask WDQS).
+    def __init__(self, hierarchy: ClassHierarchy, classes: Interner):
+        n = len(classes)
+        rows: List[List[int]] = []
+        self.complete = np.zeros(n, dtype=bool)
+        for i in range(n):
+            anc = hierarchy.ancestors(classes.items[i])
+            self.complete[i] = anc is not None
+            rows.append([classes.intern(a) for a in anc] if anc is not None else [])
+        self.indptr, self.indices = _csr(rows)
+
+class _RoleTables:
+    def __init__(self, constraints: ConstraintIndex, role: str, pids: Interner, ents: Interner, classes: Interner):
+        n = len(pids) + 1  # last slot: PIDs without constraints
+        self.active = np.zeros(n, dtype=bool)
+        self.allowed: List[Tuple[str, ...]] = [() for _ in range(n)]
+        allowed_keys, exc_keys = [], []
+        for p, c in constraints.items():
+            i = pids.ids[p]
+            tc = getattr(c, role)
+            if tc is None:
+                continue
+            self.active[i] = True
+            self.allowed[i] = tc.classes
+            allowed_keys += [(i << 32) | classes.intern(a) for a in tc.allowed]
+            exc_keys += [(i << 32) | ents.intern(e) for e in tc.exceptions]
+        self.allowed_keys = np.unique(np.array(allowed_keys, dtype=np.int64))
+        self.exc_keys = np.unique(np.array(exc_keys, dtype=np.int64))
+
+class VectorizedScorer:
+    def __init__(self, constraints: Union[ConstraintIndex, Dict[str, Any]], types_cache: Optional[Dict[str, List[str]]] = None,
+                 oracle: Optional[TypeOracle] = None):
+        self.constraints = constraints = ConstraintIndex.of(constraints)
+        self.oracle = oracle
+        self.ents = Interner()
+        self.classes = Interner()
+        self.pids = Interner()
+        self.tpids = Interner()
+        self.types = _TypeTable(types_cache or {}, self.ents, self.classes)
+        for p in constraints:
+            self.pids.intern(p)
+        self.no_pid = len(self.pids)
+        self.value = _RoleTables(constraints, "value_type", self.pids, self.ents, self.classes)
+        self.subject = _RoleTables(constraints, "subject_type", self.pids, self.ents, self.classes)
+        self.single = np.zeros(self.no_pid + 1, dtype=bool)
+        for p, c in constraints.items():
+            self.single[self.pids.ids[p]] = c.single_value
+        self.oracle_types = self.ancestors = None
+        if oracle is not None and oracle.hierarchy is not None and oracle.types is not None:
+            self.oracle_types = self.types if oracle.types is types_cache else _TypeTable(oracle.types, self.ents, self.classes)
+            self.ancestors = _AncestorTable(oracle.hierarchy, self.classes)
+
+    def encode(self, preds: List[Dict[str, Any]]):
+        row_pid = pd.Index(self.pids.items, dtype=object).get_indexer(np.asarray([pr["pid"] for pr in preds], dtype=object))
+        row_pid[row_pid < 0] = self.no_pid
+        n_trip = np.array([len(pr.get("triples", [])) for pr in preds], dtype=np.int64)
+        triples = [t for pr in preds for t in pr.get("triples", [])]
+        subj = self.ents.intern_many([t["subj"] for t in triples])
+        obj = self.ents.intern_many([t["obj"] for t in triples])
+        tpid = self.tpids.intern_many([t["pid"] for t in triples])
+        row = np.repeat(np.arange(len(preds)), n_trip)
+        return row_pid, n_trip, row, subj, obj, tpid
+
+    def _type_violations(self, tables: _RoleTables, ent: np.ndarray, p: np.ndarray) -> np.ndarray:
+        T = len(ent)
+        active = tables.active[p]
+        exc = _member(_key(p, ent), tables.exc_keys)
+        typed = self.types.is_typed(ent)
+        intersect = np.zeros(T, dtype=bool)
+        idx = np.nonzero(typed & active)[0]
+        if len(idx):
+            pos, j = _expand(self.types.indptr, ent[idx])
+            hit = _member(_key(p[idx][pos], self.types.indices[j]), tables.allowed_keys)
+            intersect[idx[pos[hit]]] = True
+        unresolved = active & ~exc & ~(typed & intersect)
+        out = np.zeros(T, dtype=bool)
+        if self.oracle is None or not unresolved.any():
+            return out
+        if self.ancestors is not None:
+            unresolved = self._hierarchy_violations(tables, ent, p, unresolved, out)
+            if not unresolved.any():
+                return out
+        # Same fallback as the per-triple functions: ask whether any allowed class matches.
+        uidx = np.nonzero(unresolved)[0]
+        pairs, inv = np.unique(_key(p[uidx], ent[uidx]), return_inverse=True)
+        checks = [(self.ents.items[int(k & 0xFFFFFFFF)], tables.allowed[int(k >> 32)]) for k in pairs]
+        self.oracle.check_many(checks)
+        ok = np.array([any(self.oracle.is_instance_or_subclass(e, a) for a in allowed) for e, allowed in checks], dtype=bool)
+        out[uidx] = ~ok[inv.ravel()]
+        return out
+
+    def _hierarchy_violations(self, tables: _RoleTables, ent: np.ndarray, p: np.ndarray,
+                              unresolved: np.ndarray, out: np.ndarray) -> np.ndarray:
+        # Mirrors TypeOracle.local_answer over all allowed classes at once: a hit in any complete
+        # closure satisfies the constraint; no hit with every closure complete is a violation;
+        # anything else is left for the oracle.
+        T = len(ent)
+        idx = np.nonzero(unresolved & self.oracle_types.is_typed(ent))[0]
+        if not len(idx):
+            return unresolved
+        pos1, j1 = _expand(self.oracle_types.indptr, ent[idx])
+        tcls = self.oracle_types.indices[j1]
+        incomplete = np.zeros(T, dtype=bool)
+        incomplete[idx[pos1[~self.ancestors.complete[tcls]]]] = True
+        pos2, j2 = _expand(self.ancestors.indptr, tcls)
+        hit = _member(_key(p[idx][pos1][pos2], self.ancestors.indices[j2]), tables.allowed_keys)
+        ok = np.zeros(T, dtype=bool)
+        ok[idx[pos1[pos2[hit]]]] = True
+        settled = np.zeros(T, dtype=bool)
+        settled[idx] = True
+        settled &= ok | ~incomplete
+        out[settled & ~ok] = True
+        return unresolved & ~settled
+
+    def score(self, preds: List[Dict[str, Any]]) -> Dict[str, np.ndarray]:
+        row_pid, n_trip, row, subj, obj, tpid = self.encode(preds)
+        n = len(preds)
+        p = row_pid[row]
+        v_val = np.bincount(row, weights=self._type_violations(self.value, obj, p), minlength=n) > 0
+        v_sub = np.bincount(row, weights=self._type_violations(self.subject, subj, p), minlength=n) > 0
+        # Sorted by (row, subj, pid, obj), a group has two distinct objects iff two neighbours
+        # inside it differ in obj.
+        v_single = np.zeros(n, dtype=bool)
+        if len(row):
+            o = np.lexsort((obj, tpid, subj, row))
+            r, s, t, b = row[o], subj[o], tpid[o], obj[o]
+            same = (r[1:] == r[:-1]) & (s[1:] == s[:-1]) & (t[1:] == t[:-1]) & (b[1:] != b[:-1])
+            v_single[r[1:][same]] = True
+        v_single &= self.single[row_pid]
+        return {
+            "n_triples": n_trip,
+            "viol_value_type": v_val,
+            "viol_subject_type": v_sub,
+            "viol_single_value": v_single,
+            "any_violation": v_val | v_sub | v_single,
+            "has_output": n_trip > 0,
+        }
+
+    def score_rows(self, preds: List[Dict[str, Any]]) -> Iterable[Dict[str, Any]]:
+        flags = self.score(preds)
+        cols = [[pr["id"] for pr in preds], [pr.get("test_type") for pr in preds], [pr["pid"] for pr in preds]]
+        cols += [flags[k].astype(int).tolist() for k in EVAL_COLUMNS[3:]]
+        for vals in zip(*cols):
+            yield dict(zip(EVAL_COLUMNS, vals))
@@ -1,7 +1,10 @@
 from __future__ import annotations
-import requests, time
-from typing import Dict, Any, Optional
-from .io_utils import SimpleDiskCache
+import email.utils, random, requests, threading, time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Any, Iterable, List, Optional
+from requests.adapters import HTTPAdapter
+from . import metrics
+from .io_utils import Cache, open_cache
 
 WDQS = "https://query.wikidata.org/sparql"
 
@@ -10,22 +13,221 @@ HEADERS = {
     "Accept": "application/sparql-results+json"
 }
 
-def sparql(query: str, cache: Optional[SimpleDiskCache]=None, sleep: float=0.0) -> Dict[str, Any]:
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+_SESSION = requests.Session()
+
+def sparql(query: str, cache: Optional[Cache]=None, sleep: float=0.0) -> Dict[str, Any]:
     if cache is not None:
         hit = cache.get(query)
         if hit is not None:
             return hit
     if sleep:
         time.sleep(sleep)
-    r = requests.get(WDQS, params={"query": query}, headers=HEADERS, timeout=60)
+        metrics.incr("sparql.throttle_s", sleep)
+    t0 = time.perf_counter()
+    r = _SESSION.get(WDQS, params={"query": query}, headers=HEADERS, timeout=60)
+    metrics.incr("sparql.requests")
+    metrics.incr("sparql.time_s", time.perf_counter() - t0)
+    metrics.incr("sparql.bytes", len(r.content))
     r.raise_for_status()
     js = r.json()
     if cache is not None:
         cache.set(query, js)
     return js
 
+def rate_from_sleep(sleep: float) -> Optional[float]:
+    # Scripts still take --sleep; a sleep of s seconds becomes a 1/s requests-per-second budget.
+    return 1.0 / sleep if sleep and sleep > 0 else None
+
+class TokenBucket:
+    def __init__(self, rate: Optional[float], burst: int=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+            metrics.incr("sparql.throttle_s", wait)
+
+def _retry_after(r: requests.Response) -> Optional[float]:
+    v = r.headers.get("Retry-After")
+    if not v:
+        return None
+    try:
+        return max(0.0, float(v))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(v).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class CacheMiss(RuntimeError):
+    pass
+
+class SparqlClient:
+    # Keep-alive session + bounded thread pool + token bucket. Identical queries that
+    # are already in flight share one Future instead of hitting the endpoint twice.
+    # offline=True answers from the cache only: any query that would go to the endpoint
+    # raises CacheMiss (see contrakg.prewarm for filling a cache ahead of time).
+    def __init__(self, endpoint: str=WDQS, cache: Optional[Cache]=None, rate: Optional[float]=None, burst: int=1,
+                 max_workers: int=4, max_retries: int=5, backoff: float=1.0, max_backoff: float=60.0,
+                 timeout: float=60.0, headers: Optional[Dict[str, str]]=None, offline: bool=False):
+        self.endpoint = endpoint
+        self.cache = cache
+        self.offline = offline
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.headers = dict(headers or HEADERS)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sparql")
+        self._inflight: Dict[tuple, Future] = {}
+        self._lock = threading.RLock()
+        self.requests = 0
+        self.retries = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+        self.session.close()
+
+    def _sleep_before_retry(self, attempt: int, r: Optional[requests.Response]):
+        wait = _retry_after(r) if r is not None else None
+        if wait is None:
+            wait = random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+        with self._lock:
+            self.retries += 1
+        metrics.incr("sparql.retries")
+        metrics.incr("sparql.retry_wait_s", wait)
+        time.sleep(wait)
+
+    def _fetch(self, query: str, use_cache: bool) -> Dict[str, Any]:
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            with self._lock:
+                self.requests += 1
+            t0 = time.perf_counter()
+            try:
+                r = self.session.get(self.endpoint, params={"query": query}, headers=self.headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                metrics.incr("sparql.errors")
+                if attempt >= self.max_retries:
+                    raise
+                self._sleep_before_retry(attempt, None)
+                attempt += 1
+                continue
+            metrics.incr("sparql.requests")
+            metrics.incr("sparql.time_s", time.perf_counter() - t0)
+            metrics.incr("sparql.bytes", len(r.content))
+            if r.status_code >= 400:
+                metrics.incr("sparql.errors")
+            if r.status_code in RETRY_STATUS and attempt < self.max_retries:
+                self._sleep_before_retry(attempt, r)
+                attempt += 1
+                continue
+            r.raise_for_status()
+            js = r.json()
+            if use_cache and self.cache is not None:
+                self.cache.set(query, js)
+            return js
+
+    def submit(self, query: str, use_cache: bool=True) -> Future:
+        if use_cache and self.cache is not None:
+            hit = self.cache.get(query)
+            if hit is not None:
+                fut: Future = Future()
+                fut.set_result(hit)
+                return fut
+        if self.offline:
+            raise CacheMiss(f"offline and not in the cache (see scripts/prewarm_cache.py): {' '.join(query.split())[:200]}")
+        key = (query, use_cache)
+        with self._lock:
+            fut = self._inflight.get(key)
+            if fut is not None:
+                metrics.incr("sparql.deduped")
+            else:
+                fut = self._pool.submit(self._fetch, query, use_cache)
+                self._inflight[key] = fut
+                fut.add_done_callback(lambda _f, k=key: self._done(k))
+            return fut
+
+    def _done(self, key: tuple):
+        with self._lock:
+            self._inflight.pop(key, None)
+
+    def query(self, query: str, use_cache: bool=True) -> Dict[str, Any]:
+        return self.submit(query, use_cache=use_cache).result()
+
+    def query_many(self, queries: Iterable[str], use_cache: bool=True, return_exceptions: bool=False) -> List[Any]:
+        futs = [self.submit(q, use_cache=use_cache) for q in queries]
+        out = []
+        for f in futs:
+            try:
+                out.append(f.result())
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                out.append(e)
+        return out
+
+def default_client(cache_dir: Optional[str]=".cache_wdqs", sleep: float=0.1, max_workers: int=4,
+                   endpoint: str=WDQS, offline: bool=False) -> SparqlClient:
+    cache = open_cache(cache_dir) if cache_dir else None
+    if offline and cache is None:
+        raise ValueError("offline mode needs a cache_dir")
+    return SparqlClient(endpoint=endpoint, cache=cache, rate=rate_from_sleep(sleep), max_workers=max_workers,
+                        offline=offline)
+
 def qid(url_or_qid: str) -> str:
     return url_or_qid.rsplit("/",1)[-1] if url_or_qid.startswith("http") else url_or_qid
 
 def pid(url_or_pid: str) -> str:
     return url_or_pid.rsplit("/",1)[-1] if url_or_pid.startswith("http") else url_or_pid
+
+def entity_query(ents: List[str]) -> str:
+    # Label and P31 in one round trip; entities without P31 still come back (OPTIONAL).
+    values=" ".join([f"wd:{e}" for e in ents])
+    return f"""
+        SELECT ?x ?xLabel ?t WHERE {{
+          VALUES ?x {{ {values} }}
+          OPTIONAL {{ ?x wdt:P31 ?t . }}
+          SERVICE wikibase:label {{ bd:serviceParam wikibase:language "en". }}
+        }}
+        """
+
+def parse_entities(js: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    # -> {qid: {"label": str, "types": [...]}} in binding order
+    out={}
+    for b in js["results"]["bindings"]:
+        rec=out.setdefault(qid(b["x"]["value"]), {"label": b.get("xLabel",{}).get("value",""), "types": []})
+        if "t" in b:
+            t=qid(b["t"]["value"])
+            if t not in rec["types"]:
+                rec["types"].append(t)
+    return out
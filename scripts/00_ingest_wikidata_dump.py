@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+from __future__ import annotations
+import argparse
+from pathlib import Path
+from contrakg import metrics
+from contrakg.contrast import TypePoolIndex, constraint_classes
+from contrakg.dump import build_pools_from_dump, ingest_dump, subclass_graph
+from contrakg.entity_store import write_entity_store
+from contrakg.io_utils import read_jsonl, write_json_atomic
+
+def main():
+    ap = argparse.ArgumentParser(description="Offline replacement for steps 1-2 (and the type pools of step 3) "
+                                             "from a Wikidata JSON dump (.json, .json.gz or .json.bz2).")
+    ap.add_argument("--dump", required=True)
+    ap.add_argument("--examples", required=True)
+    ap.add_argument("--pids", required=True)
+    ap.add_argument("--out_constraints", required=True)
+    ap.add_argument("--out_labels", required=True)
+    ap.add_argument("--out_types", required=True)
+    ap.add_argument("--out_subclass", default=None)
+    ap.add_argument("--out_store", default=None, help="also write labels+types as a binary entity store")
+    ap.add_argument("--out_pools", default=None, help="type-pool index for 03 --pools (second pass over the dump)")
+    ap.add_argument("--per_class", type=int, default=50)
+    ap.add_argument("--max_classes", type=int, default=None)
+    ap.add_argument("--workers", type=int, default=4, help="parse processes; 0 parses in the main process")
+    ap.add_argument("--chunk_lines", type=int, default=2000)
+    metrics.add_arguments(ap)
+    args = ap.parse_args()
+    metrics.start(args, "00_ingest_wikidata_dump")
+
+    pids = [l.strip().split()[0] for l in Path(args.pids).read_text(encoding="utf-8").splitlines()
+            if l.strip() and not l.strip().startswith("#")]
+    ents = set()
+    for ex in read_jsonl(args.examples):
+        ents.add(ex["subj"]); ents.add(ex["obj"])
+
+    with metrics.stage("scan_dump", items=len(ents)):
+        res = ingest_dump(args.dump, ents, pids, workers=args.workers, chunk_lines=args.chunk_lines)
+    write_json_atomic(args.out_constraints, res.constraints)
+    print(f"[OK] wrote constraints={args.out_constraints} (pids={len(res.constraints)})")
+
+    labels, types = dict(res.labels), dict(res.types)
+    if args.out_pools:
+        seeds = constraint_classes(res.constraints)[:args.max_classes]
+        with metrics.stage("pool_pass", items=len(seeds)):
+            pools, pool_labels, pool_types = build_pools_from_dump(args.dump, res.parents, seeds, per_class=args.per_class,
+                                                                   workers=args.workers, chunk_lines=args.chunk_lines)
+        TypePoolIndex(pools, per_class=args.per_class).save(args.out_pools)
+        # 03 needs labels for the pool entities it swaps in, and 05 their types.
+        for q, lab in pool_labels.items():
+            labels.setdefault(q, lab)
+        for q, ts in pool_types.items():
+            if ts:
+                types.setdefault(q, ts)
+        print(f"[OK] wrote pools={args.out_pools} (classes={len(pools)}, "
+              f"empty={sum(1 for p in pools.values() if not p)})")
+
+    with metrics.stage("write_caches", items=len(labels)):
+        write_json_atomic(args.out_labels, labels)
+        write_json_atomic(args.out_types, types)
+        if args.out_store:
+            write_entity_store(args.out_store, labels, types)
+    if args.out_store:
+        print(f"[OK] wrote store={args.out_store}")
+    if args.out_subclass:
+        parents = subclass_graph(res.parents, {t for ts in types.values() for t in ts})
+        write_json_atomic(args.out_subclass, parents)
+        print(f"[OK] wrote subclass={args.out_subclass}, classes={len(parents)}")
+    print(f"[OK] wrote labels={args.out_labels}, types={args.out_types}, ents={len(ents)} (found={len(res.labels)})")
+
+if __name__=="__main__":
+    main()
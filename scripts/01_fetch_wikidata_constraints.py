@@ -2,7 +2,10 @@
 from __future__ import annotations
 import argparse, json
 from pathlib import Path
-from contrakg.constraints import fetch_constraints
+from contrakg import metrics
+from contrakg.constraints import fetch_constraints, refresh_constraints
+from contrakg.io_utils import write_json_atomic
+from contrakg.wikidata import WDQS, default_client
 
 def main():
     ap = argparse.ArgumentParser()
@@ -10,12 +13,32 @@ def main():
     ap.add_argument("--out_json", required=True)
     ap.add_argument("--cache_dir", default=".cache_wdqs")
     ap.add_argument("--sleep", type=float, default=0.2)
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--endpoint", default=WDQS)
+    ap.add_argument("--offline", action="store_true", help="answer from --cache_dir only; a cache miss is an error")
+    ap.add_argument("--batch_size", type=int, default=50, help="PIDs per query")
+    ap.add_argument("--refresh", action="store_true",
+                    help="merge into the existing --out_json, fetching only PIDs missing from it (and stale ones with --max_age)")
+    ap.add_argument("--max_age", type=float, default=None, help="re-fetch PIDs last fetched more than this many seconds ago")
+    metrics.add_arguments(ap)
     args = ap.parse_args()
+    metrics.start(args, "01_fetch_wikidata_constraints")
 
     pids = [l.strip().split()[0] for l in Path(args.pids).read_text(encoding="utf-8").splitlines()
             if l.strip() and not l.strip().startswith("#")]
-    data = fetch_constraints(pids, cache_dir=args.cache_dir, sleep=args.sleep)
-    Path(args.out_json).write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    client = default_client(args.cache_dir, args.sleep, max_workers=args.workers, endpoint=args.endpoint,
+                            offline=args.offline)
+    out = Path(args.out_json)
+    if args.refresh and out.exists():
+        existing = json.loads(out.read_text(encoding="utf-8"))
+        with metrics.stage("refresh_constraints", items=len(pids)):
+            data, fetched = refresh_constraints(existing, pids, client, batch_size=args.batch_size, max_age=args.max_age)
+        write_json_atomic(out, data)
+        print(f"[OK] wrote {args.out_json} (pids={len(data)}, refreshed={len(fetched)})")
+        return
+    with metrics.stage("fetch_constraints", items=len(pids)):
+        data = fetch_constraints(pids, client=client, batch_size=args.batch_size, max_age=args.max_age)
+    write_json_atomic(out, data)
     print(f"[OK] wrote {args.out_json} (pids={len(pids)})")
 
 if __name__ == "__main__":
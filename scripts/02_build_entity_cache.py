@@ -2,60 +2,96 @@
 from __future__ import annotations
 import argparse, json
 from pathlib import Path
-from collections import defaultdict
-from contrakg.io_utils import read_jsonl
-from contrakg.wikidata import sparql, qid
-from contrakg.io_utils import SimpleDiskCache
+from contrakg import metrics
+from contrakg.entity_store import load_labels, load_types, store_entries, write_entity_store
+from contrakg.io_utils import iter_chunks, read_jsonl, write_json_atomic
+from contrakg.wikidata import WDQS, default_client, entity_query, parse_entities
+from contrakg.hierarchy import fetch_subclass_edges
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--examples", required=True)
     ap.add_argument("--out_types", required=True)
     ap.add_argument("--out_labels", required=True)
+    ap.add_argument("--out_subclass", default=None, help="also write the P279 graph above all P31 types")
+    ap.add_argument("--out_store", default=None, help="also write labels+types as a binary entity store")
+    ap.add_argument("--incremental", action="store_true",
+                    help="keep existing --out_labels/--out_types/--out_subclass and only fetch entities missing from them")
+    ap.add_argument("--chunk", type=int, default=200, help="entities per query")
+    ap.add_argument("--checkpoint_every", type=int, default=20, help="chunks between checkpoint journal flushes")
     ap.add_argument("--cache_dir", default=".cache_wdqs")
     ap.add_argument("--sleep", type=float, default=0.1)
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--endpoint", default=WDQS)
+    ap.add_argument("--offline", action="store_true", help="answer from --cache_dir only; a cache miss is an error")
+    metrics.add_arguments(ap)
     args = ap.parse_args()
+    metrics.start(args, "02_build_entity_cache")
 
     ents=set()
-    for ex in read_jsonl(args.examples):
-        ents.add(ex["subj"]); ents.add(ex["obj"])
-    ents=sorted(ents)
-    cache = SimpleDiskCache(args.cache_dir)
+    with metrics.stage("read_examples") as st:
+        for ex in read_jsonl(args.examples):
+            ents.add(ex["subj"]); ents.add(ex["obj"])
+            st.add()
 
-    labels={}
-    chunk=200
-    for i in range(0, len(ents), chunk):
-        sub=ents[i:i+chunk]
-        values=" ".join([f"wd:{e}" for e in sub])
-        q=f"""
-        SELECT ?x ?xLabel WHERE {{
-          VALUES ?x {{ {values} }}
-          SERVICE wikibase:label {{ bd:serviceParam wikibase:language "en". }}
-        }}
-        """
-        js=sparql(q, cache=cache, sleep=args.sleep)
-        for b in js["results"]["bindings"]:
-            labels[qid(b["x"]["value"])]=b.get("xLabel",{}).get("value","")
+    labels, types, parents = {}, {}, {}
+    if args.incremental:
+        if Path(args.out_labels).exists():
+            labels=dict(load_labels(args.out_labels).items())
+        if Path(args.out_types).exists():
+            types=dict(load_types(args.out_types).items())
+        if args.out_subclass and Path(args.out_subclass).exists():
+            parents=json.loads(Path(args.out_subclass).read_text(encoding="utf-8"))
+    kept=len(labels)
 
-    types=defaultdict(list)
-    for i in range(0, len(ents), chunk):
-        sub=ents[i:i+chunk]
-        values=" ".join([f"wd:{e}" for e in sub])
-        q=f"""
-        SELECT ?x ?t WHERE {{
-          VALUES ?x {{ {values} }}
-          OPTIONAL {{ ?x wdt:P31 ?t . }}
-        }}
-        """
-        js=sparql(q, cache=cache, sleep=args.sleep)
-        for b in js["results"]["bindings"]:
-            x=qid(b["x"]["value"])
-            if "t" in b:
-                types[x].append(qid(b["t"]["value"]))
+    # Fetched chunks are appended to a journal next to --out_labels; a rerun replays it, so a
+    # crash loses at most `--checkpoint_every` chunks. It is removed once the outputs are written.
+    journal=Path(args.out_labels + ".journal.jsonl")
+    resumed=0
+    if journal.exists():
+        for rec in read_jsonl(journal):
+            if rec["x"] in ents and rec["x"] not in labels:
+                labels[rec["x"]]=rec["label"]
+                if rec["types"]:
+                    types[rec["x"]]=rec["types"]
+                resumed+=1
 
-    Path(args.out_labels).write_text(json.dumps(labels, ensure_ascii=False, indent=2), encoding="utf-8")
-    Path(args.out_types).write_text(json.dumps(types, ensure_ascii=False, indent=2), encoding="utf-8")
-    print(f"[OK] wrote labels={args.out_labels}, types={args.out_types}, ents={len(ents)}")
+    # An entity counts as fetched once it has a label entry (possibly ""), since every
+    # entity in VALUES comes back with one.
+    todo=sorted(e for e in ents if e not in labels)
+    client = default_client(args.cache_dir, args.sleep, max_workers=args.workers, endpoint=args.endpoint,
+                            offline=args.offline)
+    journal.parent.mkdir(parents=True, exist_ok=True)
+    with journal.open("a", encoding="utf-8") as jf, metrics.stage("fetch_entities", items=len(todo)):
+        for window in iter_chunks(iter_chunks(todo, args.chunk), args.checkpoint_every):
+            for sub, js in zip(window, client.query_many([entity_query(sub) for sub in window])):
+                got=parse_entities(js)
+                for e in sub:
+                    rec=got.get(e, {"label": "", "types": []})
+                    labels[e]=rec["label"]
+                    if rec["types"]:
+                        types[e]=rec["types"]
+                    jf.write(json.dumps({"x": e, **rec}, ensure_ascii=False) + "\n")
+            jf.flush()
+
+    with metrics.stage("write_caches", items=len(labels)):
+        # The store only holds QIDs; filter before writing anything, so it cannot abort the run.
+        store = store_entries(labels, types) if args.out_store else None
+        write_json_atomic(args.out_labels, labels)
+        write_json_atomic(args.out_types, types)
+        if store is not None:
+            write_entity_store(args.out_store, store[0], store[1])
+    if store is not None:
+        print(f"[OK] wrote store={args.out_store}" + (f" (skipped {store[2]} non-QID keys/types)" if store[2] else ""))
+    if args.out_subclass:
+        classes = {t for ts in types.values() for t in ts}
+        with metrics.stage("fetch_subclass", items=len(classes)):
+            parents = fetch_subclass_edges(classes, chunk=args.chunk, parents=parents, client=client)
+        write_json_atomic(args.out_subclass, parents)
+        print(f"[OK] wrote subclass={args.out_subclass}, classes={len(parents)}")
+    journal.unlink()
+    print(f"[OK] wrote labels={args.out_labels}, types={args.out_types}, ents={len(labels)} "
+          f"(kept={kept}, resumed={resumed}, fetched={len(todo)})")
 
 if __name__=="__main__":
     main()
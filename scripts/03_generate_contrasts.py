@@ -1,55 +1,79 @@
 #!/usr/bin/env python
 from __future__ import annotations
-import argparse, json, random
+import argparse, itertools, random
 from pathlib import Path
+from contrakg import metrics
+from contrakg.constraints import ConstraintIndex
+from contrakg.entity_store import load_labels
 from contrakg.io_utils import read_jsonl, write_jsonl
-from contrakg.contrast import build_type_pools, make_range_violation, make_subject_violation, make_single_value_violation
+from contrakg.wikidata import WDQS, default_client
+from contrakg.contrast import CandidateIndex, TypePoolIndex, constraint_classes, generate_contrasts_parallel, make_contrasts
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--examples", required=True)
     ap.add_argument("--constraints", required=True)
-    ap.add_argument("--labels", required=True)
+    ap.add_argument("--labels", required=True, help="labels.json or an entity store")
     ap.add_argument("--out_pairs", required=True)
     ap.add_argument("--seed", type=int, default=42)
     ap.add_argument("--per_class", type=int, default=50)
+    ap.add_argument("--pools", default=None, help="persisted type-pool index; reused and extended across runs")
+    ap.add_argument("--max_classes", type=int, default=None,
+                    help="only build pools for the first N constraint classes (sorted); default all")
+    ap.add_argument("--pool_batch", type=int, default=20, help="classes per pool query")
     ap.add_argument("--sleep", type=float, default=0.1)
     ap.add_argument("--cache_dir", default=".cache_wdqs")
+    ap.add_argument("--sparql_workers", type=int, default=4)
+    ap.add_argument("--endpoint", default=WDQS)
+    ap.add_argument("--offline", action="store_true", help="answer from --cache_dir only; a cache miss is an error")
     ap.add_argument("--max_pairs", type=int, default=5000)
+    ap.add_argument("--shard_size", type=int, default=None,
+                    help="write --out_pairs as a directory of part-*.jsonl files of this many rows")
+    ap.add_argument("--workers", type=int, default=0,
+                    help="generation processes; >0 switches to a per-example RNG seeded from (seed, id), "
+                         "so output is identical for any worker count but differs from the serial default")
+    metrics.add_arguments(ap)
     args = ap.parse_args()
+    metrics.start(args, "03_generate_contrasts")
 
     rng = random.Random(args.seed)
-    constraints = json.loads(Path(args.constraints).read_text(encoding="utf-8"))
-    labels = json.loads(Path(args.labels).read_text(encoding="utf-8"))
+    with metrics.stage("load_inputs"):
+        constraints = ConstraintIndex.load(args.constraints)
+        labels = load_labels(args.labels)
 
-    seed_classes=set()
-    for _,c in constraints.items():
-        for tc in c.get("subject_type",[]):
-            seed_classes.update(tc.get("classes") or [])
-        for tc in c.get("value_type",[]):
-            seed_classes.update(tc.get("classes") or [])
-    seed_classes=sorted(seed_classes)[:50]
+    seed_classes = constraint_classes(constraints)[:args.max_classes]
 
-    type_pools = build_type_pools(seed_classes, cache_dir=args.cache_dir, per_class=args.per_class, sleep=args.sleep)
+    client = default_client(args.cache_dir, args.sleep, max_workers=args.sparql_workers, endpoint=args.endpoint,
+                            offline=args.offline)
+    with metrics.stage("type_pools", items=len(seed_classes)):
+        stored = TypePoolIndex.load(args.pools) if args.pools and Path(args.pools).exists() else None
+        type_pools = TypePoolIndex.build(seed_classes, client, per_class=args.per_class, batch_size=args.pool_batch,
+                                         existing=stored)
+        if args.pools:
+            (stored.merged(type_pools) if stored is not None and stored.per_class == args.per_class else type_pools).save(args.pools)
+        type_pools.precompute(constraints)
 
-    pairs=[]
-    for ex in read_jsonl(args.examples):
-        cand=[]
-        v1 = make_range_violation(ex, constraints, labels, type_pools, rng)
-        if v1: cand.append(v1)
-        v2 = make_subject_violation(ex, constraints, labels, type_pools, rng)
-        if v2: cand.append(v2)
-        v3 = make_single_value_violation(ex, constraints, labels, rng)
-        if v3: cand.append(v3)
-        for v in cand:
-            pairs.append(v)
-            if len(pairs) >= args.max_pairs:
-                break
-        if len(pairs) >= args.max_pairs:
-            break
+    if args.workers > 0:
+        pairs = generate_contrasts_parallel(read_jsonl(args.examples), constraints, labels, type_pools,
+                                            seed=args.seed, workers=args.workers)
+    else:
+        candidates = CandidateIndex(labels)
+        pairs = (v for ex in read_jsonl(args.examples)
+                 for v in make_contrasts(ex, constraints, labels, type_pools, rng, candidates=candidates))
 
-    write_jsonl(args.out_pairs, pairs)
-    print(f"[OK] wrote pairs={args.out_pairs} n={len(pairs)}")
+    n = 0
+    def counted(rows):
+        nonlocal n
+        for r in rows:
+            n += 1
+            yield r
+    with metrics.stage("generate") as st:
+        write_jsonl(args.out_pairs, counted(itertools.islice(pairs, args.max_pairs)), shard_size=args.shard_size)
+        st.add(n)
+    msg = f"[OK] wrote pairs={args.out_pairs} n={n}"
+    if type_pools.failed:
+        msg += f" (pool queries failed for {len(type_pools.failed)} classes: empty this run, not saved to --pools)"
+    print(msg)
 
 if __name__=="__main__":
     main()
@@ -1,28 +1,124 @@
 #!/usr/bin/env python
 from __future__ import annotations
-import argparse
-from contrakg.io_utils import read_jsonl, write_jsonl
-from contrakg.baselines import baseline_copy_gold, baseline_string_match_swap
+import argparse, json, statistics, time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contrakg import metrics
+from contrakg.entity_store import load_labels, load_types
+from contrakg.io_utils import JsonlWriter, iter_chunks, read_jsonl
+from contrakg.predictors import BUILTIN, load_predictor, run_batch
+
+_PREDICTORS = []
+
+def _init_worker(specs, use_contrast, kwargs):
+    # Entity stores pickle as their path, so process workers map the file rather than copy it.
+    _PREDICTORS[:] = [load_predictor(s, use_contrast=use_contrast, **kwargs) for s in specs]
+
+def _timed_batch(batch):
+    t0 = time.perf_counter()
+    res = run_batch(_PREDICTORS, batch)
+    return res, time.perf_counter() - t0
+
+def _parse_kv(items):
+    out = {}
+    for kv in items:
+        k, _, v = kv.partition("=")
+        try:
+            out[k] = json.loads(v)
+        except json.JSONDecodeError:
+            out[k] = v
+    return out
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--pairs", required=True)
-    ap.add_argument("--mode", choices=["copy_gold","string_match"], default="copy_gold")
+    ap.add_argument("--mode", default=None, help=f"built-in predictor ({', '.join(BUILTIN)}); alias of --predictor")
+    ap.add_argument("--predictor", default=None,
+                    help="built-in name, module:Class, or a 'contrakg.predictors' entry point; "
+                         "several comma-separated need a {mode} placeholder in --out_preds")
+    ap.add_argument("--predictor_arg", action="append", default=[], metavar="KEY=VALUE",
+                    help="constructor argument (VALUE parsed as JSON when possible)")
+    ap.add_argument("--labels", default=None, help="labels.json or entity store, passed to predictors taking `labels`")
+    ap.add_argument("--types", default=None, help="types.json or entity store, passed to predictors taking `types`")
     ap.add_argument("--use_contrast", action="store_true")
     ap.add_argument("--out_preds", required=True)
+    ap.add_argument("--shard_size", type=int, default=None,
+                    help="write --out_preds as a directory of part-*.jsonl files of this many rows")
+    ap.add_argument("--batch_size", type=int, default=64)
+    ap.add_argument("--workers", type=int, default=0, help="concurrent batches; 0 runs in the main thread")
+    ap.add_argument("--executor", choices=["thread", "process"], default="thread")
+    ap.add_argument("--latency_log", default=None, help="write per-batch size/latency records (JSONL)")
+    metrics.add_arguments(ap)
     args = ap.parse_args()
+    metrics.start(args, "04_run_baselines")
 
-    out=[]
-    for pair in read_jsonl(args.pairs):
-        if args.mode=="copy_gold":
-            p2 = {"orig_sentence": pair["contrast_sentence"], **pair} if args.use_contrast else pair
-            triples = baseline_copy_gold(p2)
+    if args.mode and args.predictor:
+        ap.error("--mode is an alias of --predictor; give only one of them")
+    specs = [m.strip() for m in (args.predictor or args.mode or "copy_gold").split(",") if m.strip()]
+    if len(specs) > 1 and "{mode}" not in args.out_preds:
+        ap.error("--out_preds needs a {mode} placeholder when several predictors are given")
+    kwargs = _parse_kv(args.predictor_arg)
+    with metrics.stage("load_inputs"):
+        if args.labels:
+            kwargs["labels"] = load_labels(args.labels)
+        if args.types:
+            kwargs["types"] = load_types(args.types)
+    paths = {s: args.out_preds.replace("{mode}", s.replace(":", "_")) for s in specs}
+    writers = {s: JsonlWriter(p, shard_size=args.shard_size) for s, p in paths.items()}
+    log = JsonlWriter(args.latency_log) if args.latency_log else None
+
+    if args.workers <= 0:
+        _init_worker(specs, args.use_contrast, kwargs)
+        results = ((b, _timed_batch(b)) for b in iter_chunks(read_jsonl(args.pairs), args.batch_size))
+        pool = None
+    else:
+        Pool = ProcessPoolExecutor if args.executor == "process" else ThreadPoolExecutor
+        if args.executor == "process":
+            pool = Pool(args.workers, initializer=_init_worker, initargs=(specs, args.use_contrast, kwargs))
         else:
-            triples = baseline_string_match_swap(pair, use_contrast=args.use_contrast)
-        out.append({"id": pair["id"], "test_type": pair.get("test_type"), "pid": pair["pid"],
-                    "is_contrast": bool(args.use_contrast), "triples": triples})
-    write_jsonl(args.out_preds, out)
-    print(f"[OK] wrote preds={args.out_preds} rows={len(out)}")
+            _init_worker(specs, args.use_contrast, kwargs)
+            pool = Pool(args.workers)
+        results = _ordered(pool, iter_chunks(read_jsonl(args.pairs), args.batch_size), window=2 * args.workers)
+
+    t0 = time.perf_counter()
+    latencies, n = [], 0
+    with metrics.stage("predict") as st:
+        for batch, (res, lat) in results:
+            for s, triples_list in zip(specs, res):
+                writers[s].write_rows({"id": pair["id"], "test_type": pair.get("test_type"), "pid": pair["pid"],
+                                       "is_contrast": bool(args.use_contrast), "triples": triples}
+                                      for pair, triples in zip(batch, triples_list))
+            if log is not None:
+                log.write_rows([{"batch": len(latencies), "size": len(batch), "latency_s": round(lat, 6)}])
+            latencies.append(lat)
+            n += len(batch)
+        st.add(n)
+    wall = time.perf_counter() - t0
+    if pool is not None:
+        pool.shutdown()
+    for w in writers.values():
+        w.close()
+    if log is not None:
+        log.close()
+
+    for p in paths.values():
+        print(f"[OK] wrote preds={p} rows={n}")
+    if latencies:
+        q = statistics.quantiles(latencies, n=20) if len(latencies) > 1 else [latencies[0]] * 19
+        print(f"[OK] batches={len(latencies)} latency_mean={statistics.mean(latencies):.4f}s "
+              f"p50={statistics.median(latencies):.4f}s p95={q[18]:.4f}s throughput={n / wall if wall else 0.0:.1f} pairs/s")
+
+def _ordered(pool, batches, window):
+    # Bounded look-ahead: at most `window` batches in flight, results yielded in input order.
+    pending = deque()
+    for batch in batches:
+        pending.append((batch, pool.submit(_timed_batch, batch)))
+        if len(pending) >= window:
+            b, f = pending.popleft()
+            yield b, f.result()
+    while pending:
+        b, f = pending.popleft()
+        yield b, f.result()
 
 if __name__=="__main__":
     main()
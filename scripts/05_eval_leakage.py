@@ -1,65 +1,122 @@
 #!/usr/bin/env python
 from __future__ import annotations
-import argparse, json
+import argparse
 from pathlib import Path
-import pandas as pd
-from contrakg.io_utils import read_jsonl
-from contrakg.eval import TypeOracle, violates_value_type, violates_subject_type, violates_single_value
+from contrakg import metrics
+from contrakg.constraints import ConstraintIndex
+from contrakg.entity_store import load_types
+from contrakg.io_utils import iter_chunks, open_row_writer, read_jsonl
+from contrakg.hierarchy import ClassHierarchy
+from contrakg.wikidata import WDQS, default_client
+from contrakg.eval import (EVAL_COLUMNS, PAIRED_COLUMNS, LeakageSummary, PairedSummary, TypeOracle, paired_row,
+                           score_predictions)
+from contrakg.join import JOIN_METHODS, PairedJoin
+
+XLSX_MAX_ROWS = 1_048_575
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--pairs", required=True)
     ap.add_argument("--preds", required=True)
+    ap.add_argument("--orig_preds", default=None,
+                    help="predictions on the original sentences (04 without --use_contrast); --preds then holds the "
+                         "contrast run and the output has one row per pair with both runs' flags and an outcome")
+    ap.add_argument("--join", choices=JOIN_METHODS, default="auto",
+                    help="paired mode: hash join in memory, external sort-merge, or hash until --join_max_rows")
+    ap.add_argument("--join_max_rows", type=int, default=2_000_000,
+                    help="pairs + orig rows held in memory before auto switches to the sort-merge (also its run size x2)")
+    ap.add_argument("--tmp_dir", default=None, help="sort-merge runs (default: system temp dir)")
     ap.add_argument("--constraints", required=True)
-    ap.add_argument("--types", required=False, default=None)
+    ap.add_argument("--types", required=False, default=None, help="types.json or an entity store")
     ap.add_argument("--use_oracle", action="store_true")
+    ap.add_argument("--subclass", default=None, help="P279 graph from 02 --out_subclass; oracle answers locally first")
     ap.add_argument("--cache_dir", default=".cache_wdqs")
     ap.add_argument("--sleep", type=float, default=0.05)
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--endpoint", default=WDQS)
+    ap.add_argument("--offline", action="store_true", help="answer from --cache_dir only; a cache miss is an error")
     ap.add_argument("--out_csv", required=True)
+    ap.add_argument("--out_parquet", default=None, help="also stream per-example rows to Parquet (needs pyarrow)")
+    ap.add_argument("--xlsx", action="store_true", help="also write <out_csv>.xlsx (per_example + summary sheets)")
+    ap.add_argument("--chunk_size", type=int, default=50_000)
+    ap.add_argument("--engine", choices=["python", "vectorized"], default="python",
+                    help="vectorized scores each chunk with NumPy (same results)")
+    metrics.add_arguments(ap)
     args = ap.parse_args()
+    metrics.start(args, "05_eval_leakage")
 
-    constraints = json.loads(Path(args.constraints).read_text(encoding="utf-8"))
-    types_cache = json.loads(Path(args.types).read_text(encoding="utf-8")) if args.types else None
-    oracle = TypeOracle(cache_dir=args.cache_dir, sleep=args.sleep) if args.use_oracle else None
-
-    rows=[]
-    for pr in read_jsonl(args.preds):
-        pid = pr["pid"]
-        c = constraints.get(pid, {})
-        triples = pr.get("triples", [])
-        v_val = any(violates_value_type(t, c, oracle, types_cache) for t in triples)
-        v_sub = any(violates_subject_type(t, c, oracle, types_cache) for t in triples)
-        v_single = violates_single_value(triples, c)
-        violated = v_val or v_sub or v_single
+    with metrics.stage("load_inputs"):
+        constraints = ConstraintIndex.load(args.constraints)
+        types_cache = load_types(args.types) if args.types else None
+        hierarchy = ClassHierarchy.load(args.subclass).precompute() if args.subclass else None
+    oracle = None
+    if args.use_oracle:
+        client = default_client(args.cache_dir, args.sleep, max_workers=args.workers, endpoint=args.endpoint,
+                                offline=args.offline)
+        oracle = TypeOracle(client=client, hierarchy=hierarchy, types=types_cache)
 
-        rows.append({
-            "id": pr["id"],
-            "test_type": pr.get("test_type"),
-            "pid": pid,
-            "n_triples": len(triples),
-            "viol_value_type": int(v_val),
-            "viol_subject_type": int(v_sub),
-            "viol_single_value": int(v_single),
-            "any_violation": int(violated),
-        })
+    paired = args.orig_preds is not None
+    summary = PairedSummary() if paired else LeakageSummary()
+    columns = PAIRED_COLUMNS if paired else EVAL_COLUMNS
+    out_path = Path(args.out_csv)
+    writers = [open_row_writer(out_path, columns)]
+    if args.out_parquet:
+        writers.append(open_row_writer(args.out_parquet, columns))
+    buf = []
+    if args.engine == "vectorized":
+        from contrakg.vectorized import VectorizedScorer
+        scorer = VectorizedScorer(constraints, types_cache, oracle)
+        def score(path):
+            return (row for chunk in iter_chunks(read_jsonl(path), args.chunk_size) for row in scorer.score_rows(chunk))
+    else:
+        def score(path):
+            return score_predictions(read_jsonl(path), constraints, oracle, types_cache, chunk_size=args.chunk_size)
+    join = None
+    if paired:
+        # Orig rows are scored (and, for the hash join, held) before the contrast rows stream through.
+        join = PairedJoin(args.join, max_rows=args.join_max_rows, tmp_dir=args.tmp_dir)
+        rows = (paired_row(*r) for r in join.join(read_jsonl(args.pairs), score(args.orig_preds), score(args.preds)))
+    else:
+        rows = score(args.preds)
+    n = 0
+    with metrics.stage("score") as st:
+        for row in rows:
+            summary.add(row)
+            n += 1
+            buf.append(row)
+            if len(buf) >= args.chunk_size:
+                for w in writers:
+                    w.write_rows(buf)
+                buf = []
+        for w in writers:
+            w.write_rows(buf)
+            w.close()
+        st.add(n)
+    if join is not None:
+        join.close()
 
-    df = pd.DataFrame(rows)
-    df["has_output"] = (df["n_triples"] > 0).astype(int)
-    itlr = (df.loc[df["has_output"]==1, "any_violation"].mean() if (df["has_output"]==1).any() else 0.0)
-    summary = pd.DataFrame([{
-        "ITLR": float(itlr),
-        "rows": int(len(df)),
-        "rows_with_output": int(df["has_output"].sum()),
-        "viol_rate_any": float(df["any_violation"].mean() if len(df) else 0.0)
-    }])
+    summary_path = out_path.with_suffix(".summary.csv")
+    sw = open_row_writer(summary_path, list(summary.to_dict()))
+    sw.write_rows([summary.to_dict()])
+    sw.close()
+    written = [str(out_path), str(summary_path)] + ([args.out_parquet] if args.out_parquet else [])
 
-    out_path = Path(args.out_csv)
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    with pd.ExcelWriter(out_path.with_suffix(".xlsx")) as w:
-        df.to_excel(w, index=False, sheet_name="per_example")
-        summary.to_excel(w, index=False, sheet_name="summary")
-    df.to_csv(out_path, index=False)
-    print(f"[OK] wrote {args.out_csv} and {out_path.with_suffix('.xlsx')}")
+    if args.xlsx:
+        import pandas as pd
+        if n > XLSX_MAX_ROWS:
+            raise SystemExit(f"--xlsx: {n} rows exceed the Excel sheet limit ({XLSX_MAX_ROWS}); use the CSV/Parquet output.")
+        with metrics.stage("xlsx"), pd.ExcelWriter(out_path.with_suffix(".xlsx")) as w:
+            pd.read_csv(out_path, keep_default_na=False, na_values=[""]).to_excel(w, index=False, sheet_name="per_example")
+            pd.DataFrame([summary.to_dict()]).to_excel(w, index=False, sheet_name="summary")
+        written.append(str(out_path.with_suffix(".xlsx")))
+    res = summary.to_dict()
+    msg = f"[OK] wrote {', '.join(written)} ITLR={res['ITLR']:.4f}"
+    if paired:
+        js = join.stats
+        msg += (f" orig_ITLR={res['orig_ITLR']:.4f} leaked={res['leaked']} already_wrong={res['already_wrong']} "
+                f"leak_rate={res['leak_rate']:.4f} (join={js['method']}, pairs={js['pairs']}, matched={js['matched']}, "
+                f"unmatched orig={js['unmatched_orig']} contrast={js['unmatched_contrast']})")
+    print(msg)
 
 if __name__=="__main__":
     main()
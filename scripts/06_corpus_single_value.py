@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+from __future__ import annotations
+import argparse
+from pathlib import Path
+from contrakg import metrics
+from contrakg.constraints import ConstraintIndex
+from contrakg.corpus import SingleValueChecker
+from contrakg.io_utils import JsonlWriter, read_jsonl, write_json_atomic
+
+def main():
+    ap = argparse.ArgumentParser(description="Single-value violations across all rows of one or more prediction files "
+                                             "(same subject and PID, different objects in different rows or documents).")
+    ap.add_argument("--preds", required=True, nargs="+", help="prediction JSONL files or shard directories from step 4")
+    ap.add_argument("--constraints", required=True)
+    ap.add_argument("--out_jsonl", required=True, help="one line per conflicting (subj, pid) group")
+    ap.add_argument("--max_records", type=int, default=5_000_000, help="triples held in memory before spilling to disk")
+    ap.add_argument("--partitions", type=int, default=64)
+    ap.add_argument("--tmp_dir", default=None, help="where spill files go (default: system temp dir)")
+    ap.add_argument("--max_rows_per_group", type=int, default=100, help="row references listed per group")
+    metrics.add_arguments(ap)
+    args = ap.parse_args()
+    metrics.start(args, "06_corpus_single_value")
+
+    constraints = ConstraintIndex.load(args.constraints)
+    with SingleValueChecker(constraints, max_records=args.max_records, partitions=args.partitions,
+                            tmp_dir=args.tmp_dir, max_rows_per_group=args.max_rows_per_group) as chk:
+        with metrics.stage("partition") as st:
+            for p in args.preds:
+                chk.add_rows(read_jsonl(p), source=p)
+            st.add(chk.stats["triples"])
+        w = JsonlWriter(args.out_jsonl)
+        with metrics.stage("group") as st:
+            w.write_rows(chk.conflicts())
+            st.add(chk.stats["checked"])
+        w.close()
+        stats = dict(chk.stats)
+
+    stats["conflict_rate"] = stats["conflicts"] / stats["groups"] if stats["groups"] else 0.0
+    summary_path = Path(args.out_jsonl).with_suffix(".summary.json")
+    write_json_atomic(summary_path, {"preds": args.preds, **stats})
+    print(f"[OK] wrote {args.out_jsonl}, {summary_path} groups={stats['groups']} conflicts={stats['conflicts']} "
+          f"(rows={stats['rows']}, checked={stats['checked']}, excepted={stats['excepted']}, spills={stats['spills']})")
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+from __future__ import annotations
+import argparse
+import pandas as pd
+from contrakg import metrics
+from contrakg.constraints import ConstraintIndex
+from contrakg.io_utils import open_row_writer
+from contrakg.profiles import DEFAULT_BY, KEYS, RESAMPLE, leakage_profiles, load_eval, pair_rows, profile_columns
+
+def _by(s: str):
+    cols = tuple(c.strip() for c in s.split(",") if c.strip() and c.strip() != "all")
+    bad = [c for c in cols if c not in KEYS]
+    if bad:
+        raise argparse.ArgumentTypeError(f"unknown column(s) {bad}; use {', '.join(KEYS)} or 'all'")
+    return cols
+
+def main():
+    ap = argparse.ArgumentParser(description="Constraint-wise leakage profiles (ITLR per pid / test_type / constraint "
+                                             "status) with bootstrap CIs from the per-example rows of step 5.")
+    ap.add_argument("--eval", required=True, help="per-example CSV or Parquet of 05 (contrast predictions); "
+                                                  "a paired file of 05 --orig_preds gives the deltas by itself")
+    ap.add_argument("--orig_eval", default=None, help="same for predictions on the original sentences: adds paired deltas")
+    ap.add_argument("--constraints", required=True)
+    ap.add_argument("--by", type=_by, action="append", default=None, metavar="COLS",
+                    help="grouping, comma-separated from pid,test_type,status or 'all'; repeatable "
+                         "(default: all, test_type, status, pid, pid+test_type, test_type+status)")
+    ap.add_argument("--n_boot", type=int, default=1000, help="bootstrap replicates; 0 skips the CIs")
+    ap.add_argument("--alpha", type=float, default=0.05, help="CIs are the alpha/2, 1-alpha/2 percentiles")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--resample", choices=RESAMPLE, default="rows",
+                    help="rows: resample the whole file (sampling uncertainty of each statistic); strata: keep every "
+                         "(pid, test_type) stratum at its size (CIs conditional on the strata)")
+    ap.add_argument("--min_valid", type=float, default=0.5,
+                    help="leave a CI empty when fewer than this fraction of the replicates define the statistic "
+                         "(a resample can leave a small group without output rows)")
+    ap.add_argument("--out_csv", required=True, help="one row per group (.parquet writes Parquet)")
+    metrics.add_arguments(ap)
+    args = ap.parse_args()
+    metrics.start(args, "07_leakage_profiles")
+
+    with metrics.stage("load_inputs") as st:
+        constraints = ConstraintIndex.load(args.constraints)
+        df = load_eval(args.eval, with_id=args.orig_eval is not None)
+        st.add(len(df))
+        join = None
+        if args.orig_eval is not None:
+            orig = load_eval(args.orig_eval, with_id=True)
+            st.add(len(orig))
+            df, join = pair_rows(df, orig)
+    paired = "orig_has_output" in df.columns
+    with metrics.stage("profiles", items=len(df)):
+        prof = leakage_profiles(df, constraints, by=args.by or DEFAULT_BY, n_boot=args.n_boot, alpha=args.alpha, seed=args.seed,
+                                resample=args.resample, min_valid=args.min_valid)
+    cols = profile_columns(paired, args.n_boot)
+    w = open_row_writer(args.out_csv, cols)
+    w.write_rows(prof[cols].astype(object).where(prof[cols].notna(), None).to_dict("records"))
+    w.close()
+
+    overall = prof[prof["by"] == "all"]
+    msg = f"[OK] wrote {args.out_csv} groups={len(prof)} rows={len(df)}"
+    if len(overall):
+        r = overall.iloc[0]
+        msg += f" ITLR={r['ITLR']:.4f}"
+        if args.n_boot and pd.notna(r["ITLR_lo"]):
+            msg += f" [{r['ITLR_lo']:.4f}, {r['ITLR_hi']:.4f}] ({args.resample} bootstrap, {r['n_boot_valid']} valid)"
+        if paired:
+            msg += f" delta_ITLR={r['delta_ITLR']:+.4f}"
+        if join is not None:
+            msg += f" (pairs={join['pairs']}, unmatched contrast={join['contrast_only']}, orig={join['orig_only']})"
+    print(msg)
+
+if __name__=="__main__":
+    main()
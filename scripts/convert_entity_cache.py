@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+from __future__ import annotations
+import argparse, json
+from pathlib import Path
+from contrakg import metrics
+from contrakg.entity_store import EntityStore, write_entity_store
+
+def main():
+    ap = argparse.ArgumentParser(description="Convert labels.json/types.json to a binary entity store and back.")
+    ap.add_argument("--labels", default=None, help="labels.json (to store) or output path (from store)")
+    ap.add_argument("--types", default=None, help="types.json (to store) or output path (from store)")
+    ap.add_argument("--store", required=True)
+    ap.add_argument("--to_json", action="store_true", help="read --store and write --labels/--types as JSON")
+    metrics.add_arguments(ap)
+    args = ap.parse_args()
+    metrics.start(args, "convert_entity_cache")
+
+    if args.to_json:
+        store = EntityStore(args.store)
+        for path, view in ((args.labels, store.labels), (args.types, store.types)):
+            if path:
+                Path(path).write_text(json.dumps(dict(view.items()), ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"[OK] wrote labels={args.labels}, types={args.types} from store={args.store} "
+              f"labels={len(store.labels)} types={len(store.types)}")
+        return
+    labels = json.loads(Path(args.labels).read_text(encoding="utf-8")) if args.labels else {}
+    types = json.loads(Path(args.types).read_text(encoding="utf-8")) if args.types else {}
+    with metrics.stage("write_store", items=len(labels)):
+        write_entity_store(args.store, labels, types)
+    print(f"[OK] wrote store={args.store} labels={len(labels)} types={len(types)}")
+
+if __name__=="__main__":
+    main()
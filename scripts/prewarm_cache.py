@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+from __future__ import annotations
+import argparse
+from pathlib import Path
+from contrakg import metrics
+from contrakg.constraints import ConstraintIndex
+from contrakg.contrast import TypePoolIndex
+from contrakg.entity_store import load_types
+from contrakg.hierarchy import ClassHierarchy
+from contrakg.io_utils import open_cache, read_jsonl, write_json_atomic
+from contrakg.prewarm import Prewarmer, import_bundle
+from contrakg.wikidata import WDQS, default_client
+
+def _warm(args):
+    client = default_client(args.cache_dir, args.sleep, max_workers=args.workers, endpoint=args.endpoint)
+    pw = Prewarmer(client, dry_run=args.dry_run)
+    constraints = ConstraintIndex.load(args.constraints) if args.constraints else None
+    # The oracle plan is exact only for the --types/--subclass the 05 run gets; "fetched" means
+    # the files this run's --examples / --with_subclass answers become (02 --out_types/--out_subclass).
+    if args.types == "fetched" and not args.examples:
+        raise SystemExit("--types fetched needs --examples")
+    if args.subclass == "fetched" and not (args.examples and args.with_subclass):
+        raise SystemExit("--subclass fetched needs --examples and --with_subclass")
+    types = load_types(args.types) if args.types and args.types != "fetched" else None
+    hierarchy = ClassHierarchy.load(args.subclass).precompute() if args.subclass and args.subclass != "fetched" else None
+
+    if args.pids:
+        pids = [l.strip().split()[0] for l in Path(args.pids).read_text(encoding="utf-8").splitlines()
+                if l.strip() and not l.strip().startswith("#")]
+        with metrics.stage("constraints", items=len(pids)):
+            fetched = pw.constraints(pids, batch_size=args.batch_size)
+        if constraints is None and fetched:
+            constraints = ConstraintIndex(fetched)
+    if args.examples:
+        with metrics.stage("entities"):
+            ent_types = pw.entities(read_jsonl(args.examples), chunk=args.chunk)
+        if args.with_subclass:
+            with metrics.stage("subclass"):
+                graph = pw.subclass({t for ts in ent_types.values() for t in ts}, chunk=args.chunk)
+            if args.subclass == "fetched":
+                hierarchy = ClassHierarchy(graph).precompute()
+        if args.types == "fetched":
+            types = ent_types
+    if constraints is not None and not args.no_pools:
+        stored = TypePoolIndex.load(args.pools) if args.pools and Path(args.pools).exists() else None
+        with metrics.stage("pools"):
+            pw.pools(constraints, per_class=args.per_class, batch_size=args.pool_batch, max_classes=args.max_classes,
+                     existing=stored)
+    if args.preds:
+        if constraints is None:
+            raise SystemExit("--preds needs --constraints (or --pids)")
+        for p in args.preds:
+            with metrics.stage("oracle"):
+                pw.oracle(read_jsonl(p), constraints, types=types, hierarchy=hierarchy, chunk_size=args.chunk_size,
+                          batch_size=args.oracle_batch)
+    client.close()
+
+    for stage, r in pw.report.items():
+        print(f"[OK] {stage}: planned={r['planned']} cached={r['cached']} missing={r['missing']} "
+              f"requests={r['requests']} failed={r['failed']}")
+    if args.report:
+        write_json_atomic(args.report, {"dry_run": args.dry_run, "stages": pw.report})
+    if args.export:
+        with metrics.stage("export", items=len(pw.keys)):
+            res = pw.export(args.export)
+        print(f"[OK] wrote bundle={args.export} entries={res['exported']} (not cached: {res['skipped']})")
+    if any(r["failed"] for r in pw.report.values()):
+        raise SystemExit("some queries failed; rerun to fetch them")
+
+def _import(args):
+    cache = open_cache(args.cache_dir)
+    n = 0
+    with metrics.stage("import") as st:
+        for b in args.bundle:
+            n += import_bundle(b, cache)
+        st.add(n)
+    print(f"[OK] imported {n} entries into {args.cache_dir}")
+
+def main():
+    ap = argparse.ArgumentParser(description="Fill the WDQS cache before a run, and move it between machines.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    w = sub.add_parser("warm", help="plan every query steps 01/02/03/05 will ask, fetch the ones not cached yet")
+    w.add_argument("--cache_dir", default=".cache_wdqs")
+    w.add_argument("--sleep", type=float, default=0.05)
+    w.add_argument("--workers", type=int, default=8)
+    w.add_argument("--endpoint", default=WDQS)
+    w.add_argument("--pids", default=None, help="01 input")
+    w.add_argument("--batch_size", type=int, default=50, help="PIDs per constraints query")
+    w.add_argument("--examples", default=None, help="02 input")
+    w.add_argument("--chunk", type=int, default=200, help="same as 02 --chunk")
+    w.add_argument("--with_subclass", action="store_true", help="also the P279 graph of 02 --out_subclass")
+    w.add_argument("--constraints", default=None, help="constraints.json; default: the --pids answers")
+    w.add_argument("--no_pools", action="store_true", help="skip the 03 type pools")
+    w.add_argument("--per_class", type=int, default=50, help="same as 03 --per_class")
+    w.add_argument("--pool_batch", type=int, default=20, help="same as 03 --pool_batch")
+    w.add_argument("--max_classes", type=int, default=None, help="same as 03 --max_classes")
+    w.add_argument("--pools", default=None, help="same as 03 --pools: classes already in it are not asked")
+    w.add_argument("--preds", nargs="+", default=None, help="04 outputs that 05 --use_oracle will score")
+    w.add_argument("--types", default=None,
+                   help="same as 05 --types: a file, 'fetched' for the --examples answers, or none for 05 without --types")
+    w.add_argument("--subclass", default=None,
+                   help="same as 05 --subclass: a file, 'fetched' for the --with_subclass graph, or none for 05 without it")
+    w.add_argument("--chunk_size", type=int, default=50_000)
+    w.add_argument("--oracle_batch", type=int, default=500, help="(entity, class) pairs per VALUES query")
+    w.add_argument("--dry_run", action="store_true", help="only count cached / missing queries")
+    w.add_argument("--export", default=None, help="write every planned key the cache holds to this bundle (.jsonl.gz)")
+    w.add_argument("--report", default=None, help="per-stage counts as JSON")
+    i = sub.add_parser("import", help="load bundles into a cache")
+    i.add_argument("--bundle", required=True, nargs="+")
+    i.add_argument("--cache_dir", default=".cache_wdqs")
+    for p in (w, i):
+        metrics.add_arguments(p)
+    args = ap.parse_args()
+    metrics.start(args, f"prewarm_cache.{args.cmd}")
+    (_warm if args.cmd == "warm" else _import)(args)
+
+if __name__=="__main__":
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+from __future__ import annotations
+import argparse, json, time
+from pathlib import Path
+from contrakg import metrics
+from contrakg.constraints import ConstraintIndex
+from contrakg.contrast import TypePoolIndex, constraint_classes
+from contrakg.entity_store import load_labels, load_types
+from contrakg.eval import EVAL_COLUMNS, LeakageSummary, TypeOracle
+from contrakg.hierarchy import ClassHierarchy
+from contrakg.io_utils import JsonlWriter, open_row_writer, read_jsonl
+from contrakg.predictors import BUILTIN
+from contrakg.streaming import StreamPipeline, generate_stage, pred_row, predict_stage, score_stage
+from contrakg.wikidata import WDQS, default_client
+
+def _parse_kv(items):
+    out = {}
+    for kv in items:
+        k, _, v = kv.partition("=")
+        try:
+            out[k] = json.loads(v)
+        except json.JSONDecodeError:
+            out[k] = v
+    return out
+
+def main():
+    ap = argparse.ArgumentParser(description="Steps 03 -> 04 -> 05 in one process: pairs and predictions stream "
+                                             "through bounded queues instead of files.")
+    ap.add_argument("--examples", required=True)
+    ap.add_argument("--constraints", required=True)
+    ap.add_argument("--labels", required=True, help="labels.json or an entity store (generation and predictors)")
+    ap.add_argument("--types", default=None, help="types.json or an entity store (predictors and scoring)")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--per_class", type=int, default=50)
+    ap.add_argument("--pools", default=None, help="persisted type-pool index; reused and extended across runs")
+    ap.add_argument("--max_classes", type=int, default=None)
+    ap.add_argument("--pool_batch", type=int, default=20)
+    ap.add_argument("--max_pairs", type=int, default=5000)
+    ap.add_argument("--predictor", default="copy_gold",
+                    help=f"built-in ({', '.join(BUILTIN)}), module:Class or entry point; several comma-separated "
+                         "need a {mode} placeholder in --out_csv")
+    ap.add_argument("--predictor_arg", action="append", default=[], metavar="KEY=VALUE")
+    ap.add_argument("--use_contrast", action="store_true")
+    ap.add_argument("--use_oracle", action="store_true")
+    ap.add_argument("--subclass", default=None, help="P279 graph from 02 --out_subclass; oracle answers locally first")
+    ap.add_argument("--engine", choices=["python", "vectorized"], default="python")
+    ap.add_argument("--cache_dir", default=".cache_wdqs")
+    ap.add_argument("--sleep", type=float, default=0.1)
+    ap.add_argument("--sparql_workers", type=int, default=4)
+    ap.add_argument("--endpoint", default=WDQS)
+    ap.add_argument("--offline", action="store_true", help="answer from --cache_dir only; a cache miss is an error")
+    ap.add_argument("--executor", choices=["thread", "process"], default="thread",
+                    help="where stage batches run: the stage's thread (or a thread pool), or forked worker processes")
+    ap.add_argument("--gen_workers", type=int, default=1,
+                    help=">1 switches to the per-example RNG of 03 --workers (pairs then match 03 --workers)")
+    ap.add_argument("--pred_workers", type=int, default=1)
+    ap.add_argument("--score_workers", type=int, default=1)
+    ap.add_argument("--gen_batch", type=int, default=64, help="examples per generation batch")
+    ap.add_argument("--batch_size", type=int, default=64, help="pairs per predictor batch (same as 04)")
+    ap.add_argument("--score_batch", type=int, default=2048, help="rows per scoring batch")
+    ap.add_argument("--queue_size", type=int, default=8, help="batches buffered between two stages")
+    ap.add_argument("--out_csv", required=True, help="per-example rows of 05 (.parquet writes Parquet) + .summary.csv")
+    ap.add_argument("--out_pairs", default=None, help="also write the pairs of 03")
+    ap.add_argument("--out_preds", default=None, help="also write the predictions of 04 ({mode} with several predictors)")
+    metrics.add_arguments(ap)
+    args = ap.parse_args()
+    metrics.start(args, "run_streaming")
+
+    specs = [m.strip() for m in args.predictor.split(",") if m.strip()]
+    for flag in ("out_csv", "out_preds"):
+        if len(specs) > 1 and getattr(args, flag) and "{mode}" not in getattr(args, flag):
+            ap.error(f"--{flag} needs a {{mode}} placeholder when several predictors are given")
+    kwargs = _parse_kv(args.predictor_arg)
+    with metrics.stage("load_inputs"):
+        constraints = ConstraintIndex.load(args.constraints)
+        labels = load_labels(args.labels)
+        types = load_types(args.types) if args.types else None
+        hierarchy = ClassHierarchy.load(args.subclass).precompute() if args.subclass else None
+    kwargs.setdefault("labels", labels)
+    if types is not None:
+        kwargs.setdefault("types", types)
+
+    seed_classes = constraint_classes(constraints)[:args.max_classes]
+    client = default_client(args.cache_dir, args.sleep, max_workers=args.sparql_workers, endpoint=args.endpoint,
+                            offline=args.offline)
+    with metrics.stage("type_pools", items=len(seed_classes)):
+        stored = TypePoolIndex.load(args.pools) if args.pools and Path(args.pools).exists() else None
+        type_pools = TypePoolIndex.build(seed_classes, client, per_class=args.per_class, batch_size=args.pool_batch,
+                                         existing=stored)
+        if args.pools:
+            (stored.merged(type_pools) if stored is not None and stored.per_class == args.per_class else type_pools).save(args.pools)
+        type_pools.precompute(constraints)
+    client.close()
+
+    oracle_factory = None
+    if args.use_oracle:
+        # Built where the score stage runs, so forked workers open their own cache connection.
+        def oracle_factory():
+            return TypeOracle(client=default_client(args.cache_dir, args.sleep, max_workers=args.sparql_workers,
+                                                    endpoint=args.endpoint, offline=args.offline),
+                              hierarchy=hierarchy, types=types)
+
+    stages = [generate_stage(constraints, labels, type_pools, args.seed, per_example_rng=args.gen_workers > 1,
+                             batch_size=args.gen_batch, workers=args.gen_workers, max_pairs=args.max_pairs),
+              predict_stage(specs, use_contrast=args.use_contrast, predictor_kwargs=kwargs, batch_size=args.batch_size,
+                            workers=args.pred_workers),
+              score_stage(constraints, types, oracle_factory, engine=args.engine, use_contrast=args.use_contrast,
+                          batch_size=args.score_batch, workers=args.score_workers)]
+    pipe = StreamPipeline(stages, executor=args.executor, queue_size=args.queue_size)
+
+    def path(p, s):
+        return p.replace("{mode}", s.replace(":", "_"))
+    csv_paths = {s: Path(path(args.out_csv, s)) for s in specs}
+    writers = {s: open_row_writer(p, EVAL_COLUMNS) for s, p in csv_paths.items()}
+    summaries = {s: LeakageSummary() for s in specs}
+    pair_w = JsonlWriter(args.out_pairs) if args.out_pairs else None
+    pred_ws = {s: JsonlWriter(path(args.out_preds, s)) for s in specs} if args.out_preds else {}
+
+    n, t0 = 0, time.perf_counter()
+    buf = []
+    def flush():
+        for k, s in enumerate(specs):
+            rows = [ev[k] for _, ev in buf]
+            for r in rows:
+                summaries[s].add(r)
+            writers[s].write_rows(rows)
+            if pred_ws:
+                pred_ws[s].write_rows([pred_row(pair, triples[k], args.use_contrast) for (pair, triples), _ in buf])
+        if pair_w is not None:
+            pair_w.write_rows([pair for (pair, _), _ in buf])
+        buf.clear()
+    with metrics.stage("stream") as st:
+        for item in pipe.run(read_jsonl(args.examples)):
+            buf.append(item)
+            n += 1
+            if len(buf) >= args.score_batch:
+                flush()
+        flush()
+        st.add(n)
+    wall = time.perf_counter() - t0
+    for w in [*writers.values(), *pred_ws.values()] + ([pair_w] if pair_w is not None else []):
+        w.close()
+
+    for name, s in pipe.stats.items():
+        for k, v in s.items():
+            metrics.incr(f"stream.{name}.{k}", v)
+        print(f"[OK] stage {name}: batches={s['batches']} in={s['items_in']} out={s['items_out']} "
+              f"busy={s['busy_s']:.2f}s starved={s['starved_s']:.2f}s blocked={s['blocked_s']:.2f}s")
+    for s in specs:
+        summary_path = csv_paths[s].with_suffix(".summary.csv")
+        sw = open_row_writer(summary_path, list(summaries[s].to_dict()))
+        sw.write_rows([summaries[s].to_dict()])
+        sw.close()
+        written = [str(csv_paths[s]), str(summary_path)] + ([path(args.out_preds, s)] if args.out_preds else [])
+        print(f"[OK] {s}: wrote {', '.join(written)} ITLR={summaries[s].to_dict()['ITLR']:.4f}")
+    if pair_w is not None:
+        print(f"[OK] wrote pairs={args.out_pairs}")
+    print(f"[OK] pairs={n} wall={wall:.2f}s throughput={n / wall if wall else 0.0:.1f} pairs/s")
+
+if __name__=="__main__":
+    main()